@@ -1,17 +1,125 @@
-import importlib
+import io
+import os
 import streamlit as st
 
-import docx_utils
+from preview import LARGE_DOCUMENT_CHARS, page_bounds, previous_page_start
 
-importlib.reload(docx_utils)
+# Set MARKDOWN_VIEWER_RELOAD=1 while editing the converter to reload it on every rerun
+DEV_RELOAD = os.environ.get("MARKDOWN_VIEWER_RELOAD") == "1"
 
-from docx_utils import convert_md_to_docx, get_docx_bytes
+DEFAULT_CONTENT = "# Welcome to Markdown Viewer\n\nEnter your markdown content here..."
 
 def replace_dollar_with_fullwidth(text):
     if not isinstance(text, str):
         return text
     return text.replace("$", "＄")
 
+@st.cache_resource
+def load_converter():
+    """Import the converter on first use and warm its default template."""
+    import docx_utils
+    docx_utils.load_template()
+    return docx_utils
+
+@st.cache_resource
+def load_initial_content():
+    """Read sample.md once per process for the initial text."""
+    try:
+        with open("sample.md", "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return DEFAULT_CONTENT
+    except Exception as e:
+        return f"# Error reading sample.md: {str(e)}\n\nEnter your markdown content here..."
+
+def reload_converter():
+    """Re-execute the converter modules and drop everything cached from them."""
+    import importlib
+    import sys
+    for name in ("docx_utils", "image_utils", "incremental_convert", "exporters",
+                 "conversion_cache", "scheduler", "deferred_export", "preview"):
+        if name in sys.modules:
+            importlib.reload(sys.modules[name])
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    st.session_state.pop("deferred_export", None)
+    st.session_state.pop("diagnostics", None)
+    st.session_state.pop("latest_parse", None)
+
+@st.cache_resource
+def get_conversion_cache():
+    """Process-wide DOCX cache shared by every session, backed by the on-disk cache."""
+    load_converter()
+    from conversion_cache import ConversionCache, default_disk_cache
+    return ConversionCache(store=default_disk_cache())
+
+def get_parser():
+    """Per-session parse of the latest text, shared by the export formats built from it.
+
+    Only one tree per session is kept. Download callables run without the
+    session, so they are handed this object rather than looking it up.
+    """
+    if "latest_parse" not in st.session_state:
+        load_converter()
+        from exporters import LatestParse
+        st.session_state.latest_parse = LatestParse()
+    return st.session_state.latest_parse
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_sections(user_text):
+    """Split the text into heading sections once per distinct input."""
+    from preview import split_sections
+    return split_sections(user_text)
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def prepare_section(digest, _text):
+    """Preview markdown for one section, keyed by its content digest only."""
+    return replace_dollar_with_fullwidth(_text)
+
+@st.cache_resource
+def get_scheduler():
+    """Process-wide limits on concurrent conversions, input size and run time."""
+    from scheduler import default_scheduler
+    return default_scheduler()
+
+def session_id():
+    """Identify the browser session so queued conversions are shared fairly."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "default"
+
+def get_deferred_export():
+    """Per-session background DOCX builder backed by the shared cache."""
+    if "deferred_export" not in st.session_state:
+        from deferred_export import DeferredExport
+        st.session_state.deferred_export = DeferredExport(
+            get_conversion_cache(), scheduler=get_scheduler(), session_id=session_id())
+    return st.session_state.deferred_export
+
+def deferred_docx(exporter):
+    """Wait for a session's background DOCX build when the download is clicked.
+
+    Raising, rather than returning empty bytes, makes the button report the
+    failure instead of saving an empty, invalid document.
+    """
+    data = exporter.result()
+    if data is None:
+        raise RuntimeError(exporter.error() or "Unable to generate Word document.")
+    return data
+
+def show_queue_wait():
+    """Tell the user when their last conversion had to wait for a free slot."""
+    waited = get_scheduler().last_wait.get(session_id(), 0.0)
+    if waited >= 0.1:
+        st.caption(f"Waited {waited:.1f} s in the conversion queue.")
+
+def display_load():
+    """Summarize conversions running and waiting across all sessions in the sidebar."""
+    load = get_scheduler().snapshot()
+    st.sidebar.caption(
+        f"Conversions: {load['running']}/{load['max_concurrent']} running, {load['queued']} queued"
+        f" (median wait {load['wait_median']:.1f} s)")
+
 def set_page_config():
     st.set_page_config(
         page_title="Markdown Viewer",
@@ -40,7 +148,122 @@ def display_header():
     with col2:
         st.title("MD Text Viewer & Converter")
 
+def _set_preview_section(index):
+    st.session_state.preview_section = index
+
+def display_sectioned_preview(user_text):
+    """Render one page of heading sections with an outline in the sidebar to jump between them."""
+    sections = get_sections(user_text)
+    if st.session_state.get("preview_section", 0) >= len(sections):
+        st.session_state.preview_section = 0
+    start = st.sidebar.selectbox(
+        "Outline",
+        range(len(sections)),
+        format_func=lambda i: "\u2003" * max(sections[i].level - 1, 0) + sections[i].title,
+        key="preview_section"
+    )
+    end = page_bounds(sections, start)
+
+    # Only this page is sent to the browser; unchanged sections reuse their cached text
+    for section in sections[start:end]:
+        st.markdown(prepare_section(section.digest, section.text))
+
+    col1, col2, col3 = st.columns([1, 4, 1])
+    col1.button("Previous", disabled=start == 0, on_click=_set_preview_section,
+                args=(previous_page_start(sections, start),))
+    col2.caption(f"Sections {start + 1}\u2013{end} of {len(sections)}")
+    col3.button("Next", disabled=end >= len(sections), on_click=_set_preview_section,
+                args=(min(end, len(sections) - 1),))
+
+def display_file_converter():
+    """Convert an uploaded markdown file to Word in chunks, without loading it into the editor."""
+    with st.expander("Convert a large file"):
+        upload = st.file_uploader("Markdown file", type=["md", "markdown", "txt"])
+        if upload is None:
+            return
+        cached = st.session_state.get("upload_docx")
+        if cached is None or cached[0] != upload.file_id:
+            if not st.button("Convert to Word"):
+                return
+            converter = load_converter()
+            from scheduler import ConversionLimitExceeded
+            output = io.BytesIO()
+            with st.spinner("Converting..."):
+                try:
+                    # Streaming keeps memory flat, so the size limit does not apply and
+                    # the time limit grows with the file
+                    scheduler = get_scheduler()
+                    time_limit = scheduler.time_limit
+                    if time_limit is not None:
+                        time_limit *= max(1.0, upload.size / scheduler.max_chars) if scheduler.max_chars else 1.0
+                    scheduler.run(
+                        session_id(),
+                        lambda cancel_event: converter.save_md_stream(upload, output, cancel_event=cancel_event),
+                        None, time_limit=time_limit)
+                    cached = (upload.file_id, output.getvalue(), None)
+                except ConversionLimitExceeded as e:
+                    cached = (upload.file_id, None, str(e))
+                except Exception as e:
+                    st.caption(f"{type(e).__name__}: {e}")
+                    cached = (upload.file_id, None, "Unable to generate Word document.")
+            st.session_state.upload_docx = cached
+        if cached[1]:
+            st.download_button(
+                label="Download as Word",
+                data=cached[1],
+                file_name=os.path.splitext(upload.name)[0] + ".docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key="upload_download"
+            )
+        else:
+            st.error(cached[2])
+
+def display_diagnostics(user_text):
+    """Show per-stage timings and document counts for the current text in the sidebar."""
+    with st.sidebar.expander("Conversion diagnostics"):
+        if not st.checkbox("Measure this document", key="diagnostics_enabled"):
+            return
+        profile = st.checkbox("Capture cProfile", key="diagnostics_profile")
+
+        converter = load_converter()
+        from conversion_cache import make_cache_key
+        from scheduler import ConversionLimitExceeded
+
+        # Re-measure only when the text or the profiling choice changes
+        key = (make_cache_key(user_text), profile)
+        cached = st.session_state.get("diagnostics")
+        if cached is not None and cached[0] == key:
+            metrics = cached[1]
+        else:
+            metrics = converter.ConversionMetrics(profile=profile)
+
+            def measure(cancel_event):
+                doc = converter.convert_md_to_docx(user_text, cancel_event=cancel_event, metrics=metrics)
+                if doc:
+                    converter.get_docx_bytes(doc, metrics=metrics)
+
+            try:
+                get_scheduler().run(session_id(), measure, len(user_text))
+            except ConversionLimitExceeded as e:
+                st.error(str(e))
+                return
+            st.session_state.diagnostics = (key, metrics)
+
+        st.metric("Conversion time", f"{metrics.total * 1000:.0f} ms")
+        st.dataframe(
+            {"Stage": list(metrics.stages), "ms": [round(s * 1000, 1) for s in metrics.stages.values()]},
+            hide_index=True
+        )
+        st.dataframe(
+            {"Count": list(metrics.counts), "Value": list(metrics.counts.values())},
+            hide_index=True
+        )
+        if profile:
+            st.code(metrics.profile_report(), language="text")
+
 def main():
+    if DEV_RELOAD:
+        reload_converter()
     set_page_config()
     add_custom_css()
     display_header()
@@ -60,30 +283,81 @@ def main():
         - Multiple spaces will be preserved in the output
         """)
     
-    # Read initial content from sample.md if available
-    initial_content = ""
-    try:
-        with open("sample.md", "r", encoding="utf-8") as f:
-            initial_content = f.read()
-    except FileNotFoundError:
-        initial_content = "# Welcome to Markdown Viewer\n\nEnter your markdown content here..."
-    except Exception as e:
-        initial_content = f"# Error reading sample.md: {str(e)}\n\nEnter your markdown content here..."
-
-    # Create a text area for user input
-    user_text = st.text_area("Enter MD text here:", value=initial_content, height=200)
+    # Create a text area for user input, starting from sample.md if available
+    user_text = st.text_area("Enter MD text here:", value=load_initial_content(), height=200)
+    display_file_converter()
     
     # Display the rendered markdown and add download button
     if user_text:
+        mode = st.sidebar.radio(
+            "Preview",
+            ["Auto", "Full", "Sectioned"],
+            horizontal=True,
+            help=f"Auto shows long documents (over {LARGE_DOCUMENT_CHARS:,} characters) a page of sections at a time."
+        )
+        sectioned = mode == "Sectioned" or (mode == "Auto" and len(user_text) > LARGE_DOCUMENT_CHARS)
         with st.container(border=True):
             st.subheader("Markdown Output:")
-            st.markdown(replace_dollar_with_fullwidth(user_text))
+            if sectioned:
+                display_sectioned_preview(user_text)
+            else:
+                st.markdown(replace_dollar_with_fullwidth(user_text))
         
-        # Add download buttons directly
-        # Convert to Word and offer download
-        doc = convert_md_to_docx(user_text)
-        if doc:
-            docx_data = get_docx_bytes(doc)
+        scheduler = get_scheduler()
+        parser = get_parser()
+        from scheduler import ConversionLimitExceeded
+        too_large = scheduler.max_chars is not None and len(user_text) > scheduler.max_chars
+        deferred = st.sidebar.toggle(
+            "Build Word file in background",
+            value=True,
+            help="Render the preview immediately and prepare the Word file once typing pauses."
+        )
+        if too_large:
+            get_deferred_export().cancel()
+            st.warning(
+                f"This document has {len(user_text):,} characters; Word, HTML and text exports are "
+                f"limited to {scheduler.max_chars:,}. Use **Convert a large file** to convert it in chunks.")
+        elif deferred:
+            # Build the DOCX off the critical path; the button waits for it if needed
+            exporter = get_deferred_export()
+            exporter.schedule(user_text)
+            # The callable runs on another thread, so it gets the exporter, not the session
+            data, error = lambda: deferred_docx(exporter), None
+            if exporter.status() == "ready":
+                # A finished job that produced nothing was cancelled, failed or hit a limit
+                data = exporter.result()
+                if data is None:
+                    error = exporter.error() or "Unable to generate Word document."
+                else:
+                    show_queue_wait()
+            else:
+                st.caption("Preparing Word file...")
+            if error:
+                st.error(error)
+            st.download_button(
+                label="Download as Word",
+                data=b"" if error else data,
+                file_name="document.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                disabled=bool(error)
+            )
+        else:
+            get_deferred_export().cancel()
+            # Convert to Word (cached by content hash) from the shared parse and offer download
+            # Parsing happens inside the slot too, and only on a cache miss
+            try:
+                docx_data = get_conversion_cache().get_or_convert(
+                    user_text,
+                    build=lambda text, cancel_event: scheduler.run(
+                        session_id(),
+                        lambda limited: load_converter().get_docx_bytes(
+                            parser.get(text).to_docx(cancel_event=limited)),
+                        len(text), cancel_event)
+                )
+                error = None if docx_data else "Unable to generate Word document."
+                show_queue_wait()
+            except ConversionLimitExceeded as e:
+                docx_data, error = None, str(e)
             if docx_data:
                 st.download_button(
                     label="Download as Word",
@@ -92,9 +366,7 @@ def main():
                     mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
                 )
             else:
-                st.error("Unable to prepare Word document for download.")
-        else:
-            st.error("Unable to generate Word document.")
+                st.error(error)
 
         st.download_button(
             label="Download as Markdown",
@@ -102,6 +374,28 @@ def main():
             file_name="document.md",
             mime="text/markdown"
         )
+
+        if not too_large:
+            # HTML and text are rendered from the cached parse only when clicked; the
+            # parse cannot be cancelled, so only the slot limit applies to it
+            sid = session_id()
+            st.download_button(
+                label="Download as HTML",
+                data=lambda: scheduler.run(sid, lambda _: parser.get(user_text).to_html(),
+                                           len(user_text)),
+                file_name="document.html",
+                mime="text/html"
+            )
+            st.download_button(
+                label="Download as Text",
+                data=lambda: scheduler.run(sid, lambda _: parser.get(user_text).to_text(),
+                                           len(user_text)),
+                file_name="document.txt",
+                mime="text/plain"
+            )
+
+            display_diagnostics(user_text)
+        display_load()
     
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Convert many Markdown files to Word documents in parallel, or merge them into one."""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import docx_utils
+
+# Conversion settings shared by every task in a worker process
+_worker_options = {}
+_worker_compression = 'default'
+
+
+def find_markdown_files(patterns, keep_order=False):
+    """Expand glob patterns and directories into a sorted list of markdown files.
+
+    With ``keep_order`` the files stay in the order of the patterns, each
+    pattern's matches sorted, and a file matched twice keeps its first place.
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.md')
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path):
+                found.setdefault(os.path.abspath(path), None)
+    return list(found) if keep_order else sorted(found)
+
+
+def output_path_for(source, base_dir, output_dir):
+    """Mirror a source file's location under base_dir into output_dir as .docx."""
+    relative = os.path.relpath(source, base_dir)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + '.docx')
+
+
+def is_up_to_date(source, target):
+    """Check whether target exists and is at least as new as source."""
+    try:
+        return os.path.getmtime(target) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def _init_worker(options, compression='default'):
+    """Load per-process converter state once, before any file is converted."""
+    global _worker_compression
+    _worker_options.update(options)
+    _worker_compression = compression
+    # Warm the template cache and this process's Markdown instance
+    docx_utils.load_template(options.get('template'))
+    docx_utils._get_markdown()
+
+
+def convert_file(source, target):
+    """Convert one markdown file, writing the .docx atomically.
+
+    Returns (source, target, seconds, error) where error is None on success.
+    """
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                # Converted chunk by chunk, so large files never sit in memory whole;
+                # relative image paths are resolved against the markdown file's folder
+                docx_utils.save_md_stream(source, f, image_dir=os.path.dirname(source),
+                                          compression=_worker_compression, **_worker_options)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return source, target, time.perf_counter() - start, None
+    except Exception as e:
+        return source, target, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def run_batch(sources, output_dir, workers=None, force=False, options=None, progress=None,
+              compression='default'):
+    """Convert sources into output_dir across a process pool.
+
+    Files whose output is newer than the source are skipped unless force is
+    set. ``compression`` is a docx_utils.COMPRESSION_MODES key. ``progress`` is called with (done, total, result) after each file.
+    Returns a dict with 'converted', 'skipped' and 'failed' lists.
+    """
+    options = options or {}
+    base_dir = os.path.commonpath([os.path.dirname(path) for path in sources]) if sources else '.'
+    tasks = []
+    skipped = []
+    for source in sources:
+        target = output_path_for(source, base_dir, output_dir)
+        if not force and is_up_to_date(source, target):
+            skipped.append((source, target))
+        else:
+            tasks.append((source, target))
+
+    converted = []
+    failed = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options, compression)) as pool:
+            futures = [pool.submit(convert_file, source, target) for source, target in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                (failed if result[3] else converted).append(result)
+                if progress:
+                    progress(done, len(tasks), result)
+    return {'converted': converted, 'skipped': skipped, 'failed': failed}
+
+
+def merge_files(sources, target, workers=None, options=None, compression='default'):
+    """Merge sources, in order, into one .docx written atomically to target.
+
+    ``options`` are passed to merge_export.merge_markdown. Returns the
+    ConversionMetrics of the merge.
+    """
+    import merge_export
+
+    metrics = docx_utils.ConversionMetrics()
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        doc = merge_export.merge_markdown(sources, workers=workers, metrics=metrics, **(options or {}))
+        with open(temp_path, 'wb') as f:
+            docx_utils.save_docx(doc, f, compression)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return metrics
+
+
+def _print_progress(done, total, result):
+    source, _, seconds, error = result
+    status = 'FAIL' if error else 'ok'
+    print(f"[{done}/{total}] {status:<4} {source} ({seconds:.2f}s)", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('inputs', nargs='+', help='Markdown files, directories or glob patterns')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('-o', '--output-dir', help='Directory for the .docx files')
+    output.add_argument('--merge', metavar='FILE',
+                        help='Merge the inputs, in the order given, into this one .docx')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--toc-levels', type=int, default=3,
+                        help='With --merge, heading levels in the table of contents (0 for none)')
+    parser.add_argument('--no-section-breaks', action='store_true',
+                        help='With --merge, do not start each file on a new page')
+    parser.add_argument('--force', action='store_true', help='Convert even if the output is up to date')
+    parser.add_argument('--template', help='.docx/.dotx template providing styles and page setup')
+    parser.add_argument('--engine', choices=docx_utils.ENGINES, default='soup', help='Conversion engine')
+    parser.add_argument('--compression', choices=docx_utils.COMPRESSION_MODES, default='default',
+                        help="Zip compression: 'stored' is fastest, 'max' is smallest")
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the summary')
+    args = parser.parse_args(argv)
+
+    sources = find_markdown_files(args.inputs, keep_order=bool(args.merge))
+    if not sources:
+        print("No markdown files matched.", file=sys.stderr)
+        return 1
+
+    options = {'engine': args.engine}
+    if args.template:
+        options['template'] = os.path.abspath(args.template)
+
+    if args.merge:
+        options.update(toc_levels=args.toc_levels, section_breaks=not args.no_section_breaks)
+        start = time.perf_counter()
+        try:
+            # The process emitting the document does not parse, so it is not counted as a worker
+            metrics = merge_files(sources, args.merge, max(args.workers - 1, 0), options, args.compression)
+        except Exception as e:
+            print(f"Merge failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+        print(f"Merged {len(sources)} files ({metrics.counts.get('headings', 0)} headings) into {args.merge} "
+              f"in {time.perf_counter() - start:.1f}s")
+        return 0
+
+    start = time.perf_counter()
+    results = run_batch(sources, args.output_dir, args.workers, args.force, options,
+                        None if args.quiet else _print_progress, args.compression)
+    elapsed = time.perf_counter() - start
+
+    converted, skipped, failed = results['converted'], results['skipped'], results['failed']
+    rate = len(converted) / elapsed if elapsed else 0.0
+    print(f"Converted {len(converted)}, skipped {len(skipped)} up to date, failed {len(failed)} "
+          f"in {elapsed:.1f}s ({rate:.1f} files/s)")
+    if failed:
+        print("\nErrors:", file=sys.stderr)
+        for source, _, _, error in failed:
+            print(f"  {source}: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""Performance benchmarks for the markdown to Word conversion pipeline."""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import re
+import time
+import tracemalloc
+import zipfile
+
+import lxml.html
+from bs4 import BeautifulSoup
+from docx import Document
+
+import docx_utils
+
+
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+          'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'labore', 'magna', 'aliqua')
+_EMOJI = ('\U0001F680', '\U0001F600', '\u2705', '\U0001F4BB', '\u2B50', '\U0001F525')
+
+
+def generate_markdown(seed=0, size=50_000, table_rows=10, table_cols=5, list_depth=3,
+                      link_density=0.05, emoji_density=0.01):
+    """Generate a reproducible synthetic markdown document of roughly ``size`` characters.
+
+    ``link_density`` and ``emoji_density`` are the probability that a word is
+    replaced by a bare URL / inline link or by an emoji. Headings, paragraphs,
+    nested lists (up to ``list_depth`` levels), tables of ``table_rows`` x
+    ``table_cols``, quotes and fenced code are mixed in fixed proportions.
+    """
+    rng = random.Random(seed)
+
+    def sentence(words=12):
+        out = []
+        for _ in range(words):
+            roll = rng.random()
+            if roll < link_density / 2:
+                out.append(f"https://example.com/{rng.choice(_WORDS)}/{rng.randrange(1000)}")
+            elif roll < link_density:
+                out.append(f"[{rng.choice(_WORDS)}](https://example.org/{rng.randrange(1000)})")
+            elif roll < link_density + emoji_density:
+                out.append(rng.choice(_EMOJI))
+            elif roll < link_density + emoji_density + 0.05:
+                out.append(f"**{rng.choice(_WORDS)}**")
+            elif roll < link_density + emoji_density + 0.08:
+                out.append(f"`{rng.choice(_WORDS)}()`")
+            else:
+                out.append(rng.choice(_WORDS))
+        return ' '.join(out) + '.'
+
+    def nested_list(depth, ordered):
+        lines = []
+        for index in range(rng.randint(2, 4)):
+            marker = f"{index + 1}." if ordered else '-'
+            lines.append(f"{'    ' * depth}{marker} {sentence(6)}")
+            if depth + 1 < list_depth and rng.random() < 0.5:
+                lines.extend(nested_list(depth + 1, ordered))
+        return lines
+
+    def table():
+        header = '| ' + ' | '.join(f"Column {c}" for c in range(table_cols)) + ' |'
+        rule = '|' + '---|' * table_cols
+        rows = [
+            '| ' + ' | '.join(
+                str(r) if c == 0 else f"Jan {r % 28 + 1}" if c % 3 == 1 else
+                str(rng.randrange(10_000)) if c % 3 == 2 else sentence(3)
+                for c in range(table_cols)
+            ) + ' |'
+            for r in range(table_rows)
+        ]
+        return '\n'.join([header, rule] + rows)
+
+    blocks = []
+    length = 0
+    section = 0
+    while length < size:
+        roll = rng.random()
+        if roll < 0.10:
+            section += 1
+            block = f"{'#' * rng.randint(1, 3)} Section {section}: {sentence(4)}"
+        elif roll < 0.50:
+            block = ' '.join(sentence() for _ in range(rng.randint(1, 4)))
+        elif roll < 0.70:
+            block = '\n'.join(nested_list(0, rng.random() < 0.4))
+        elif roll < 0.80 and table_rows and table_cols:
+            block = table()
+        elif roll < 0.88:
+            block = '> ' + sentence()
+        elif roll < 0.96:
+            block = "```python\ndef handler(event):\n    return event['id'] < 10\n```"
+        else:
+            block = '---'
+        blocks.append(block)
+        length += len(block) + 2
+    return '\n\n'.join(blocks)
+
+
+def measure(func, *args, **kwargs):
+    """Return (result, seconds, peak traced bytes) for func.
+
+    Timing and memory are taken from separate runs because tracemalloc
+    slows allocation-heavy code down considerably.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _soup_tree(content):
+    converter = docx_utils.get_default_converter()
+    return converter.parse_html(converter.markdown().convert(content))
+
+
+def _etree_tree(content):
+    return docx_utils._markdown_to_tree(docx_utils._get_markdown(), content)
+
+
+# Named corpora covering the document shapes the editors export
+CORPUS = {
+    'small': dict(size=5_000),
+    'medium': dict(size=100_000),
+    'large': dict(size=500_000),
+    'tables': dict(size=200_000, table_rows=200, table_cols=8),
+    'nested-lists': dict(size=100_000, list_depth=8),
+    'link-dense': dict(size=100_000, link_density=0.4),
+    'emoji-dense': dict(size=100_000, emoji_density=0.2),
+}
+
+
+def time_stages(md_content, engine='soup'):
+    """Run one conversion with metrics and return (seconds per stage, counts)."""
+    metrics = docx_utils.ConversionMetrics()
+    doc = docx_utils.convert_md_to_docx(md_content, engine=engine, metrics=metrics)
+    docx_utils.get_docx_bytes(doc, metrics=metrics)
+    return metrics.stages, metrics.counts
+
+
+def run_case(md_content, engine='soup', repeat=3):
+    """Benchmark one document: best-of-N stage times plus peak traced memory."""
+    best = {}
+    for _ in range(repeat):
+        stages, counts = time_stages(md_content, engine)
+        for name, seconds in stages.items():
+            best[name] = min(seconds, best.get(name, seconds))
+    tracemalloc.start()
+    try:
+        docx_utils.get_docx_bytes(docx_utils.convert_md_to_docx(md_content, engine=engine))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    total = sum(seconds for name, seconds in best.items() if name != 'tables')
+    return {'stages': best, 'total': total, 'peak_bytes': peak, **counts}
+
+
+def compare_results(baseline, current, threshold=0.10, min_seconds=0.005):
+    """Return a list of (case, metric, old, new, change) for slowdowns above threshold.
+
+    Metrics faster than ``min_seconds`` in the baseline are ignored because
+    their relative noise is too high to be meaningful.
+    """
+    regressions = []
+    for case, result in current['cases'].items():
+        old = baseline.get('cases', {}).get(case)
+        if old is None:
+            continue
+        metrics = [('total', old['total'], result['total'])]
+        metrics += [(f"stage:{name}", old['stages'].get(name), seconds)
+                    for name, seconds in result['stages'].items()]
+        for metric, old_value, new_value in metrics:
+            if not old_value or old_value < min_seconds:
+                continue
+            change = new_value / old_value - 1
+            if change > threshold:
+                regressions.append((case, metric, old_value, new_value, change))
+    return regressions
+
+
+def _report_regressions(regressions, threshold):
+    if not regressions:
+        print(f"No slowdowns above {threshold:.0%}.")
+        return 0
+    print(f"Slowdowns above {threshold:.0%}:")
+    for case, metric, old_value, new_value, change in regressions:
+        print(f"  {case:<14} {metric:<16} {old_value:>8.3f}s -> {new_value:>8.3f}s (+{change:.0%})")
+    return 1
+
+
+def bench_run(args):
+    """Run the synthetic corpus suite and write machine-readable results."""
+    cases = args.cases or list(CORPUS)
+    unknown = [case for case in cases if case not in CORPUS]
+    if unknown:
+        raise SystemExit(f"Unknown corpus cases: {', '.join(unknown)}")
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': args.engine,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'cases': {},
+    }
+    print(f"{'case':<14} {'chars':>9} {'total s':>9} {'peak MB':>9}  slowest stages")
+    for case in cases:
+        params = CORPUS[case]
+        md_content = generate_markdown(seed=args.seed, **params)
+        result = run_case(md_content, args.engine, args.repeat)
+        result['params'] = params
+        results['cases'][case] = result
+        slowest = sorted(result['stages'].items(), key=lambda item: -item[1])[:3]
+        print(f"{case:<14} {result['input_chars']:>9,} {result['total']:>9.3f} "
+              f"{result['peak_bytes'] / 2**20:>9.1f}  " +
+              ', '.join(f"{name} {seconds:.3f}" for name, seconds in slowest))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        return _report_regressions(compare_results(baseline, results, args.threshold), args.threshold)
+    return 0
+
+
+def bench_compare(args):
+    """Compare two result files and flag slowdowns above the threshold."""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    return _report_regressions(compare_results(baseline, current, args.threshold), args.threshold)
+
+
+def bench_engines(args):
+    """Compare the BeautifulSoup and element tree engines on a large input."""
+    content = docx_utils.sanitize_content_for_word(generate_markdown(args.seed, args.size))
+    print(f"Input: {len(content):,} characters")
+    print(f"{'engine':<8} {'stage':<8} {'seconds':>10} {'peak MB':>10}")
+    tree_builders = {'soup': _soup_tree, 'etree': _etree_tree}
+    for engine in docx_utils.ENGINES:
+        _, parse_time, parse_peak = measure(tree_builders[engine], content)
+        _, total_time, total_peak = measure(docx_utils.convert_md_to_docx, content, engine=engine)
+        print(f"{engine:<8} {'parse':<8} {parse_time:>10.3f} {parse_peak / 2**20:>10.1f}")
+        print(f"{engine:<8} {'convert':<8} {total_time:>10.3f} {total_peak / 2**20:>10.1f}")
+
+
+def build_table_html(rows, cols):
+    """Build an HTML table like the tables extension emits, with IDs, dates and numbers."""
+    header = ''.join(f'<th>Column {c}</th>' for c in range(cols))
+    body = ''.join(
+        '<tr>' + ''.join(
+            f'<td>{r}</td>' if c == 0 else f'<td>Jan {r % 28 + 1}</td>' if c % 3 == 1
+            else f'<td>{r * c}</td>' if c % 3 == 2 else f'<td>Row {r} note {c}</td>'
+            for c in range(cols)
+        ) + '</tr>'
+        for r in range(rows)
+    )
+    return f'<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>'
+
+
+def bench_tables(args):
+    """Time the table builder on large tables to check it stays linear in cells."""
+    print(f"{'rows':>8} {'cols':>5} {'cells':>9} {'seconds':>9} {'cells/s':>10}")
+    for rows in args.rows:
+        table = docx_utils._build_tree_node(lxml.html.fromstring(build_table_html(rows, args.cols)), None, False)
+        doc = Document()
+        _, elapsed, _ = measure(docx_utils._add_table_to_doc, doc, table)
+        cells = (rows + 1) * args.cols
+        print(f"{rows:>8} {args.cols:>5} {cells:>9} {elapsed:>9.3f} {cells / elapsed:>10,.0f}")
+
+
+def _legacy_sanitize(content):
+    """The multi-pass sanitizer TextSanitizer replaced, kept as a baseline."""
+    if not content:
+        return content
+    emoji_pattern = re.compile(
+        "["
+        "\U0001F600-\U0001F64F"
+        "\U0001F300-\U0001F5FF"
+        "\U0001F680-\U0001F6FF"
+        "\U0001F1E0-\U0001F1FF"
+        "\U00002500-\U00002BEF"
+        "\U00002702-\U000027B0"
+        "\U000024C2-\U0001F251"
+        "\U0001f926-\U0001f937"
+        "\U00010000-\U0010ffff"
+        "\u2640-\u2642"
+        "\u2600-\u2B55"
+        "\u200d"
+        "\u23cf"
+        "\u23e9"
+        "\u231a"
+        "\ufe0f"
+        "\u3030"
+        "]+", flags=re.UNICODE
+    )
+    content = emoji_pattern.sub(' ', content)
+    content = content.replace('\u2019', "'")
+    content = content.replace('\u2018', "'")
+    content = content.replace('\u201C', '"')
+    content = content.replace('\u201D', '"')
+    content = content.replace('\u2013', '-')
+    content = content.replace('\u2014', '--')
+    content = content.replace('\u2026', '...')
+    content = re.sub(r' {2,}', ' ', content)
+    content = re.sub(r'\n{3,}', '\n\n', content)
+    return content.strip()
+
+
+def build_unicode_text(size, seed=0):
+    """Build Unicode-heavy prose with emoji, smart punctuation and whitespace runs."""
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'straße', 'naïve', '東京', 'données']
+    extras = ['\u2019', '\u201C', '\u201D', '\u2013', '\u2014', '\u2026', '\U0001F680',
+              '\U0001F600\u200d\U0001F4BB', '\u2705', '  ', '\n\n\n']
+    parts = []
+    length = 0
+    while length < size:
+        token = rng.choice(extras) if rng.random() < 0.15 else rng.choice(words)
+        parts.append(token)
+        parts.append(' ')
+        length += len(token) + 1
+    return ''.join(parts)[:size]
+
+
+def bench_sanitize(args):
+    """Compare the single-pass sanitizer with the legacy multi-pass version."""
+    print(f"{'chars':>10} {'legacy s':>10} {'legacy MB':>10} {'new s':>10} {'new MB':>10} {'speedup':>8}")
+    for size in args.sizes:
+        text = build_unicode_text(size)
+        legacy, legacy_time, legacy_peak = measure(_legacy_sanitize, text)
+        current, new_time, new_peak = measure(docx_utils.sanitize_content_for_word, text)
+        if legacy != current:
+            raise SystemExit(f"Sanitizer output differs from the legacy version at {size} characters")
+        print(f"{size:>10,} {legacy_time:>10.3f} {legacy_peak / 2**20:>10.1f} "
+              f"{new_time:>10.3f} {new_peak / 2**20:>10.1f} {legacy_time / new_time:>7.1f}x")
+
+
+def _legacy_docx_bytes(doc):
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def bench_save(args):
+    """Compare python-docx's save with streaming save_docx at each compression mode."""
+    md_content = generate_markdown(args.seed, args.size, table_rows=args.table_rows, table_cols=8)
+    doc = docx_utils.convert_md_to_docx(md_content, engine='etree')
+    print(f"{'mode':>10} {'seconds':>9} {'peak MB':>9} {'size MB':>9}")
+    runs = [('doc.save', _legacy_docx_bytes, ())]
+    runs += [(mode, docx_utils.get_docx_bytes, (None, mode)) for mode in docx_utils.COMPRESSION_MODES]
+    for name, func, extra in runs:
+        data, elapsed, peak = measure(func, doc, *extra)
+        print(f"{name:>10} {elapsed:>9.3f} {peak / 2**20:>9.1f} {len(data) / 2**20:>9.2f}")
+
+
+def build_inline_text(paragraphs, seed=0):
+    """Build link-heavy markdown whose paragraphs mix line breaks, entities, spans and bare URLs."""
+    rng = random.Random(seed)
+    blocks = []
+    for index in range(paragraphs):
+        lines = []
+        for _ in range(rng.randint(2, 5)):
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 10))]
+            words.insert(rng.randrange(len(words)), f"https://example.com/{rng.choice(_WORDS)}/{index}.")
+            words.insert(rng.randrange(len(words)), rng.choice(('AT&amp;T', '&copy;', '<span>inline</span>')))
+            lines.append(' '.join(words))
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def bench_inline(args):
+    """Report run counts, document.xml size and emit time for link-heavy documents."""
+    cases = {
+        'link-dense': generate_markdown(args.seed, args.size, **{
+            key: value for key, value in CORPUS['link-dense'].items() if key != 'size'}),
+        'inline-mixed': build_inline_text(args.size // 400, args.seed),
+    }
+    print(f"{'case':<14} {'paragraphs':>10} {'runs':>8} {'links':>7} {'runs/para':>9} "
+          f"{'xml KB':>8} {'emit s':>8}")
+    for case, md_content in cases.items():
+        stages, counts = time_stages(md_content)
+        doc = docx_utils.convert_md_to_docx(md_content)
+        with zipfile.ZipFile(io.BytesIO(docx_utils.get_docx_bytes(doc))) as archive:
+            xml_size = archive.getinfo('word/document.xml').file_size
+        print(f"{case:<14} {counts['paragraphs']:>10} {counts['runs']:>8} {counts['hyperlinks']:>7} "
+              f"{counts['runs'] / max(counts['paragraphs'], 1):>9.2f} {xml_size / 1024:>8.0f} "
+              f"{stages['emit']:>8.3f}")
+
+
+def bench_exports(args):
+    """Time one shared parse plus per-format emits against parsing once per format."""
+    from exporters import ParsedDocument
+
+    md_content = generate_markdown(args.seed, args.size)
+    start = time.perf_counter()
+    parsed = ParsedDocument(md_content, args.engine)
+    parse_time = time.perf_counter() - start
+    emitters = {
+        'docx': lambda document: docx_utils.get_docx_bytes(document.to_docx()),
+        'html': lambda document: document.to_html(),
+        'text': lambda document: document.to_text(),
+    }
+    print(f"parse once: {parse_time:.3f}s")
+    print(f"{'format':<8} {'emit s':>8} {'reparse s':>10}")
+    shared = separate = 0.0
+    for name, emit in emitters.items():
+        start = time.perf_counter()
+        emit(parsed)
+        emit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        emit(ParsedDocument(md_content, args.engine))
+        reparse_time = time.perf_counter() - start
+        shared += emit_time
+        separate += reparse_time
+        print(f"{name:<8} {emit_time:>8.3f} {reparse_time:>10.3f}")
+    print(f"all formats: {parse_time + shared:.3f}s shared parse, {separate:.3f}s parsing per format")
+
+
+_IMPORT_PROBE = (
+    "import sys, time\n"
+    "import streamlit\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "print(time.perf_counter() - start, int(any(name in sys.modules for name in ('docx', 'bs4', 'markdown'))))\n"
+)
+
+
+def bench_startup(args):
+    """Time importing the app in a fresh interpreter and rerunning it, with and without converter reloads."""
+    from streamlit.testing.v1 import AppTest
+
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    imports = []
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_PROBE], cwd=app_dir, capture_output=True,
+                                text=True, check=True).stdout.split()
+        imports.append(float(output[0]))
+    heavy = 'loaded' if output[1] == '1' else 'deferred'
+    print(f"import app: {statistics.median(imports) * 1000:.0f} ms (converter imports {heavy})")
+
+    print(f"{'reload':>8} {'first run ms':>13} {'rerun ms':>9}")
+    for reload in (False, True):
+        os.environ['MARKDOWN_VIEWER_RELOAD'] = '1' if reload else '0'
+        try:
+            app = AppTest.from_file(os.path.join(app_dir, 'app.py'), default_timeout=60)
+            start = time.perf_counter()
+            app.run()
+            first = time.perf_counter() - start
+            reruns = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                app.run()
+                reruns.append(time.perf_counter() - start)
+        finally:
+            os.environ.pop('MARKDOWN_VIEWER_RELOAD', None)
+        print(f"{'on' if reload else 'off':>8} {first * 1000:>13.0f} {statistics.median(reruns) * 1000:>9.0f}")
+
+
+_STREAM_PROBE = (
+    "import resource, sys, time\n"
+    "import docx_utils\n"
+    "mode, source, target = sys.argv[1:]\n"
+    "start = time.perf_counter()\n"
+    "if mode == 'stream':\n"
+    "    docx_utils.save_md_stream(source, target)\n"
+    "else:\n"
+    "    with open(source, encoding='utf-8') as f:\n"
+    "        docx_utils.save_docx(docx_utils.convert_md_to_docx(f.read()), target)\n"
+    "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+)
+
+
+def bench_stream(args):
+    """Compare peak RSS and time of whole-string and streaming conversion of generated files."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'input MB':>9} {'mode':>7} {'seconds':>9} {'peak RSS MB':>12} {'RSS/input':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'input.md')
+        target = os.path.join(directory, 'output.docx')
+        for size_mb in args.sizes:
+            # Repeat one generated megabyte so large inputs are quick to build
+            with open(source, 'w', encoding='utf-8') as f:
+                block = generate_markdown(args.seed, 2**20)
+                for _ in range(max(1, round(size_mb))):
+                    f.write(block + '\n\n')
+            input_mb = os.path.getsize(source) / 2**20
+            for mode in ('full', 'stream'):
+                if mode == 'full' and size_mb > args.full_limit:
+                    print(f"{input_mb:>9.1f} {mode:>7} {'skipped (over --full-limit)':>33}")
+                    continue
+                output = subprocess.run([sys.executable, '-c', _STREAM_PROBE, mode, source, target],
+                                        cwd=app_dir, capture_output=True, text=True, check=True).stdout.split()
+                seconds, rss_mb = float(output[0]), int(output[1]) / 1024
+                print(f"{input_mb:>9.1f} {mode:>7} {seconds:>9.1f} {rss_mb:>12.0f} {rss_mb / input_mb:>10.1f}")
+
+
+def bench_merge(args):
+    """Time merging generated chapters into one document, per chapter, against one concatenated string."""
+    import merge_export
+
+    print(f"{'chapters':>9} {'mode':>7} {'seconds':>9} {'ms/chapter':>11}")
+    for count in args.chapters:
+        chapters = [(f'{number:03}.md', generate_markdown(args.seed + number, args.chapter_size))
+                    for number in range(count)]
+        modes = {
+            'merge': lambda: merge_export.merge_markdown(chapters, workers=args.workers),
+            'concat': lambda: docx_utils.convert_md_to_docx('\n\n'.join(text for _, text in chapters)),
+        }
+        for mode, func in modes.items():
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            print(f"{count:>9} {mode:>7} {elapsed:>9.2f} {elapsed * 1000 / count:>11.1f}")
+
+
+def _legacy_parse(content):
+    """Parse the way convert_md_to_docx did before converters: a new Markdown object and html.parser per call."""
+    import markdown
+
+    html = markdown.markdown(docx_utils.sanitize_content_for_word(content), extensions=docx_utils.MARKDOWN_EXTENSIONS)
+    root = BeautifulSoup(html, 'html.parser')
+    docx_utils._linkify_plain_urls(root)
+    return root
+
+
+def bench_overhead(args):
+    """Time parsing many documents with a new Markdown object per call against reused converters."""
+    modes = {'legacy': _legacy_parse}
+    for html_parser in docx_utils.HTML_PARSERS:
+        try:
+            converter = docx_utils.MarkdownConverter(html_parser=html_parser)
+        except ValueError:
+            continue
+        modes[f'reuse {html_parser}'] = converter.parse
+    print(f"{'size':>8} {'mode':<18} {'ms/doc':>8} {'docs/s':>8}")
+    for size in args.sizes:
+        documents = [generate_markdown(args.seed + number, size) for number in range(args.documents)]
+        for mode, parse in modes.items():
+            parse(documents[0])
+            start = time.perf_counter()
+            for document in documents:
+                parse(document)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>8} {mode:<18} {elapsed * 1000 / len(documents):>8.2f} "
+                  f"{len(documents) / elapsed:>8.1f}")
+
+
+def build_outline(items, depth=6, seed=0):
+    """Build a runbook-style outline of bulleted and numbered items drifting between nesting levels."""
+    rng = random.Random(seed)
+    lines = []
+    level = 0
+    for number in range(items):
+        level = max(0, min(depth - 1, level + rng.choice((-1, 0, 1))))
+        marker = '1.' if level % 2 else '-'
+        lines.append(f"{'    ' * level}{marker} Step {number}: {rng.choice(_WORDS)} **{rng.choice(_WORDS)}** `{rng.choice(_WORDS)}`")
+    return '\n'.join(lines) + '\n'
+
+
+def bench_outline(args):
+    """Time converting nested outlines of increasing length; a linear emitter keeps ms/item flat."""
+    print(f"{'items':>8} {'emit s':>8} {'total s':>8} {'ms/item':>8} {'lists':>7}")
+    for items in args.items:
+        metrics = docx_utils.ConversionMetrics()
+        start = time.perf_counter()
+        doc = docx_utils.convert_md_to_docx(build_outline(items, args.depth, args.seed), metrics=metrics)
+        elapsed = time.perf_counter() - start
+        lists = len(doc.part.numbering_part.element.xpath('./w:num'))
+        print(f"{items:>8} {metrics.stages['emit']:>8.2f} {elapsed:>8.2f} "
+              f"{metrics.stages['emit'] * 1000 / items:>8.3f} {lists:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help=bench_run.__doc__)
+    run.add_argument('cases', nargs='*', metavar='case', help=f"Corpus cases to run: {', '.join(CORPUS)} (default: all)")
+    run.add_argument('--engine', choices=docx_utils.ENGINES, default='soup', help='Conversion engine')
+    run.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    run.add_argument('--repeat', type=int, default=3, help='Runs per case; the best time per stage is kept')
+    run.add_argument('-o', '--output', help='Write results as JSON to this file')
+    run.add_argument('--baseline', help='Compare against a previous results file')
+    run.add_argument('--threshold', type=float, default=0.10, help='Relative slowdown to flag (default: 0.10)')
+    run.set_defaults(func=bench_run)
+
+    compare = subparsers.add_parser('compare', help=bench_compare.__doc__)
+    compare.add_argument('baseline', help='Baseline results file')
+    compare.add_argument('current', help='Current results file')
+    compare.add_argument('--threshold', type=float, default=0.10, help='Relative slowdown to flag (default: 0.10)')
+    compare.set_defaults(func=bench_compare)
+
+    engines = subparsers.add_parser('engines', help=bench_engines.__doc__)
+    engines.add_argument('--size', type=int, default=100_000, help='Approximate input size in characters')
+    engines.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    engines.set_defaults(func=bench_engines)
+
+    tables = subparsers.add_parser('tables', help=bench_tables.__doc__)
+    tables.add_argument('--rows', type=int, nargs='+', default=[2500, 5000, 10000, 20000],
+                        help='Row counts to benchmark')
+    tables.add_argument('--cols', type=int, default=8, help='Number of columns')
+    tables.set_defaults(func=bench_tables)
+
+    sanitize = subparsers.add_parser('sanitize', help=bench_sanitize.__doc__)
+    sanitize.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000],
+                          help='Input sizes in characters')
+    sanitize.set_defaults(func=bench_sanitize)
+
+    inline = subparsers.add_parser('inline', help=bench_inline.__doc__)
+    inline.add_argument('--size', type=int, default=200_000, help='Approximate input size in characters')
+    inline.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    inline.set_defaults(func=bench_inline)
+
+    exports = subparsers.add_parser('exports', help=bench_exports.__doc__)
+    exports.add_argument('--size', type=int, default=200_000, help='Approximate input size in characters')
+    exports.add_argument('--engine', choices=docx_utils.ENGINES, default='soup', help='Parsing engine')
+    exports.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    exports.set_defaults(func=bench_exports)
+
+    save = subparsers.add_parser('save', help=bench_save.__doc__)
+    save.add_argument('--size', type=int, default=1_000_000, help='Approximate input size in characters')
+    save.add_argument('--table-rows', type=int, default=200, help='Rows per generated table')
+    save.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    save.set_defaults(func=bench_save)
+
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument('--repeat', type=int, default=5, help='Fresh imports and reruns to time')
+    startup.set_defaults(func=bench_startup)
+
+    stream = subparsers.add_parser('stream', help=bench_stream.__doc__)
+    stream.add_argument('--sizes', type=float, nargs='+', default=[1, 5, 50], help='Input sizes in MB')
+    stream.add_argument('--full-limit', type=float, default=10,
+                        help='Largest size in MB also converted as one string (default: 10)')
+    stream.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    stream.set_defaults(func=bench_stream)
+
+    merge = subparsers.add_parser('merge', help=bench_merge.__doc__)
+    merge.add_argument('--chapters', type=int, nargs='+', default=[10, 20, 40, 80],
+                       help='Numbers of chapters to merge')
+    merge.add_argument('--chapter-size', type=int, default=20_000, help='Characters per chapter')
+    merge.add_argument('--workers', type=int, help='Parser processes (default: CPUs - 1)')
+    merge.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    merge.set_defaults(func=bench_merge)
+
+    overhead = subparsers.add_parser('overhead', help=bench_overhead.__doc__)
+    overhead.add_argument('--sizes', type=int, nargs='+', default=[2_000, 50_000],
+                          help='Characters per document')
+    overhead.add_argument('--documents', type=int, default=50, help='Documents parsed per size and mode')
+    overhead.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    overhead.set_defaults(func=bench_overhead)
+
+    outline = subparsers.add_parser('outline', help=bench_outline.__doc__)
+    outline.add_argument('--items', type=int, nargs='+', default=[2_500, 5_000, 10_000],
+                         help='List items per outline')
+    outline.add_argument('--depth', type=int, default=6, help='Deepest nesting level')
+    outline.add_argument('--seed', type=int, default=0, help='Generator seed')
+    outline.set_defaults(func=bench_outline)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    """Thread-safe LRU cache of byte strings bounded by total payload size.
+
+    Shared by the DOCX conversion cache and the processed image cache.
+    ``get`` counts hits and misses; subclasses that track them differently
+    use ``_lookup`` under ``_lock`` instead.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Total number of cached payload bytes."""
+        return self._size
+
+    def _lookup(self, key):
+        # Caller holds _lock
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def get(self, key):
+        """Return cached bytes for a key and mark them as recently used."""
+        with self._lock:
+            data = self._lookup(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """Store bytes for a key, evicting least recently used entries as needed."""
+        if data is None or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,310 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import docx
+import docx_utils
+from byte_cache import ByteLRUCache
+
+# Default byte budget for cached DOCX payloads (64 MB)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Defaults for the persistent cache: location, size cap (512 MB) and entry lifetime (7 days)
+DEFAULT_DISK_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'markdown_viewer')
+DEFAULT_DISK_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_DISK_CACHE_TTL = 7 * 24 * 3600
+
+
+def make_cache_key(md_content, options=None):
+    """Build a content-addressed cache key from markdown text, conversion options and converter version.
+
+    A template option also contributes the template file's modification time,
+    so editing the template invalidates documents built from it, and a
+    converter option contributes its settings rather than its identity.
+    """
+    options = dict(options or {})
+    if options.get('converter') is not None:
+        options['converter'] = options['converter'].options
+    options['converter_version'] = (docx_utils.CONVERTER_VERSION, docx.__version__)
+    if options.get('template'):
+        try:
+            options['template_mtime'] = os.path.getmtime(options['template'])
+        except OSError:
+            pass
+    digest = hashlib.sha256(md_content.encode('utf-8'))
+    for name, value in sorted(options.items()):
+        digest.update(f'\0{name}={value!r}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ConversionCache(ByteLRUCache):
+    """Thread-safe LRU cache of DOCX bytes bounded by total payload size.
+
+    An optional ``store`` (such as a DiskConversionCache) is consulted on a
+    miss before converting and receives every new conversion. Hits and
+    misses count ``get_or_convert`` calls only.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, store=None):
+        super().__init__(max_bytes)
+        self.store = store
+        self._in_flight = {}
+
+    def get(self, key):
+        """Return cached bytes for a key and mark them as recently used."""
+        with self._lock:
+            return self._lookup(key)
+
+    def get_or_convert(self, md_content, cancel_event=None, build=None, **options):
+        """Return DOCX bytes for markdown content, converting at most once per key.
+
+        ``cancel_event`` is forwarded to the converter and is not part of the key.
+        ``build(md_content, cancel_event)`` replaces the default full conversion
+        when given; it must return DOCX bytes or None.
+        """
+        key = make_cache_key(md_content, options)
+        while True:
+            with self._lock:
+                data = self._lookup(key)
+                if data is not None:
+                    self.hits += 1
+                    return data
+                pending = self._in_flight.get(key)
+                if pending is None:
+                    # This thread owns the conversion for the key
+                    pending = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another session is converting the same document; wait for it
+            # and look again (retrying ourselves if that conversion failed)
+            pending.wait()
+
+        try:
+            data = self.store.get(key) if self.store is not None else None
+            if data is None:
+                if build is not None:
+                    data = build(md_content, cancel_event)
+                else:
+                    doc = docx_utils.convert_md_to_docx(md_content, cancel_event=cancel_event, **options)
+                    data = docx_utils.get_docx_bytes(doc) if doc else None
+                if self.store is not None:
+                    self.store.put(key, data)
+            self.put(key, data)
+            return data
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            pending.set()
+
+
+class DiskConversionCache:
+    """DOCX bytes persisted in a SQLite file, shared by every process on the host.
+
+    Entries are evicted least recently used first once the total payload
+    exceeds ``max_bytes`` and expire ``ttl`` seconds after they were
+    written. SQLite's locking (in WAL mode) makes concurrent readers and
+    writers in several processes safe. Storage errors are treated as misses
+    so a broken cache never breaks a conversion.
+    """
+
+    def __init__(self, directory=DEFAULT_DISK_CACHE_DIR, max_bytes=DEFAULT_DISK_CACHE_BYTES,
+                 ttl=DEFAULT_DISK_CACHE_TTL):
+        self.directory = directory
+        self.path = os.path.join(directory, 'docx_cache.sqlite3')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                'size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _connection(self):
+        # One connection per thread; SQLite connections must not be shared across threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        """Total number of cached payload bytes."""
+        return self._connection().execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        """Return cached bytes for a key, or None if missing or expired."""
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                row = connection.execute('SELECT data FROM entries WHERE key = ? AND created >= ?',
+                                         (key, now - self.ttl)).fetchone()
+                if row is not None:
+                    connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytes(row[0])
+
+    def put(self, key, data):
+        """Store bytes for a key, then drop expired and least recently used entries over the cap."""
+        if data is None or len(data) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                   (key, sqlite3.Binary(data), len(data), now, now))
+                self._evict(connection, now)
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        """Apply the TTL and size cap now; returns the number of entries removed."""
+        with self._connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return self._evict(connection, time.time())
+
+    def _evict(self, connection, now):
+        removed = connection.execute('DELETE FROM entries WHERE created < ?', (now - self.ttl,)).rowcount
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return removed
+        stale = []
+        for key, size in connection.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM entries WHERE key = ?', stale)
+        return removed + len(stale)
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._connection() as connection:
+            connection.execute('DELETE FROM entries')
+
+
+def _environment_limits():
+    """Return the (size cap in MB, lifetime in seconds) set by the environment or the defaults."""
+    max_mb = int(os.environ.get('MARKDOWN_VIEWER_CACHE_MB', DEFAULT_DISK_CACHE_BYTES // 2**20))
+    ttl = float(os.environ.get('MARKDOWN_VIEWER_CACHE_TTL', DEFAULT_DISK_CACHE_TTL))
+    return max_mb, ttl
+
+
+def default_disk_cache():
+    """Return the persistent cache configured by the environment, or None if disabled.
+
+    MARKDOWN_VIEWER_CACHE_DIR sets the directory (an empty value disables the
+    cache), MARKDOWN_VIEWER_CACHE_MB the size cap and MARKDOWN_VIEWER_CACHE_TTL
+    the lifetime in seconds.
+    """
+    directory = os.environ.get('MARKDOWN_VIEWER_CACHE_DIR', DEFAULT_DISK_CACHE_DIR)
+    if not directory:
+        return None
+    max_mb, ttl = _environment_limits()
+    max_bytes = max_mb * 2**20
+    try:
+        return DiskConversionCache(directory, max_bytes, ttl)
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def _convert_for_cache(source, options):
+    """Read and convert one markdown file; returns (source, key, bytes or None)."""
+    with open(source, 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    doc = docx_utils.convert_md_to_docx(md_content, **options)
+    return source, make_cache_key(md_content, options), docx_utils.get_docx_bytes(doc) if doc else None
+
+
+def warm_cache(cache, sources, options=None, workers=None, force=False):
+    """Convert markdown files into the disk cache; returns (converted, already cached, failed) counts."""
+    options = options or {}
+    todo = []
+    seen = set()
+    cached = 0
+    for source in sources:
+        with open(source, 'r', encoding='utf-8') as f:
+            key = make_cache_key(f.read(), options)
+        if key in seen or (not force and cache.get(key) is not None):
+            cached += 1
+        else:
+            todo.append(source)
+        seen.add(key)
+    converted = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for source, key, data in pool.map(_convert_for_cache, todo, [options] * len(todo)):
+            if data is None:
+                failed += 1
+                print(f"  failed: {source}", file=sys.stderr)
+                continue
+            cache.put(key, data)
+            converted += 1
+    return converted, cached, failed
+
+
+def main(argv=None):
+    from batch_convert import find_markdown_files
+
+    max_mb, ttl = _environment_limits()
+    parser = argparse.ArgumentParser(description="Manage the persistent DOCX conversion cache.")
+    parser.add_argument('--cache-dir', default=os.environ.get('MARKDOWN_VIEWER_CACHE_DIR', DEFAULT_DISK_CACHE_DIR),
+                        help='Cache directory (default: $MARKDOWN_VIEWER_CACHE_DIR or ~/.cache/markdown_viewer)')
+    parser.add_argument('--max-mb', type=int, default=max_mb,
+                        help=f'Size cap in MB (default: $MARKDOWN_VIEWER_CACHE_MB or {max_mb})')
+    parser.add_argument('--ttl', type=float, default=ttl,
+                        help=f'Entry lifetime in seconds (default: $MARKDOWN_VIEWER_CACHE_TTL or {ttl:g})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    warm = subparsers.add_parser('warm', help='Pre-populate the cache from markdown files')
+    warm.add_argument('inputs', nargs='+', help='Markdown files, directories or glob patterns')
+    warm.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    warm.add_argument('--engine', choices=docx_utils.ENGINES, help='Conversion engine')
+    warm.add_argument('--template', help='.docx/.dotx template providing styles and page setup')
+    warm.add_argument('--force', action='store_true', help='Convert even if already cached')
+    subparsers.add_parser('stats', help='Show entry count and size')
+    subparsers.add_parser('evict', help='Apply the TTL and size cap now')
+    subparsers.add_parser('clear', help='Remove every entry')
+    args = parser.parse_args(argv)
+
+    cache = DiskConversionCache(args.cache_dir, args.max_mb * 2**20, args.ttl)
+    if args.command == 'warm':
+        sources = find_markdown_files(args.inputs)
+        options = {}
+        if args.engine:
+            options['engine'] = args.engine
+        if args.template:
+            options['template'] = os.path.abspath(args.template)
+        start = time.perf_counter()
+        converted, cached, failed = warm_cache(cache, sources, options, args.workers, args.force)
+        print(f"Converted {converted}, already cached {cached}, failed {failed} "
+              f"in {time.perf_counter() - start:.1f}s")
+        return 1 if failed else 0
+    if args.command == 'evict':
+        print(f"Removed {cache.evict()} entries")
+    elif args.command == 'clear':
+        cache.clear()
+    print(f"{len(cache)} entries, {cache.size / 2**20:.1f} MB in {cache.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
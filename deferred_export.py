@@ -0,0 +1,131 @@
+import threading
+
+from docx_utils import ConversionCancelled, get_docx_bytes
+from incremental_convert import IncrementalConverter
+from scheduler import ConversionLimitExceeded
+
+# Seconds the text must stay unchanged before the DOCX is built
+DEFAULT_IDLE_SECONDS = 1.5
+
+
+class _ExportJob:
+    """A single pending or running conversion of one version of the text."""
+
+    def __init__(self, md_content):
+        self.md_content = md_content
+        self.started = False
+        self.data = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+
+
+class DeferredExport:
+    """Builds DOCX bytes on a background thread once the text has been idle.
+
+    Each call to ``schedule`` supersedes the previous text: a job that has
+    not started yet is dropped and a running one is cancelled between blocks.
+    ``result`` returns the finished bytes, starting or waiting for the
+    conversion if it is not ready yet. Cache misses are built incrementally
+    from the previous version of the session's document. With a
+    ``scheduler`` (a ConversionScheduler), builds wait for a slot under
+    ``session_id`` and are subject to its size and time limits.
+    """
+
+    def __init__(self, cache, idle_seconds=DEFAULT_IDLE_SECONDS, scheduler=None, session_id=None):
+        self.cache = cache
+        self.idle_seconds = idle_seconds
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        self._job = None
+        self._timer = None
+        self._converter = IncrementalConverter()
+        self._converter_lock = threading.Lock()
+
+    def schedule(self, md_content):
+        """Queue a conversion of the text once it has been idle long enough."""
+        with self._lock:
+            if self._job is not None and self._job.md_content == md_content:
+                return
+            self._cancel_locked()
+            job = self._job = _ExportJob(md_content)
+            self._timer = threading.Timer(self.idle_seconds, self._run, args=(job,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """Abandon the current job, if any."""
+        with self._lock:
+            self._cancel_locked()
+            self._job = None
+
+    def status(self):
+        """Return 'idle', 'pending', 'running' or 'ready' for the current job."""
+        job = self._job
+        if job is None:
+            return 'idle'
+        if job.done.is_set():
+            return 'ready'
+        return 'running' if job.started else 'pending'
+
+    def result(self, timeout=None):
+        """Return DOCX bytes for the latest text, building them now if needed."""
+        with self._lock:
+            job = self._job
+            if job is None:
+                return None
+            start_now = not job.started
+            if start_now:
+                # Nobody wants to wait for the idle timer once a download is requested
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                job.started = True
+        if start_now:
+            self._convert(job)
+        job.done.wait(timeout)
+        return job.data
+
+    def error(self):
+        """Return the message of a limit the latest job exceeded, or None."""
+        job = self._job
+        return job.error if job is not None else None
+
+    def _cancel_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._job is not None:
+            self._job.cancel_event.set()
+
+    def _run(self, job):
+        with self._lock:
+            if job is not self._job or job.started:
+                return
+            job.started = True
+            self._timer = None
+        self._convert(job)
+
+    def _build(self, md_content, cancel_event):
+        if self.scheduler is None:
+            return self._build_now(md_content, cancel_event)
+        return self.scheduler.run(self.session_id, lambda event: self._build_now(md_content, event),
+                                  len(md_content), cancel_event)
+
+    def _build_now(self, md_content, cancel_event):
+        # The converter's document is shared, so updates and saves take turns
+        with self._converter_lock:
+            doc = self._converter.convert(md_content, cancel_event)
+            return get_docx_bytes(doc) if doc else None
+
+    def _convert(self, job):
+        try:
+            job.data = self.cache.get_or_convert(job.md_content, cancel_event=job.cancel_event,
+                                                 build=self._build)
+        except ConversionCancelled:
+            job.data = None
+        except ConversionLimitExceeded as e:
+            job.error = str(e)
+        finally:
+            job.done.set()
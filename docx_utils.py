@@ -1,13 +1,37 @@
 import streamlit as st
 from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.shared import OxmlElement, qn
-from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.shared import Emu, Inches, Twips
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.opc.constants import CONTENT_TYPE, RELATIONSHIP_TYPE
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+from docx.opc.part import XmlPart
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.parts.numbering import NumberingPart
+from docx.section import Section
+from docx.text.paragraph import Paragraph
 from io import BytesIO
+from xml.sax.saxutils import escape as xml_escape
+import copy
+import cProfile
+import html
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager, nullcontext
 import markdown
+import lxml.html
+from lxml import etree
 from bs4 import BeautifulSoup, NavigableString
+from bs4.builder import builder_registry
+from bs4.element import PreformattedString
+
+from image_utils import ImageLoader
 
 # Check if running in Streamlit context
 def _is_streamlit_context():
@@ -21,82 +45,500 @@ import re
 
 URL_PATTERN = re.compile(r"(https?://[^\s<>()]+)")
 
-def sanitize_content_for_word(content):
-    """Sanitize markdown content for Word export by removing/replacing problematic characters."""
-    if not content:
-        return content
-    
-    # Simple approach: just remove all emoji characters using a comprehensive pattern
-    # This avoids replacement issues and duplication
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\U00002500-\U00002BEF"  # chinese char
-        "\U00002702-\U000027B0"  # dingbats
-        "\U000024C2-\U0001F251"  # enclosed characters
-        "\U0001f926-\U0001f937"  # additional emojis
-        "\U00010000-\U0010ffff"  # supplementary multilingual plane
-        "\u2640-\u2642"         # gender symbols
-        "\u2600-\u2B55"         # misc symbols
-        "\u200d"                # zero width joiner
-        "\u23cf"                # eject symbol
-        "\u23e9"                # fast forward
-        "\u231a"                # watch
-        "\ufe0f"                # variation selector
-        "\u3030"                # wavy dash
-        "]+", flags=re.UNICODE
-    )
-    
-    # Remove all emojis and replace with space, then clean up
-    content = emoji_pattern.sub(' ', content)
-    
-    # Replace problematic characters that might cause Word issues
-    content = content.replace('\u2019', "'")  # Right single quotation mark
-    content = content.replace('\u2018', "'")  # Left single quotation mark
-    content = content.replace('\u201C', '"')  # Left double quotation mark
-    content = content.replace('\u201D', '"')  # Right double quotation mark
-    content = content.replace('\u2013', '-')  # En dash
-    content = content.replace('\u2014', '--') # Em dash
-    content = content.replace('\u2026', '...') # Horizontal ellipsis
-    
-    # Clean up multiple consecutive spaces and newlines
-    content = re.sub(r' {2,}', ' ', content)
-    content = re.sub(r'\n{3,}', '\n\n', content)
-    
-    return content.strip()
-
-
-def _set_table_borders(table):
-    """Add borders to all cells in the table."""
+# Entity references that survive into Python-Markdown's element tree text
+_ENTITY_PATTERN = re.compile(r'&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);', re.IGNORECASE)
+
+# Content types of Word templates (.dotx/.dotm) and the document type python-docx expects
+_TEMPLATE_CONTENT_TYPES = (
+    b'application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml',
+    b'application/vnd.ms-word.template.macroEnabledTemplate.main+xml',
+)
+_DOCUMENT_CONTENT_TYPE = b'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+
+# Styles the converter adds to a template that does not define them: name -> (type, id, body XML)
+_CELL_SPACING_XML = '<w:spacing w:after="0" w:line="240" w:lineRule="auto"/>'
+_MARKDOWN_STYLES = {
+    'Code Char': ('character', 'CodeChar',
+                  '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/><w:sz w:val="20"/></w:rPr>'),
+    'Code Block': ('paragraph', 'CodeBlock',
+                   '<w:basedOn w:val="Normal"/>'
+                   '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/><w:sz w:val="20"/></w:rPr>'),
+    'Hyperlink': ('character', 'Hyperlink',
+                  '<w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/></w:rPr>'),
+    'Table Header': ('paragraph', 'TableHeader',
+                     f'<w:basedOn w:val="Normal"/><w:pPr>{_CELL_SPACING_XML}<w:jc w:val="center"/></w:pPr>'
+                     '<w:rPr><w:rFonts w:ascii="Arial" w:hAnsi="Arial"/><w:b/><w:sz w:val="24"/></w:rPr>'),
+    'Table Cell': ('paragraph', 'TableCell',
+                   f'<w:basedOn w:val="Normal"/><w:pPr>{_CELL_SPACING_XML}</w:pPr>'
+                   '<w:rPr><w:rFonts w:ascii="Arial" w:hAnsi="Arial"/><w:sz w:val="22"/></w:rPr>'),
+    'Markdown Table': ('table', 'MarkdownTable',
+                       f'<w:pPr>{_CELL_SPACING_XML}</w:pPr><w:tblPr><w:tblBorders>' + ''.join(
+                           f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+                           for side in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')
+                       ) + '</w:tblBorders><w:tblCellMar><w:left w:w="108" w:type="dxa"/>'
+                       '<w:right w:w="108" w:type="dxa"/></w:tblCellMar></w:tblPr>'),
+}
+# Built-in styles referenced by the block emitters
+_BUILTIN_STYLE_NAMES = ('Heading 1', 'Heading 2', 'Heading 3', 'Heading 4', 'Heading 5', 'Heading 6',
+                        'List Bullet', 'List Number', 'Quote')
+
+# Loaded template documents keyed by absolute path (None for python-docx's default)
+_template_cache = {}
+_template_lock = threading.Lock()
+
+# Bump whenever a change alters the generated documents, so persisted caches miss
+CONVERTER_VERSION = 21
+
+# Conversion engines accepted by convert_md_to_docx
+ENGINES = ('soup', 'etree')
+MARKDOWN_EXTENSIONS = ['tables', 'nl2br', 'fenced_code']
+# BeautifulSoup tree builders for the 'soup' engine, fastest first
+HTML_PARSERS = ('lxml', 'html.parser', 'html5lib')
+
+# Zip settings selectable when saving: (compression method, deflate level)
+COMPRESSION_MODES = {
+    'stored': (zipfile.ZIP_STORED, None),
+    'fast': (zipfile.ZIP_DEFLATED, 1),
+    'default': (zipfile.ZIP_DEFLATED, None),
+    'max': (zipfile.ZIP_DEFLATED, 9),
+}
+
+# Markdown characters parsed and emitted at a time by convert_md_stream
+STREAM_CHUNK_CHARS = 256 * 1024
+
+# Line shapes that decide where markdown can be split into independent blocks
+_FENCE_PATTERN = re.compile(r'(`{3,}|~{3,})')
+_LIST_ITEM_PATTERN = re.compile(r'(?:[*+-]|\d+\.)[ \t]')
+_HTML_BLOCK_PATTERN = re.compile(r'<(!--|[a-zA-Z][a-zA-Z0-9-]*)')
+_REFERENCE_PATTERN = re.compile(r' {0,3}\[[^\[\]]*\]:')
+# Elements that never have a closing tag, so a line starting with one opens no HTML block
+_HTML_VOID_TAGS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                             'link', 'meta', 'source', 'track', 'wbr'})
+
+
+class ConversionCancelled(Exception):
+    """Raised when a conversion is abandoned through its cancel event."""
+
+
+class ConversionMetrics:
+    """Per-stage timings and counts collected during one conversion.
+
+    Pass the same instance as ``metrics`` to ``convert_md_to_docx`` and
+    ``get_docx_bytes``. Stage durations accumulate in ``stages`` (seconds)
+    and sizes in ``counts``. The 'tables' stage is part of 'emit'. With
+    ``profile=True`` both calls also run under cProfile and
+    ``profile_report()`` returns the hottest functions.
+    """
+
+    def __init__(self, profile=False):
+        self.stages = {}
+        self.counts = {}
+        self._profiler = cProfile.Profile() if profile else None
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work and add it to the named stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        """Add value to the named counter."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def profiling(self):
+        """Run a block under the cProfile profiler when profiling is enabled."""
+        if self._profiler is None:
+            yield
+            return
+        self._profiler.enable()
+        try:
+            yield
+        finally:
+            self._profiler.disable()
+
+    @property
+    def total(self):
+        """Total seconds across top-level stages (tables are included in emit)."""
+        return sum(seconds for name, seconds in self.stages.items() if name != 'tables')
+
+    def profile_report(self, limit=25, sort='cumulative'):
+        """Return the top functions from the cProfile capture as text."""
+        if self._profiler is None:
+            return ''
+        output = io.StringIO()
+        pstats.Stats(self._profiler, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+def _stage(metrics, name):
+    """Return a timing context for a stage, or a no-op when metrics are off."""
+    return nullcontext() if metrics is None else metrics.stage(name)
+
+
+def _read_template(template):
+    """Load a template package from disk as an empty Document.
+
+    Word templates (.dotx) are accepted by rewriting the main part's content
+    type, and any body content is dropped so only styles, numbering and page
+    setup carry over.
+    """
+    if template is None:
+        return Document()
+    with zipfile.ZipFile(template) as source:
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if item.filename == '[Content_Types].xml':
+                    for content_type in _TEMPLATE_CONTENT_TYPES:
+                        data = data.replace(content_type, _DOCUMENT_CONTENT_TYPE)
+                target.writestr(item, data)
+    doc = Document(buffer)
+    doc.element.body.clear_content()
+    return doc
+
+
+def _style_ids(part):
+    """Return style name -> styleId for every style the emitters use in a document part.
+
+    Converter styles the document lacks are added on first use; styles a
+    template already defines are reused as they are. The map is kept on the
+    part, so templates resolve it once and every copy inherits it. Missing
+    built-in styles map to None and the content falls back to Normal.
+    """
+    ids = getattr(part, '_markdown_style_ids', None)
+    if ids is not None:
+        return ids
+    styles = part.styles
+    ids = {}
+    for name, (style_type, style_id, body) in _MARKDOWN_STYLES.items():
+        try:
+            ids[name] = styles[name].style_id
+        except KeyError:
+            styles.element.append(parse_xml(
+                f'<w:style {nsdecls("w")} w:type="{style_type}" w:customStyle="1" w:styleId="{style_id}">'
+                f'<w:name w:val="{name}"/>{body}<w:qFormat/></w:style>'
+            ))
+            ids[name] = style_id
+    for name in _BUILTIN_STYLE_NAMES:
+        try:
+            ids[name] = styles[name].style_id
+        except KeyError:
+            ids[name] = None
+    part._markdown_style_ids = ids
+    return ids
+
+
+_SECT_PR_TAG = qn('w:sectPr')
+
+
+def _last_body_child(doc):
+    """Return the body's last child element, or None; unlike len(), this does not walk the body."""
     try:
-        tbl = table._tbl
-        for row in tbl.tr_lst:
-            for cell in row.tc_lst:
-                # Get or create table cell properties
-                tcPr = cell.tcPr
-                if tcPr is None:
-                    tcPr = OxmlElement('w:tcPr')
-                    cell.append(tcPr)
-                
-                # Create borders element
-                tcBorders = OxmlElement('w:tcBorders')
-                
-                # Define border style (single line, black, 0.5pt)
-                for border_name in ['top', 'left', 'bottom', 'right']:
-                    border = OxmlElement(f'w:{border_name}')
-                    border.set(qn('w:val'), 'single')
-                    border.set(qn('w:sz'), '4')  # 0.5pt
-                    border.set(qn('w:space'), '0')
-                    border.set(qn('w:color'), '000000')
-                    tcBorders.append(border)
-                
-                tcPr.append(tcBorders)
-    except Exception as e:
-        # If border setting fails, continue without borders
-        pass
+        return doc.element.body[-1]
+    except IndexError:
+        return None
+
+
+def _append_body_element(doc, element):
+    """Append a block element to the document body, keeping the section properties last.
+
+    python-docx searches the body's children for ``w:sectPr`` on every
+    insert, which makes building long documents quadratic; the section
+    properties are always the last child, so only that one is checked.
+    """
+    last = _last_body_child(doc)
+    if last is not None and last.tag == _SECT_PR_TAG:
+        last.addprevious(element)
+    else:
+        doc.element.body.append(element)
+
+
+def _text_width(doc):
+    """Return the width between the margins of the document's last section, in EMU.
+
+    ``doc.sections`` runs an XPath over the whole body; the last section's
+    properties are the body's final child, so they are read from there.
+    """
+    last = _last_body_child(doc)
+    section = Section(last, doc.part) if last is not None and last.tag == _SECT_PR_TAG else doc.sections[-1]
+    return section.page_width - section.left_margin - section.right_margin
+
+
+def _add_paragraph(doc, text=''):
+    """Append a paragraph to the document body in constant time (see _append_body_element)."""
+    p = doc.element.body._new_p()
+    _append_body_element(doc, p)
+    paragraph = Paragraph(p, doc._body)
+    if text:
+        paragraph.add_run(text)
+    return paragraph
+
+
+def _add_styled_paragraph(doc, style_name, text=''):
+    """Add a paragraph referencing a style by its resolved id, skipping python-docx's name lookup."""
+    paragraph = _add_paragraph(doc, text)
+    style_id = _style_ids(doc.part).get(style_name)
+    if style_id:
+        paragraph._p.style = style_id
+    return paragraph
+
+
+# List geometry in twips: level n's text starts at _LIST_INDENT * (n + 1)
+_LIST_INDENT = 720
+_LIST_HANGING = 360
+_QUOTE_INDENT = 720
+# Word numbering has nine levels (0-8); deeper lists share the last one
+_MAX_LIST_LEVEL = 8
+_BULLETS = ('\u2022', '\u25e6', '\u25aa')
+
+
+def _numbering_element(part):
+    """Return the document's w:numbering element, adding a numbering part if it has none."""
+    try:
+        return part.numbering_part.element
+    except NotImplementedError:
+        # python-docx cannot create an empty numbering part itself
+        numbering_part = NumberingPart(PackURI('/word/numbering.xml'), CONTENT_TYPE.WML_NUMBERING,
+                                       parse_xml(f'<w:numbering {nsdecls("w")}/>'), part.package)
+        part.relate_to(numbering_part, RELATIONSHIP_TYPE.NUMBERING)
+        return numbering_part.element
+
+
+def _abstract_num_xml(abstract_id, ordered):
+    levels = []
+    for level in range(_MAX_LIST_LEVEL + 1):
+        number_format, text = ('decimal', f'%{level + 1}.') if ordered else ('bullet', _BULLETS[level % 3])
+        levels.append(
+            f'<w:lvl w:ilvl="{level}"><w:start w:val="1"/><w:numFmt w:val="{number_format}"/>'
+            f'<w:lvlText w:val="{text}"/><w:lvlJc w:val="left"/><w:pPr>'
+            f'<w:ind w:left="{_LIST_INDENT * (level + 1)}" w:hanging="{_LIST_HANGING}"/></w:pPr></w:lvl>'
+        )
+    return (f'<w:abstractNum {nsdecls("w")} w:abstractNumId="{abstract_id}">'
+            f'<w:multiLevelType w:val="multilevel"/>{"".join(levels)}</w:abstractNum>')
+
+
+def _append_num(numbering, num_id, abstract_id, overrides=''):
+    """Append a w:num in constant time, keeping a trailing w:numIdMacAtCleanup last."""
+    num = parse_xml(f'<w:num {nsdecls("w")} w:numId="{num_id}">'
+                    f'<w:abstractNumId w:val="{abstract_id}"/>{overrides}</w:num>')
+    last = numbering[-1] if len(numbering) else None
+    if last is not None and last.tag == qn('w:numIdMacAtCleanup'):
+        last.addprevious(num)
+    else:
+        numbering.append(num)
+
+
+class _ListNumbering:
+    """The list numbering definitions the emitters share within one document.
+
+    A bulleted and a numbered multi-level definition (w:abstractNum) are
+    added once, when the template is loaded, together with one w:num that
+    every bulleted list uses. Each numbered list gets a w:num of its own
+    (see ``ordered``) so that it restarts at its start value.
+    """
+
+    __slots__ = ('bullet_num', 'ordered_abstract', 'first_num', 'next_num')
+
+    def __init__(self, numbering):
+        abstract_ids = [int(value) for value in numbering.xpath('./w:abstractNum/@w:abstractNumId')]
+        num_ids = [int(value) for value in numbering.xpath('./w:num/@w:numId')]
+        bullet_abstract = max(abstract_ids, default=-1) + 1
+        self.ordered_abstract = bullet_abstract + 1
+        # Schema order: abstract definitions come before every w:num
+        following = numbering.find(qn('w:num'))
+        if following is None:
+            following = numbering.find(qn('w:numIdMacAtCleanup'))
+        for abstract_id, ordered in ((bullet_abstract, False), (self.ordered_abstract, True)):
+            abstract = parse_xml(_abstract_num_xml(abstract_id, ordered))
+            if following is not None:
+                following.addprevious(abstract)
+            else:
+                numbering.append(abstract)
+        self.bullet_num = max(num_ids, default=0) + 1
+        _append_num(numbering, self.bullet_num, bullet_abstract)
+        self.first_num = self.next_num = self.bullet_num + 1
+
+    def ordered(self, part, level, start=1):
+        """Add a w:num for one numbered list whose items are at level, starting at start."""
+        num_id = self.next_num
+        self.next_num += 1
+        _append_num(_numbering_element(part), num_id, self.ordered_abstract,
+                    f'<w:lvlOverride w:ilvl="{level}"><w:startOverride w:val="{start}"/></w:lvlOverride>')
+        return num_id
+
+    def release(self, part, elements):
+        """Remove the w:num of every numbered list within elements that are leaving the document."""
+        num_ids = {int(value) for element in elements
+                   for value in element.xpath('.//w:numPr/w:numId/@w:val')}
+        num_ids = {num_id for num_id in num_ids if num_id >= self.first_num}
+        if not num_ids:
+            return
+        numbering = _numbering_element(part)
+        for num in numbering.xpath('./w:num'):
+            if num.numId in num_ids:
+                numbering.remove(num)
+
+
+def _list_numbering(part):
+    """Return the _ListNumbering of a document part, adding its definitions on first use.
+
+    Like the style map, it is kept on the part, so templates add the
+    definitions once and every copy inherits them.
+    """
+    numbering = getattr(part, '_markdown_list_numbering', None)
+    if numbering is None:
+        numbering = part._markdown_list_numbering = _ListNumbering(_numbering_element(part))
+    return numbering
+
+
+def load_template(template=None):
+    """Return the shared, pre-loaded base document for a template path.
+
+    Templates are read once per process and reloaded only when the file's
+    modification time changes. The returned document must not be modified;
+    use ``new_document`` to get a copy to fill in.
+    """
+    if template is None:
+        key, mtime = None, None
+    else:
+        key = os.path.abspath(template)
+        mtime = os.path.getmtime(key)
+    with _template_lock:
+        cached = _template_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    doc = _read_template(key)
+    _style_ids(doc.part)
+    _list_numbering(doc.part)
+    with _template_lock:
+        _template_cache[key] = (mtime, doc)
+    return doc
+
+
+def new_document(template=None):
+    """Return a new, independent document based on a cached template."""
+    return copy.deepcopy(load_template(template))
+
+
+# Code point ranges stripped from Word exports (emoji, pictographs, dingbats, ...)
+_EMOJI_RANGES = (
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F1E0, 0x1F1FF),  # flags (iOS)
+    (0x2500, 0x2BEF),    # chinese char
+    (0x2702, 0x27B0),    # dingbats
+    (0x24C2, 0x1F251),   # enclosed characters
+    (0x1F926, 0x1F937),  # additional emojis
+    (0x10000, 0x10FFFF), # supplementary multilingual plane
+    (0x2640, 0x2642),    # gender symbols
+    (0x2600, 0x2B55),    # misc symbols
+    (0x200D, 0x200D),    # zero width joiner
+    (0x23CF, 0x23CF),    # eject symbol
+    (0x23E9, 0x23E9),    # fast forward
+    (0x231A, 0x231A),    # watch
+    (0xFE0F, 0xFE0F),    # variation selector
+    (0x3030, 0x3030),    # wavy dash
+)
+
+# Characters that might cause Word issues and their plain replacements
+DEFAULT_REPLACEMENTS = {
+    '\u2019': "'",    # Right single quotation mark
+    '\u2018': "'",    # Left single quotation mark
+    '\u201C': '"',    # Left double quotation mark
+    '\u201D': '"',    # Right double quotation mark
+    '\u2013': '-',    # En dash
+    '\u2014': '--',   # Em dash
+    '\u2026': '...',  # Horizontal ellipsis
+}
+
+
+def _char_class(ranges, exclude=()):
+    """Build a regex character class body from code point ranges minus excluded characters."""
+    parts = []
+    excluded = sorted(ord(char) for char in exclude)
+    for low, high in ranges:
+        for code_point in excluded:
+            if low <= code_point <= high:
+                if low < code_point:
+                    parts.append((low, code_point - 1))
+                low = code_point + 1
+        if low <= high:
+            parts.append((low, high))
+    return ''.join(
+        re.escape(chr(low)) if low == high else f'{re.escape(chr(low))}-{re.escape(chr(high))}'
+        for low, high in parts
+    )
+
+
+class TextSanitizer:
+    """Single-pass sanitizer that makes markdown text safe for Word.
+
+    One precompiled regex strips emoji (runs of emoji and spaces collapse to
+    a single space), collapses runs of spaces after text, applies the
+    replacement table and collapses three or more newlines to two, so the
+    input is scanned once. Indentation at the start of a line is kept, since
+    it nests lists and quotes, and emoji right after it are dropped without
+    a space, so they cannot deepen it. Every match starts with a character
+    from one class, which lets the regex engine skip plain text quickly. Single-character replacement keys are carved out of the
+    emoji ranges, so a table can map symbols that would otherwise be
+    stripped; longer keys are matched first, on a slower path.
+    """
+
+    def __init__(self, replacements=None):
+        self.replacements = dict(DEFAULT_REPLACEMENTS if replacements is None else replacements)
+        single = ''.join(key for key in self.replacements if len(key) == 1)
+        multi = sorted((key for key in self.replacements if len(key) > 1), key=len, reverse=True)
+        emoji = _char_class(_EMOJI_RANGES, single)
+        keys = ''.join(re.escape(key) for key in single)
+        branches = [
+            f'(?<=[^\\n ] )[ {emoji}]+',  # two or more spaces after text, or spaces before emoji
+            r'(?<=\n)\n\n+',          # three or more newlines
+            f'(?<=[{emoji}])[ {emoji}]*',  # emoji runs, with any spaces they touch
+        ]
+        if keys:
+            branches.append(f'(?<=[{keys}])')
+        pattern = f"[ \\n{keys}{emoji}](?:{'|'.join(branches)})"
+        if multi:
+            pattern = '|'.join([re.escape(key) for key in multi] + [pattern])
+        self._pattern = re.compile(pattern)
+
+    def _substitute(self, match):
+        text = match.group()
+        replacement = self.replacements.get(text)
+        if replacement is not None:
+            return replacement
+        if text[0] == '\n':
+            return '\n\n'
+        # Runs after text start with a space, so an emoji run that follows
+        # whitespace begins the line's text
+        start = match.start()
+        if text[0] != ' ' and (start == 0 or match.string[start - 1] in '\n \t'):
+            return ''
+        return ' '
+
+    def __call__(self, content):
+        if not content:
+            return content
+        return self._pattern.sub(self._substitute, content).strip()
+
+
+_default_sanitizer = TextSanitizer()
+
+
+def sanitize_content_for_word(content, replacements=None):
+    """Sanitize markdown content for Word export by removing/replacing problematic characters.
+
+    ``replacements`` overrides the default character replacement table.
+    """
+    if replacements is None:
+        return _default_sanitizer(content)
+    return TextSanitizer(replacements)(content)
 
 
 def _linkify_plain_urls(soup: BeautifulSoup) -> None:
@@ -107,38 +549,413 @@ def _linkify_plain_urls(soup: BeautifulSoup) -> None:
         parent = text_node.parent
         if parent and parent.name in {'a', 'code', 'pre'}:
             continue
-        text_value = str(text_node)
-        parts = URL_PATTERN.split(text_value)
-        if len(parts) <= 1:
-            continue
         new_nodes = []
-        for index, part in enumerate(parts):
-            if index % 2 == 0:
-                if part:
-                    new_nodes.append(NavigableString(part))
+        for part, url in _iter_url_parts(str(text_node)):
+            if url is None:
+                new_nodes.append(NavigableString(part))
             else:
-                link_text = part
-                trailing = ''
-                while link_text and link_text[-1] in '.,);':
-                    trailing = link_text[-1] + trailing
-                    link_text = link_text[:-1]
-                if not link_text:
-                    new_nodes.append(NavigableString(part))
-                    continue
-                link = soup.new_tag('a', href=link_text)
-                link.string = link_text
+                link = soup.new_tag('a', href=url)
+                link.string = part
                 new_nodes.append(link)
-                if trailing:
-                    new_nodes.append(NavigableString(trailing))
         for node in reversed(new_nodes):
             text_node.insert_after(node)
         text_node.extract()
 
 
+class _TreeNode:
+    """Lightweight element node exposing the parts of the bs4 Tag API used by the emitters.
+
+    Text children are plain ``str`` objects, so emitters distinguish text
+    from elements with ``isinstance(node, str)`` for either engine.
+    """
+
+    __slots__ = ('name', 'attrs', 'contents', 'parent')
+
+    def __init__(self, name, attrs=None, parent=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.contents = []
+        self.parent = parent
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def get_text(self):
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            else:
+                stack.extend(reversed(node.contents))
+        return ''.join(parts)
+
+    def find_all(self, name, recursive=True):
+        names = {name} if isinstance(name, str) else set(name)
+        found = []
+        stack = list(reversed(self.contents))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                continue
+            if node.name in names:
+                found.append(node)
+            if recursive:
+                stack.extend(reversed(node.contents))
+        return found
+
+    def find(self, name):
+        found = self.find_all(name)
+        return found[0] if found else None
+
+
+def _iter_url_parts(text):
+    """Yield (text, url) pairs for a string, with url set for bare links.
+
+    This is the one tokenizer for bare URLs. Trailing sentence punctuation
+    is kept out of the link, and text without '://' skips the regex.
+    """
+    if '://' not in text:
+        if text:
+            yield text, None
+        return
+    for index, part in enumerate(URL_PATTERN.split(text)):
+        if index % 2 == 0:
+            if part:
+                yield part, None
+            continue
+        link_text = part.rstrip('.,);')
+        trailing = part[len(link_text):]
+        if not link_text:
+            yield part, None
+            continue
+        yield link_text, link_text
+        if trailing:
+            yield trailing, None
+
+
+def _append_text(node, text, unescape):
+    """Append a text child, linkifying bare URLs like _linkify_plain_urls."""
+    if not text:
+        return
+    if unescape and '&' in text:
+        text = _ENTITY_PATTERN.sub(lambda m: html.unescape(m.group(0)), text)
+    if node.name in {'a', 'code', 'pre'}:
+        node.contents.append(text)
+        return
+    for part, url in _iter_url_parts(text):
+        if url is None:
+            node.contents.append(part)
+        else:
+            link = _TreeNode('a', {'href': url}, node)
+            link.contents.append(part)
+            node.contents.append(link)
+
+
+def _build_tree_node(element, parent, unescape):
+    """Copy an ElementTree-style element (stdlib or lxml) into a _TreeNode."""
+    node = _TreeNode(element.tag, dict(element.attrib), parent)
+    _append_text(node, element.text, unescape)
+    for child in element:
+        if isinstance(child.tag, str):
+            node.contents.append(_build_tree_node(child, node, unescape))
+        _append_text(node, child.tail, unescape)
+    return node
+
+
+def _has_placeholder(element):
+    """Check whether raw-HTML stash placeholders remain anywhere under element."""
+    return any(markdown.util.STX in text for text in element.itertext())
+
+
+def default_html_parser():
+    """Return the fastest installed HTML_PARSERS entry; lxml's C parser when it is available."""
+    for name in HTML_PARSERS:
+        if builder_registry.lookup(name) is not None:
+            return name
+    return 'html.parser'
+
+
+class MarkdownConverter:
+    """Markdown settings plus one reusable Markdown instance per thread.
+
+    Building a Markdown object loads every extension, so batch and server
+    workloads keep one per thread and reset it between documents instead of
+    building one per conversion. ``extensions`` (and ``extension_configs``)
+    default to MARKDOWN_EXTENSIONS; ``html_parser`` is the BeautifulSoup
+    tree builder the 'soup' engine uses and defaults to default_html_parser().
+    Instances are safe to share between threads; pass one as ``converter``
+    to the conversion functions.
+    """
+
+    def __init__(self, extensions=None, extension_configs=None, html_parser=None):
+        if html_parser is None:
+            html_parser = default_html_parser()
+        elif builder_registry.lookup(html_parser) is None:
+            raise ValueError(f"HTML parser is not installed: {html_parser!r}")
+        self.extensions = list(MARKDOWN_EXTENSIONS if extensions is None else extensions)
+        self.extension_configs = dict(extension_configs or {})
+        self.html_parser = html_parser
+        self._local = threading.local()
+
+    @property
+    def options(self):
+        """Settings that change the output; cache keys use them in place of the instance."""
+        return {'extensions': tuple(self.extensions),
+                'extension_configs': tuple(sorted(self.extension_configs.items())),
+                'html_parser': self.html_parser}
+
+    def markdown(self):
+        """Return this thread's Markdown instance, reset for a new document."""
+        md = getattr(self._local, 'md', None)
+        if md is None:
+            md = self._local.md = markdown.Markdown(extensions=self.extensions,
+                                                    extension_configs=self.extension_configs)
+        md.reset()
+        return md
+
+    def to_html(self, md_content, metrics=None):
+        """Sanitize markdown and render it to the HTML the 'soup' engine parses."""
+        # Sanitize content for Word compatibility
+        with _stage(metrics, 'sanitize'):
+            sanitized_content = sanitize_content_for_word(md_content)
+
+        # Convert markdown to HTML with table extension
+        with _stage(metrics, 'markdown'):
+            return self.markdown().convert(sanitized_content)
+
+    def parse_html(self, html_content, metrics=None):
+        """Parse HTML from to_html into the 'soup' engine's block tree."""
+        # Parse HTML content
+        with _stage(metrics, 'parse'):
+            root = BeautifulSoup(html_content, self.html_parser)
+        with _stage(metrics, 'linkify'):
+            _linkify_plain_urls(root)
+        return root
+
+    def parse(self, md_content, engine='soup', metrics=None):
+        """Sanitize and parse markdown into the block tree every emitter walks (see parse_markdown)."""
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown conversion engine: {engine!r}")
+        if engine == 'etree':
+            # Sanitize content for Word compatibility
+            with _stage(metrics, 'sanitize'):
+                sanitized_content = sanitize_content_for_word(md_content)
+            return _markdown_to_tree(self.markdown(), sanitized_content, metrics)
+        return self.parse_html(self.to_html(md_content, metrics), metrics)
+
+
+_default_converter = None
+_default_converter_lock = threading.Lock()
+
+
+def get_default_converter():
+    """Return the shared MarkdownConverter used when no converter is given."""
+    global _default_converter
+    with _default_converter_lock:
+        if _default_converter is None:
+            _default_converter = MarkdownConverter()
+        return _default_converter
+
+
+def _get_markdown():
+    """Return this thread's reset Markdown instance of the default converter."""
+    return get_default_converter().markdown()
+
+
+def _parse_markdown_tree(md, content):
+    """Run Python-Markdown up to, but not including, HTML serialization."""
+    lines = content.split('\n')
+    for preprocessor in md.preprocessors:
+        lines = preprocessor.run(lines)
+    root = md.parser.parseDocument(lines).getroot()
+    for treeprocessor in md.treeprocessors:
+        new_root = treeprocessor.run(root)
+        if new_root is not None:
+            root = new_root
+    return root
+
+
+def _markdown_to_tree(md, content, metrics=None):
+    """Convert markdown to a _TreeNode document straight from Python-Markdown's element tree.
+
+    Blocks that still hold raw-HTML stash placeholders (fenced code, inline
+    or block HTML, entities) are serialized on their own and re-parsed with
+    lxml; everything else is copied from the element tree without an HTML
+    round trip.
+    """
+    with _stage(metrics, 'markdown'):
+        root = _parse_markdown_tree(md, content)
+    with _stage(metrics, 'parse'):
+        return _copy_markdown_tree(md, root)
+
+
+def _copy_markdown_tree(md, root):
+    """Copy Python-Markdown's element tree into _TreeNodes, resolving stashed raw HTML."""
+    document = _TreeNode('[document]')
+    for block in root:
+        if not _has_placeholder(block):
+            document.contents.append(_build_tree_node(block, document, True))
+            continue
+        block.tail = None
+        fragment = md.serializer(block)
+        for postprocessor in md.postprocessors:
+            fragment = postprocessor.run(fragment)
+        if not fragment.strip():
+            continue
+        for child in lxml.html.fragments_fromstring(fragment):
+            if isinstance(child, str):
+                _append_text(document, child, False)
+            elif isinstance(child.tag, str):
+                document.contents.append(_build_tree_node(child, document, False))
+    return document
+
+
+def _continues_block(line, first_line):
+    """Check whether a line after a blank line still belongs to the block that began with first_line.
+
+    Indented lines continue lists and code blocks, and Python-Markdown merges
+    a list or blockquote into an immediately preceding one of the same kind.
+    Reference definitions are removed before the blocks around them are
+    joined, so they never end a block.
+    """
+    if line[0] in ' \t' or _REFERENCE_PATTERN.match(line):
+        return True
+    if line.startswith('>'):
+        return first_line.startswith('>')
+    return bool(_LIST_ITEM_PATTERN.match(line) and _LIST_ITEM_PATTERN.match(first_line))
+
+
+def _html_block_delimiters(line):
+    """Return (opening, closing) patterns if line starts a raw HTML element or comment."""
+    match = _HTML_BLOCK_PATTERN.match(line)
+    if match is None:
+        return None
+    if match.group(1) == '!--':
+        return re.compile('<!--'), re.compile('-->')
+    tag = match.group(1)
+    if tag.lower() in _HTML_VOID_TAGS:
+        return None
+    # Self-closed tags (<x/>) open nothing either
+    return (re.compile(rf'<{tag}\b(?![^>]*/>)', re.IGNORECASE),
+            re.compile(rf'</{tag}\b', re.IGNORECASE))
+
+
+def iter_markdown_blocks(lines):
+    """Split markdown lines into top-level blocks that convert independently.
+
+    Blocks are cut only at blank lines, never inside fenced code or raw HTML
+    elements, and lists, blockquotes and indented continuations stay whole,
+    so converting each block on its own yields the same Word content as
+    converting the full text. Yields block text without trailing blank lines.
+    """
+    block = []
+    blanks = []
+    fence = None
+    html_delimiters = None
+    html_depth = 0
+    for line in lines:
+        if fence is not None:
+            block.append(line)
+            if line.rstrip() == fence:
+                fence = None
+            continue
+        if not line.strip():
+            if block:
+                blanks.append(line)
+            continue
+        if blanks:
+            if html_depth <= 0 and not _continues_block(line, block[0]):
+                yield ''.join(block)
+                block = []
+            else:
+                block.extend(blanks)
+            blanks = []
+        if not block:
+            html_delimiters = _html_block_delimiters(line)
+            html_depth = 0
+        block.append(line)
+        if html_delimiters is not None:
+            # Raw HTML runs until its element is closed, blank lines included
+            opening, closing = html_delimiters
+            html_depth += len(opening.findall(line)) - len(closing.findall(line))
+        match = _FENCE_PATTERN.match(line)
+        if match:
+            fence = match.group(1)
+    if block:
+        yield ''.join(block)
+
+
+def split_markdown_blocks(md_content):
+    """Return the top-level blocks of markdown text (see iter_markdown_blocks)."""
+    return [block.rstrip('\n') for block in iter_markdown_blocks(io.StringIO(md_content))]
+
+
+def iter_markdown_chunks(lines, chunk_chars=STREAM_CHUNK_CHARS):
+    """Group the top-level blocks of markdown lines into chunks of about chunk_chars characters.
+
+    Chunks end only at block boundaries, so fenced code, raw HTML, lists and
+    tables are never cut; a block longer than chunk_chars is a chunk of its own.
+    """
+    chunk = []
+    size = 0
+    for block in iter_markdown_blocks(lines):
+        if chunk and size + len(block) > chunk_chars:
+            yield '\n'.join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(block)
+        size += len(block) + 1
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+def reference_definitions(md_content):
+    """Return the link reference definitions in markdown text, which apply to every block."""
+    pattern = markdown.blockprocessors.ReferenceProcessor.RE
+    return [match.group(0).strip('\n') for match in pattern.finditer(md_content)]
+
+
+# Month abbreviations that mark a table cell as date-like
+_MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Header cells are shaded directly so viewers without conditional table styles show it
+_HEADER_SHADING_XML = '<w:shd w:val="clear" w:color="auto" w:fill="E7E6E6"/>'
+
+
+def _is_centered_value(text):
+    """Check if cell content looks numeric or date-like and should be centered."""
+    text = text.strip()
+    return (text.replace('-', '').replace('+', '').replace(' ', '').replace('days', '').replace('Day', '').isdigit() or
+            any(month in text for month in _MONTH_NAMES))
+
+
+def _run_content_xml(text):
+    """Render run text as w:t/w:tab/w:br markup, like python-docx's Run.text setter."""
+    parts = []
+    for chunk in re.split(r'(\t|\r\n|\r|\n)', text):
+        if not chunk:
+            continue
+        if chunk == '\t':
+            parts.append('<w:tab/>')
+        elif chunk in ('\n', '\r', '\r\n'):
+            parts.append('<w:br/>')
+        elif chunk.strip() != chunk:
+            parts.append(f'<w:t xml:space="preserve">{xml_escape(chunk)}</w:t>')
+        else:
+            parts.append(f'<w:t>{xml_escape(chunk)}</w:t>')
+    return ''.join(parts)
 
 
 def _add_table_to_doc(doc, table_element):
-    """Add a properly formatted table to the Word document."""
+    """Add a properly formatted table to the Word document.
+
+    The whole ``w:tbl`` element is rendered as one XML string and parsed
+    once, so the cost is linear in the number of cells. Cells reference the
+    "Markdown Table", "Table Header" and "Table Cell" styles.
+    """
     try:
         # Extract table data
         rows = table_element.find_all('tr')
@@ -166,7 +983,6 @@ def _add_table_to_doc(doc, table_element):
         if not data_rows and not headers:
             return
 
-        # Create Word table
         num_cols = max(len(headers) if headers else 0,
                       max(len(row) for row in data_rows) if data_rows else 0)
         num_rows = (1 if headers else 0) + len(data_rows)
@@ -174,73 +990,56 @@ def _add_table_to_doc(doc, table_element):
         if num_rows == 0 or num_cols == 0:
             return
 
-        word_table = doc.add_table(rows=num_rows, cols=num_cols)
-        word_table.style = 'Table Grid'  # Use Table Grid for better borders
-        word_table.alignment = WD_TABLE_ALIGNMENT.LEFT
-
-        # Set column widths to distribute evenly
-        for col in word_table.columns:
-            col.width = Inches(6.5 / num_cols)  # Distribute across page width
+        # Cells start at an even share of the text block; the grid spreads
+        # columns evenly across the page width
+        cell_width = Emu(_text_width(doc) // num_cols).twips
+        grid_width = Inches(6.5 / num_cols).twips
+        # Borders, fonts and spacing come from shared styles, not from each cell
+        styles = _style_ids(doc.part)
+        cell_properties = f'<w:tcPr><w:tcW w:type="dxa" w:w="{cell_width}"/></w:tcPr>'
+        header_paragraph = f'<w:p><w:pPr><w:pStyle w:val="{styles["Table Header"]}"/></w:pPr>'
+        cell_paragraph = f'<w:p><w:pPr><w:pStyle w:val="{styles["Table Cell"]}"/></w:pPr>'
+        centered_paragraph = f'<w:p><w:pPr><w:pStyle w:val="{styles["Table Cell"]}"/><w:jc w:val="center"/></w:pPr>'
+        empty_cell_xml = f'<w:tc>{cell_properties}<w:p/></w:tc>'
 
-        row_idx = 0
+        parts = [
+            f'<w:tbl {nsdecls("w")}><w:tblPr><w:tblStyle w:val="{styles["Markdown Table"]}"/>'
+            '<w:tblW w:type="auto" w:w="0"/><w:jc w:val="left"/>'
+            '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+            'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr><w:tblGrid>',
+            f'<w:gridCol w:w="{grid_width}"/>' * num_cols,
+            '</w:tblGrid>',
+        ]
 
-        # Add headers if they exist
+        # Add headers if they exist: centered, bold and shaded
         if headers:
-            header_row = word_table.rows[row_idx]
-            for col_idx, header_text in enumerate(headers[:num_cols]):
-                cell = header_row.cells[col_idx]
-                cell.text = header_text
-                # Format header text
-                for paragraph in cell.paragraphs:
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    for run in paragraph.runs:
-                        run.bold = True
-                        run.font.size = Pt(12)
-                        run.font.name = 'Arial'
-                
-                # Add header cell shading (light gray)
-                try:
-                    from docx.oxml.ns import nsdecls, parse_xml
-                    shading_elm = parse_xml(f'<w:shd {nsdecls("w")} w:fill="E7E6E6"/>')
-                    cell._tc.get_or_add_tcPr().append(shading_elm)
-                except:
-                    pass  # Continue without shading if it fails
-                    
-            row_idx += 1
+            parts.append('<w:tr>')
+            for header_text in headers[:num_cols]:
+                parts.append(
+                    f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{cell_width}"/>{_HEADER_SHADING_XML}</w:tcPr>'
+                    f'{header_paragraph}<w:r>{_run_content_xml(header_text)}</w:r></w:p></w:tc>'
+                )
+            parts.append(empty_cell_xml * (num_cols - len(headers)))
+            parts.append('</w:tr>')
 
         # Add data rows
         for data_row in data_rows:
-            if row_idx >= len(word_table.rows):
-                break
-            word_row = word_table.rows[row_idx]
+            parts.append('<w:tr>')
             for col_idx, cell_text in enumerate(data_row[:num_cols]):
-                if col_idx < len(word_row.cells):
-                    cell = word_row.cells[col_idx]
-                    cell.text = cell_text
-                    # Format data cell text
-                    for paragraph in cell.paragraphs:
-                        # Left align first column (usually IDs), center others for numeric data
-                        if col_idx == 0:
-                            paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                        else:
-                            # Check if content looks numeric or date-like for center alignment
-                            text = cell_text.strip()
-                            if (text.replace('-', '').replace('+', '').replace(' ', '').replace('days', '').replace('Day', '').isdigit() or
-                                any(month in text for month in ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                                                               'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])):
-                                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                            else:
-                                paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                        for run in paragraph.runs:
-                            run.font.size = Pt(11)
-                            run.font.name = 'Arial'
-            row_idx += 1
-
-        # Apply borders to the table
-        _set_table_borders(word_table)
+                # Left align first column (usually IDs), center numeric or date-like data
+                centered = col_idx > 0 and _is_centered_value(cell_text)
+                parts.append(
+                    f'<w:tc>{cell_properties}{centered_paragraph if centered else cell_paragraph}'
+                    f'<w:r>{_run_content_xml(cell_text)}</w:r></w:p></w:tc>'
+                )
+            parts.append(empty_cell_xml * (num_cols - len(data_row)))
+            parts.append('</w:tr>')
+
+        parts.append('</w:tbl>')
+        _append_body_element(doc, parse_xml(''.join(parts)))
 
         # Add some spacing after table
-        doc.add_paragraph()
+        _add_paragraph(doc)
 
     except Exception as e:
         try:
@@ -249,96 +1048,329 @@ def _add_table_to_doc(doc, table_element):
         except:
             pass
 
-def _is_nested_element(element, processed_elements):
-    """Check if an element is nested inside another element we're already processing."""
-    parent = element.parent
-    while parent:
-        if parent in processed_elements:
-            return True
-        # Check if parent is a type we process at top level
-        if parent.name in ['ul', 'ol', 'table', 'blockquote']:
-            return True
-        parent = parent.parent
-    return False
-
-
-def convert_md_to_docx(md_content):
-    """Convert markdown content to a Word document with proper table support."""
+
+def _emit_heading(doc, element):
+    """Add a heading paragraph for h1-h6 elements."""
+    heading_text = element.get_text().strip()
+    if heading_text:
+        paragraph = _add_styled_paragraph(doc, f'Heading {element.name[1]}', heading_text)
+        # Merged documents bookmark every heading as it is written (see merge_export.HeadingIndex)
+        index = getattr(doc.part, '_heading_index', None)
+        if index is not None:
+            index.add(paragraph, int(element.name[1]), heading_text)
+
+
+def _emit_paragraph(doc, element):
+    """Add a paragraph with inline formatting."""
+    # Skip paragraphs that are inside list items
+    if element.parent and element.parent.name == 'li':
+        return
+    # Add paragraph (skip empty paragraphs unless they hold an image)
+    text = element.get_text().strip()
+    if text in ['---', '***', '___']:  # Skip horizontal rules
+        return
+    if text == '[TOC]' and getattr(doc.part, '_heading_index', None) is not None:
+        # Where a merged document's table of contents goes
+        doc.part._heading_index.mark_contents(_add_paragraph(doc))
+        return
+    if text or element.find('img') is not None:
+        p = _add_paragraph(doc)
+        _add_formatted_text(p, element)
+
+
+def _is_inline_node(node):
+    """Check whether a child of a list item belongs to its text rather than being a block of its own."""
+    return isinstance(node, str) or node.name == 'code' or node.name not in _BLOCK_EMITTERS
+
+
+def _has_inline_content(nodes):
+    return any(not isinstance(node, PreformattedString) and bool(node.strip()) if isinstance(node, str)
+               else True for node in nodes)
+
+
+def _write_trimmed(paragraph, nodes):
+    """Write inline nodes to a paragraph without the whitespace around them."""
+    nodes = list(nodes)
+    if nodes and isinstance(nodes[0], str):
+        nodes[0] = nodes[0].lstrip()
+    if nodes and isinstance(nodes[-1], str):
+        nodes[-1] = nodes[-1].rstrip()
+    _add_formatted_nodes(paragraph, nodes)
+
+
+def _add_inline_paragraph(doc, nodes, style=None, indent=0):
+    """Add a paragraph holding inline nodes, indent twips from the margin."""
+    paragraph = _add_styled_paragraph(doc, style) if style else _add_paragraph(doc)
+    if indent:
+        paragraph.paragraph_format.left_indent = Twips(indent)
+    _write_trimmed(paragraph, nodes)
+    return paragraph
+
+
+def _list_item_properties(doc, style, num_id, level, indent):
+    """Build the w:pPr shared by a list's items; indent shifts them right, e.g. inside a quote."""
+    style_id = _style_ids(doc.part).get(style)
+    style_xml = f'<w:pStyle w:val="{style_id}"/>' if style_id else ''
+    indent_xml = (f'<w:ind w:left="{_LIST_INDENT * (level + 1) + indent}" w:hanging="{_LIST_HANGING}"/>'
+                  if indent else '')
+    return parse_xml(f'<w:pPr {nsdecls("w")}>{style_xml}<w:numPr><w:ilvl w:val="{level}"/>'
+                     f'<w:numId w:val="{num_id}"/></w:numPr>{indent_xml}</w:pPr>')
+
+
+def _add_list_item_paragraph(doc, properties, nodes=()):
+    """Add a list item's numbered or bulleted paragraph with a copy of its list's properties."""
+    paragraph = _add_paragraph(doc)
+    paragraph._p.insert(0, copy.deepcopy(properties))
+    _write_trimmed(paragraph, nodes)
+    return paragraph
+
+
+def _list_start(element):
+    """Return the first number of an ordered list, 1 when its start attribute is missing or invalid."""
     try:
-        # Sanitize content for Word compatibility
-        sanitized_content = sanitize_content_for_word(md_content)
-        
-        # Convert markdown to HTML with table extension
-        html_content = markdown.markdown(sanitized_content, extensions=['tables', 'nl2br', 'fenced_code'])
+        return int(element.get('start') or 1)
+    except ValueError:
+        return 1
 
-        # Create a new Word document
-        doc = Document()
 
-        # Parse HTML content
-        soup = BeautifulSoup(html_content, 'html.parser')
-        _linkify_plain_urls(soup)
-
-        # Process only top-level elements to avoid duplicates
-        processed_elements = set()
-        
-        for element in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'ul', 'ol', 'table', 'hr', 'blockquote', 'pre', 'code']):
-            # Skip elements that are nested inside other elements we're processing
-            if _is_nested_element(element, processed_elements):
+def _emit_list_items(doc, element, level, indent=0, block_style=None):
+    """Add a list's items at a numbering level, with their nested lists and blocks below them.
+
+    An item's text up to its first block is the numbered paragraph; a first
+    ``p`` (loose lists) supplies it instead. Later paragraphs, code and
+    quotes are indented to the item's text, and nested lists move one
+    level deeper. Every node is visited once, so long outlines are written
+    in a single pass. ``block_style`` styles the item's other paragraphs.
+    """
+    if element.name == 'ul':
+        style, num_id = 'List Bullet', _list_numbering(doc.part).bullet_num
+    else:
+        style, num_id = 'List Number', _list_numbering(doc.part).ordered(doc.part, level, _list_start(element))
+    properties = _list_item_properties(doc, style, num_id, level, indent)
+    text_indent = _LIST_INDENT * (level + 1) + indent
+    for li in element.contents:
+        if getattr(li, 'name', None) != 'li':
+            continue
+        item = None
+        inline = []
+        for child in li.contents:
+            if _is_inline_node(child):
+                inline.append(child)
+                continue
+            if _has_inline_content(inline):
+                if item is None:
+                    item = _add_list_item_paragraph(doc, properties, inline)
+                else:
+                    _add_inline_paragraph(doc, inline, block_style, text_indent)
+            inline = []
+            if child.name == 'p' and item is None:
+                item = _add_list_item_paragraph(doc, properties, child.contents)
                 continue
-                
-            processed_elements.add(element)
-            
-            if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                # Add heading
-                level = int(element.name[1])
-                heading_text = element.get_text().strip()
-                if heading_text:
-                    doc.add_heading(heading_text, level=level)
-            elif element.name == 'p':
-                # Skip paragraphs that are inside list items
-                if element.parent and element.parent.name == 'li':
-                    continue
-                # Add paragraph (skip empty paragraphs)
-                text = element.get_text().strip()
-                if text and text not in ['---', '***', '___']:  # Skip horizontal rules
-                    # Check if paragraph contains bold or italic formatting
-                    p = doc.add_paragraph()
-                    _add_formatted_text(p, element)
-            elif element.name == 'ul':
-                # Add unordered list
-                for li in element.find_all('li', recursive=False):
-                    paragraph = doc.add_paragraph(style='List Bullet')
-                    _add_formatted_text(paragraph, li)
-            elif element.name == 'ol':
-                # Add ordered list
-                for li in element.find_all('li', recursive=False):
-                    paragraph = doc.add_paragraph(style='List Number')
-                    _add_formatted_text(paragraph, li)
-            elif element.name == 'table':
-                # Add table with proper formatting
-                _add_table_to_doc(doc, element)
-            elif element.name == 'hr':
-                # Add horizontal rule as a line break
-                doc.add_paragraph('─' * 50)
-            elif element.name == 'blockquote':
-                # Add blockquote as indented paragraph
-                quote_text = element.get_text().strip()
-                if quote_text:
-                    p = doc.add_paragraph(quote_text)
-                    p.style = 'Quote'
-            elif element.name in ['pre', 'code']:
-                # Skip code elements that are inside paragraphs or list items
-                if element.parent and element.parent.name in ['p', 'li']:
-                    continue
-                # Add code blocks as monospace text
-                code_text = element.get_text().strip()
-                if code_text:
-                    p = doc.add_paragraph(code_text)
-                    for run in p.runs:
-                        run.font.name = 'Consolas'
-                        run.font.size = Pt(10)
+            if item is None:
+                # An item that starts with a block still gets its number or bullet
+                item = _add_list_item_paragraph(doc, properties)
+            if child.name in ('ul', 'ol'):
+                _emit_list_items(doc, child, min(level + 1, _MAX_LIST_LEVEL), indent, block_style)
+            else:
+                _emit_nested_block(doc, child, text_indent, block_style)
+        if _has_inline_content(inline):
+            if item is None:
+                _add_list_item_paragraph(doc, properties, inline)
+            else:
+                _add_inline_paragraph(doc, inline, block_style, text_indent)
+        elif item is None:
+            _add_list_item_paragraph(doc, properties)
+
+
+def _emit_list(doc, element):
+    """Add a list with its nested lists at their numbering levels."""
+    _emit_list_items(doc, element, 0)
+
+
+def _emit_hr(doc, element):
+    """Add a horizontal rule as a line of box-drawing characters."""
+    _add_paragraph(doc, '─' * 50)
+
+
+def _emit_quote(doc, element, indent):
+    """Add the blocks of a blockquote as Quote paragraphs, indent twips from the margin."""
+    for block in _iter_top_level_blocks(element):
+        _emit_nested_block(doc, block, indent, 'Quote')
+
+
+def _emit_nested_block(doc, element, indent, style=None):
+    """Add a block found inside a list item or quote, indented to line up with its container."""
+    name = element.name
+    if name in ('ul', 'ol'):
+        _emit_list_items(doc, element, 0, indent, style)
+    elif name == 'blockquote':
+        _emit_quote(doc, element, indent + _QUOTE_INDENT)
+    elif name in ('pre', 'code'):
+        code_text = element.get_text().strip()
+        if code_text:
+            paragraph = _add_styled_paragraph(doc, 'Code Block', code_text)
+            if indent:
+                paragraph.paragraph_format.left_indent = Twips(indent)
+    elif name == 'p' or name not in _BLOCK_EMITTERS:
+        if element.get_text().strip() or element.find('img') is not None:
+            _add_inline_paragraph(doc, element.contents, style, indent)
+    else:
+        _BLOCK_EMITTERS[name](doc, element)
+
+
+def _emit_blockquote(doc, element):
+    """Add a blockquote's paragraphs as Quote paragraphs, indenting nested quotes and lists."""
+    _emit_quote(doc, element, 0)
+
+
+def _emit_code(doc, element):
+    """Add a code block as a Code Block paragraph."""
+    # Skip code elements that are inside paragraphs or list items
+    if element.parent and element.parent.name in ['p', 'li']:
+        return
+    code_text = element.get_text().strip()
+    if code_text:
+        _add_styled_paragraph(doc, 'Code Block', code_text)
+
+
+# Block-level tags and the emitter that renders each of them
+_BLOCK_EMITTERS = {
+    'h1': _emit_heading,
+    'h2': _emit_heading,
+    'h3': _emit_heading,
+    'h4': _emit_heading,
+    'h5': _emit_heading,
+    'h6': _emit_heading,
+    'p': _emit_paragraph,
+    'ul': _emit_list,
+    'ol': _emit_list,
+    'table': _add_table_to_doc,
+    'hr': _emit_hr,
+    'blockquote': _emit_blockquote,
+    'pre': _emit_code,
+    'code': _emit_code,
+}
+
+
+# Raw HTML elements whose content is never shown on the page
+_UNRENDERED_TAGS = frozenset({'head', 'noscript', 'script', 'style', 'template', 'title'})
+
+
+def _emit_inline_container(doc, element):
+    """Add a paragraph for a container holding only inline content, such as a raw ``div``."""
+    if _has_inline_content(element.contents) or element.find('img') is not None:
+        _add_inline_paragraph(doc, element.contents)
+
+
+def _holds_only_inline_text(node):
+    """Check whether a container has text of its own and no block children, like a paragraph."""
+    has_text = False
+    for child in node.contents:
+        if isinstance(child, str):
+            # Comments and other bs4 markup strings are not text
+            has_text = has_text or (not isinstance(child, PreformattedString) and bool(child.strip()))
+        elif child.name in _BLOCK_EMITTERS:
+            return False
+    return has_text
+
+
+def _iter_top_level_blocks(root):
+    """Yield block elements in document order without descending into them.
+
+    Each node is visited at most once, so the walk is linear in the size of
+    the tree regardless of nesting depth. Containers that are not blocks
+    themselves (e.g. raw ``div`` wrappers) are walked through, except those
+    holding only inline content, which are yielded to be written as
+    paragraphs. The lxml parser, for one, moves a ``div`` out of the
+    paragraph it was written in. Elements a browser never renders, such
+    as ``style`` and ``script``, are skipped with their content.
+    """
+    stack = [iter(root.contents)]
+    while stack:
+        for node in stack[-1]:
+            name = getattr(node, 'name', None)
+            if name is None or name in _UNRENDERED_TAGS:
+                continue
+            if name in _BLOCK_EMITTERS or _holds_only_inline_text(node):
+                yield node
+            else:
+                stack.append(iter(node.contents))
+                break
+        else:
+            stack.pop()
+
+
+def _emit_blocks(doc, root, cancel_event=None, metrics=None, image_dir=None):
+    """Dispatch every top-level block under root to its emitter.
+
+    Images are loaded on a thread pool while the blocks before them are
+    emitted; the loader is reachable from the part as ``_image_loader``.
+    """
+    images = root.find_all('img')
+    loader = None
+    if images:
+        loader = ImageLoader(image_dir, _text_width(doc))
+        loader.prefetch(image.get('src') for image in images)
+        doc.part._image_loader = loader
+        if metrics is not None:
+            metrics.count('images', len(images))
+    try:
+        for element in _iter_top_level_blocks(root):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConversionCancelled()
+            emitter = _BLOCK_EMITTERS.get(element.name, _emit_inline_container)
+            if metrics is None:
+                emitter(doc, element)
+                continue
+            metrics.count('blocks')
+            with _stage(metrics, 'tables') if element.name == 'table' else nullcontext():
+                emitter(doc, element)
+    finally:
+        if loader is not None:
+            loader.close()
+            del doc.part._image_loader
+
+
+def _count_document_parts(doc, metrics):
+    """Record paragraph, run, table cell and hyperlink counts for a built document."""
+    body = doc.element.body
+    metrics.count('paragraphs', len(body.xpath('.//w:p')))
+    metrics.count('runs', len(body.xpath('.//w:r')))
+    metrics.count('table_cells', len(body.xpath('.//w:tc')))
+    metrics.count('hyperlinks', len(body.xpath('.//w:hyperlink')))
+
+
+def convert_md_to_docx(md_content, cancel_event=None, engine='soup', template=None, metrics=None,
+                       image_dir=None, converter=None):
+    """Convert markdown content to a Word document with proper table support.
+
+    ``engine`` selects how markdown is turned into the tree the emitters
+    walk: 'soup' renders HTML and parses it with BeautifulSoup, 'etree'
+    reads Python-Markdown's element tree directly. ``template`` is an
+    optional .docx/.dotx path whose styles and page setup are used; it is
+    loaded once and copied per conversion. If ``cancel_event`` (a
+    ``threading.Event``) is set while blocks are being emitted, the
+    conversion stops and raises ``ConversionCancelled``. An optional
+    ``ConversionMetrics`` receives per-stage timings and document counts.
+    Images in data URIs are always embedded; local image files are read
+    only when ``image_dir`` is given, with relative paths resolved against it.
+    ``converter`` (a MarkdownConverter) sets the extensions and HTML parser.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown conversion engine: {engine!r}")
+    try:
+        with metrics.profiling() if metrics is not None else nullcontext():
+            # Create a new Word document from the cached template
+            with _stage(metrics, 'template'):
+                doc = new_document(template)
+            append_markdown(doc, md_content, cancel_event, engine, metrics, image_dir, converter)
 
+        if metrics is not None:
+            metrics.count('input_chars', len(md_content))
+            _count_document_parts(doc, metrics)
         return doc
+    except ConversionCancelled:
+        raise
     except Exception as e:
         try:
             if _is_streamlit_context():
@@ -348,144 +1380,434 @@ def convert_md_to_docx(md_content):
         return None
 
 
+@contextmanager
+def _open_markdown(source):
+    """Yield a text stream for a file path, a text stream or a binary stream such as an upload."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r', encoding='utf-8') as f:
+            yield f
+    elif isinstance(source, io.TextIOBase):
+        yield source
+    else:
+        stream = io.TextIOWrapper(source, encoding='utf-8')
+        try:
+            yield stream
+        finally:
+            # Leave the caller's binary stream open
+            stream.detach()
+
+
+def _append_markdown_chunks(doc, source, cancel_event, engine, metrics, image_dir, chunk_chars, converter):
+    """Append markdown from a path or stream to doc one chunk at a time, yielding after each chunk."""
+    with _open_markdown(source) as stream:
+        definitions = []
+        seekable = stream.seekable()
+        if seekable:
+            # Reference definitions apply to the whole text, so collect them first
+            start = stream.tell()
+            with _stage(metrics, 'split'):
+                for chunk in iter_markdown_chunks(stream, chunk_chars):
+                    definitions.extend(reference_definitions(chunk))
+            stream.seek(start)
+        first = True
+        for chunk in iter_markdown_chunks(stream, chunk_chars):
+            if not seekable:
+                definitions.extend(reference_definitions(chunk))
+            if first:
+                # The start of the text loses its indentation, even with definitions before it
+                chunk = chunk.lstrip()
+                first = False
+            prefix = '\n'.join(definitions) + '\n\n' if definitions else ''
+            append_markdown(doc, prefix + chunk, cancel_event, engine, metrics, image_dir, converter)
+            if metrics is not None:
+                metrics.count('chunks')
+                metrics.count('input_chars', len(chunk))
+            yield
+
+
+def convert_md_stream(source, cancel_event=None, engine='soup', template=None, metrics=None,
+                      image_dir=None, chunk_chars=STREAM_CHUNK_CHARS, converter=None):
+    """Convert markdown from a file path or stream to a Word document, one chunk at a time.
+
+    The text is read line by line and cut into chunks at top-level block
+    boundaries (see iter_markdown_chunks). Each chunk is sanitized, parsed
+    and appended before the next is read, so apart from the document only
+    one chunk's text and tree are in memory. Link reference definitions are
+    collected in a first pass when the stream is seekable, so they resolve
+    in every chunk; otherwise each applies from its own chunk onward. Other
+    arguments and error handling are as for convert_md_to_docx.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown conversion engine: {engine!r}")
+    try:
+        with metrics.profiling() if metrics is not None else nullcontext():
+            with _stage(metrics, 'template'):
+                doc = new_document(template)
+            for _ in _append_markdown_chunks(doc, source, cancel_event, engine, metrics, image_dir,
+                                             chunk_chars, converter):
+                pass
+
+        if metrics is not None:
+            _count_document_parts(doc, metrics)
+        return doc
+    except ConversionCancelled:
+        raise
+    except Exception as e:
+        try:
+            if _is_streamlit_context():
+                st.error(f"Error converting to Word document: {str(e)}")
+        except:
+            pass
+        return None
+
+
+def _detach_body_content(doc):
+    """Remove everything but the section properties from the body and return it as XML bytes."""
+    body = doc.element.body
+    last = _last_body_child(doc)
+    sect_pr = last if last is not None and last.tag == _SECT_PR_TAG else None
+    if sect_pr is not None:
+        body.remove(sect_pr)
+    content = b''
+    if next(iter(body), None) is not None:
+        data = etree.tostring(body, encoding='UTF-8')
+        # Keep only the children; the document root declares the same namespaces
+        content = data[data.index(b'>') + 1:data.rindex(b'</')]
+        for child in list(body):
+            body.remove(child)
+    if sect_pr is not None:
+        body.append(sect_pr)
+    return content
+
+
+def save_md_stream(source, target, cancel_event=None, engine='soup', template=None, metrics=None,
+                   image_dir=None, chunk_chars=STREAM_CHUNK_CHARS, compression='default', converter=None):
+    """Convert markdown from a file path or stream and write the .docx to target chunk by chunk.
+
+    Works like convert_md_stream, but each chunk's body content is written
+    to a temporary file and dropped from the document once it is built. The
+    whole body is never in memory; only the relationships, images and one
+    chunk are. The target is a path or writable binary stream (see
+    save_docx). Errors propagate to the caller.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown conversion engine: {engine!r}")
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression mode: {compression!r}")
+    with metrics.profiling() if metrics is not None else nullcontext(), tempfile.TemporaryFile() as spool:
+        with _stage(metrics, 'template'):
+            doc = new_document(template)
+        for _ in _append_markdown_chunks(doc, source, cancel_event, engine, metrics, image_dir, chunk_chars,
+                                         converter):
+            if metrics is not None:
+                _count_document_parts(doc, metrics)
+            with _stage(metrics, 'spool'):
+                spool.write(_detach_body_content(doc))
+        spool.seek(0)
+        with _stage(metrics, 'save'):
+            _write_package(doc, target, compression, spool)
+
+
+def parse_markdown(md_content, engine='soup', metrics=None, converter=None):
+    """Sanitize and parse markdown into the block tree every emitter walks.
+
+    The tree is a BeautifulSoup document for the 'soup' engine and a
+    _TreeNode document for 'etree'; bare URLs are already links in both.
+    ``converter`` is a MarkdownConverter (default: get_default_converter()).
+    """
+    return (converter or get_default_converter()).parse(md_content, engine, metrics)
+
+
+def markdown_to_html(md_content, metrics=None, converter=None):
+    """Sanitize markdown and render it to the HTML the 'soup' engine parses."""
+    return (converter or get_default_converter()).to_html(md_content, metrics)
+
+
+def parse_html(html_content, metrics=None, converter=None):
+    """Parse HTML from markdown_to_html into the 'soup' engine's block tree."""
+    return (converter or get_default_converter()).parse_html(html_content, metrics)
+
+
+def append_markdown(doc, md_content, cancel_event=None, engine='soup', metrics=None, image_dir=None,
+                    converter=None):
+    """Convert markdown content and append its blocks to the end of an existing document.
+
+    Errors propagate to the caller; ``convert_md_to_docx`` is the forgiving wrapper.
+    """
+    root = parse_markdown(md_content, engine, metrics, converter)
+    # Walk the tree once, emitting each top-level block
+    with _stage(metrics, 'emit'):
+        _emit_blocks(doc, root, cancel_event, metrics, image_dir)
+
+
+def tree_to_docx(root, cancel_event=None, template=None, metrics=None, image_dir=None):
+    """Build a Word document from a tree returned by parse_markdown."""
+    with _stage(metrics, 'template'):
+        doc = new_document(template)
+    with _stage(metrics, 'emit'):
+        _emit_blocks(doc, root, cancel_event, metrics, image_dir)
+    return doc
+
+
+def _hyperlink_rid(part, url):
+    """Return the rId of the part's external hyperlink relationship to url, adding it if needed.
+
+    python-docx scans every relationship on each lookup and again to choose
+    a new rId, so the part keeps its own url -> rId map and rId counter.
+    """
+    rids = getattr(part, '_hyperlink_rids', None)
+    if rids is None:
+        rids = part._hyperlink_rids = {
+            rel.target_ref: r_id for r_id, rel in part.rels.items()
+            if rel.is_external and rel.reltype == RELATIONSHIP_TYPE.HYPERLINK
+        }
+        part._next_hyperlink_rid = len(part.rels) + 1
+    r_id = rids.get(url)
+    if r_id is None:
+        while f'rId{part._next_hyperlink_rid}' in part.rels:
+            part._next_hyperlink_rid += 1
+        r_id = rids[url] = f'rId{part._next_hyperlink_rid}'
+        part.rels.add_relationship(RELATIONSHIP_TYPE.HYPERLINK, url, r_id, is_external=True)
+    return r_id
+
+
+# Relationships that exist only for body content and go stale when it is removed
+_CONTENT_RELATIONSHIPS = (RELATIONSHIP_TYPE.HYPERLINK, RELATIONSHIP_TYPE.IMAGE)
+
+
+def _drop_unused_relationships(doc):
+    """Remove the hyperlink and image relationships no r:id in the body refers to any more.
+
+    Image parts they pointed to leave the package with them, so edited
+    documents save and hold no more parts than a full rebuild would.
+    Returns the number of relationships removed.
+    """
+    part = doc.part
+    used = set(doc.element.body.xpath('.//@r:id | .//@r:embed | .//@r:link'))
+    unused = [r_id for r_id, rel in part.rels.items()
+              if rel.reltype in _CONTENT_RELATIONSHIPS and r_id not in used]
+    rids = getattr(part, '_hyperlink_rids', None)
+    image_parts = part.package.image_parts
+    for r_id in unused:
+        rel = part.rels[r_id]
+        del part.rels[r_id]
+        if rel.is_external:
+            if rids is not None and rids.get(rel.target_ref) == r_id:
+                del rids[rel.target_ref]
+        elif rel.target_part in image_parts:
+            image_parts._image_parts.remove(rel.target_part)
+    return len(unused)
+
+
 def _add_hyperlink(paragraph, text: str, url: str) -> None:
-    """Add a clickable hyperlink run to a paragraph."""
+    """Add a clickable hyperlink run, formatted by the Hyperlink character style."""
     if not url:
         paragraph.add_run(text)
         return
     try:
         part = paragraph.part
-        r_id = part.relate_to(url, RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
-        hyperlink = OxmlElement('w:hyperlink')
-        hyperlink.set(qn('r:id'), r_id)
-
-        new_run = OxmlElement('w:r')
-        r_pr = OxmlElement('w:rPr')
-        
-        # Add hyperlink style
-        r_style = OxmlElement('w:rStyle')
-        r_style.set(qn('w:val'), 'Hyperlink')
-        r_pr.append(r_style)
-        
-        # Add explicit blue color for hyperlinks
-        color = OxmlElement('w:color')
-        color.set(qn('w:val'), '0563C1')  # Word's default hyperlink blue
-        r_pr.append(color)
-        
-        # Add underline
-        underline = OxmlElement('w:u')
-        underline.set(qn('w:val'), 'single')
-        r_pr.append(underline)
-        
-        new_run.append(r_pr)
-
-        text_elem = OxmlElement('w:t')
-        text_elem.text = text
-        new_run.append(text_elem)
-
-        hyperlink.append(new_run)
-        paragraph._p.append(hyperlink)
+        index = getattr(part, '_heading_index', None)
+        anchor = index.anchor(url) if index is not None else None
+        if anchor is not None:
+            # Links to headings of a merged document jump to their bookmarks
+            paragraph._p.append(parse_xml(
+                f'<w:hyperlink {nsdecls("w")} w:anchor="{anchor}"><w:r><w:rPr>'
+                f'<w:rStyle w:val="{_style_ids(part)["Hyperlink"]}"/></w:rPr>'
+                f'{_run_content_xml(text)}</w:r></w:hyperlink>'
+            ))
+            return
+        r_id = _hyperlink_rid(part, url)
+        paragraph._p.append(parse_xml(
+            f'<w:hyperlink {nsdecls("w", "r")} r:id="{r_id}"><w:r><w:rPr>'
+            f'<w:rStyle w:val="{_style_ids(part)["Hyperlink"]}"/></w:rPr>'
+            f'{_run_content_xml(text)}</w:r></w:hyperlink>'
+        ))
     except Exception:
         paragraph.add_run(text)
 
 
-def _add_formatted_text(paragraph, element):
-    """Add formatted text (bold, italic, hyperlinks) to a paragraph."""
-    try:
-        # Directly handle plain text nodes
-        if isinstance(element, NavigableString):
-            text = str(element)
-            if not text:
-                return
-            parts = URL_PATTERN.split(text)
-            if len(parts) <= 1:
-                paragraph.add_run(text)
-                return
-            for index, part in enumerate(parts):
-                if index % 2 == 0:
-                    if part:
-                        paragraph.add_run(part)
-                else:
-                    link_text = part
-                    trailing = ''
-                    while link_text and link_text[-1] in '.,);':
-                        trailing = link_text[-1] + trailing
-                        link_text = link_text[:-1]
-                    if not link_text:
-                        paragraph.add_run(part)
-                        continue
-                    _add_hyperlink(paragraph, link_text, link_text)
-                    if trailing:
-                        paragraph.add_run(trailing)
+class _RunWriter:
+    """Writes a paragraph's inline content, merging adjacent text with the same formatting into one run."""
+
+    __slots__ = ('paragraph', '_parts', '_format')
+
+    def __init__(self, paragraph):
+        self.paragraph = paragraph
+        self._parts = []
+        self._format = None
+
+    def text(self, text, format=None):
+        """Queue text with a format of None, 'bold', 'italic' or 'code'."""
+        if not text:
             return
+        if format != self._format:
+            self.flush()
+            self._format = format
+        self._parts.append(text)
 
-        if not hasattr(element, 'name'):
-            paragraph.add_run(str(element))
+    def plain(self, text):
+        """Queue unformatted text, turning bare URLs into hyperlinks."""
+        for part, url in _iter_url_parts(text):
+            if url is None:
+                self.text(part)
+            else:
+                self.link(part, url)
+
+    def link(self, text, url):
+        self.flush()
+        _add_hyperlink(self.paragraph, text, url)
+
+    def image(self, element):
+        """Write an <img> as an inline picture no wider than the page, or its alt text if it cannot be loaded."""
+        loader = getattr(self.paragraph.part, '_image_loader', None)
+        src = element.get('src')
+        data = loader.get(src) if loader is not None and src else None
+        if data is None:
+            self.text(element.get('alt', ''))
             return
+        self.flush()
+        run = self.paragraph.add_run()
+        try:
+            shape = run.add_picture(BytesIO(data))
+        except Exception:
+            run._r.getparent().remove(run._r)
+            self.text(element.get('alt', ''))
+            return
+        if shape.width > loader.max_width:
+            shape.height = Emu(round(shape.height * loader.max_width / shape.width))
+            shape.width = Emu(loader.max_width)
 
-        if element.name == 'a' and element.get('href'):
-            link_text = element.get_text().strip() or element.get('href')
-            _add_hyperlink(paragraph, link_text, element.get('href'))
+    def flush(self):
+        """Write the queued text as a single run."""
+        if not self._parts:
             return
+        run = self.paragraph.add_run(''.join(self._parts))
+        self._parts = []
+        if self._format == 'bold':
+            run.bold = True
+        elif self._format == 'italic':
+            run.italic = True
+        elif self._format == 'code':
+            run._r.style = _style_ids(self.paragraph.part)['Code Char']
 
-        for content in element.contents if hasattr(element, 'contents') else []:
-            if isinstance(content, NavigableString):
-                # Process text nodes for inline URLs
-                text = str(content)
-                if text:
-                    parts = URL_PATTERN.split(text)
-                    if len(parts) > 1:
-                        for index, part in enumerate(parts):
-                            if index % 2 == 0:
-                                if part:
-                                    paragraph.add_run(part)
-                            else:
-                                link_text = part
-                                trailing = ''
-                                while link_text and link_text[-1] in '.,);':
-                                    trailing = link_text[-1] + trailing
-                                    link_text = link_text[:-1]
-                                if not link_text:
-                                    paragraph.add_run(part)
-                                    continue
-                                _add_hyperlink(paragraph, link_text, link_text)
-                                if trailing:
-                                    paragraph.add_run(trailing)
-                    else:
-                        paragraph.add_run(text)
-            elif hasattr(content, 'name'):
-                if content.name in {'strong', 'b'}:
-                    # Check if bold element contains links
-                    if content.find('a'):
-                        _add_formatted_text(paragraph, content)
-                    else:
-                        run = paragraph.add_run(content.get_text())
-                        run.bold = True
-                elif content.name in {'em', 'i'}:
-                    run = paragraph.add_run(content.get_text())
-                    run.italic = True
-                elif content.name == 'code':
-                    run = paragraph.add_run(content.get_text())
-                    run.font.name = 'Consolas'
-                    run.font.size = Pt(10)
-                elif content.name == 'a' and content.get('href'):
-                    link_text = content.get_text().strip() or content.get('href')
-                    _add_hyperlink(paragraph, link_text, content.get('href'))
-                else:
-                    _add_formatted_text(paragraph, content)
+
+def _add_formatted_text(paragraph, element):
+    """Add formatted text (bold, italic, hyperlinks) to a paragraph."""
+    writer = _RunWriter(paragraph)
+    try:
+        _write_inline(writer, element)
+        writer.flush()
     except Exception:
         paragraph.add_run(element.get_text() if hasattr(element, 'get_text') else str(element))
 
 
+def _add_formatted_nodes(paragraph, nodes):
+    """Add a sequence of sibling inline nodes to a paragraph as _add_formatted_text does."""
+    writer = _RunWriter(paragraph)
+    try:
+        _write_inline_nodes(writer, nodes)
+        writer.flush()
+    except Exception:
+        paragraph.add_run(''.join(node if isinstance(node, str) else node.get_text() for node in nodes))
+
+
+def _write_inline(writer, element):
+    """Queue an inline element and its children on a _RunWriter."""
+    # Directly handle plain text nodes
+    if isinstance(element, str):
+        writer.plain(element)
+        return
+
+    if not hasattr(element, 'name'):
+        writer.text(str(element))
+        return
+
+    if element.name == 'a' and element.get('href'):
+        writer.link(element.get_text().strip() or element.get('href'), element.get('href'))
+        return
+
+    _write_inline_nodes(writer, element.contents if hasattr(element, 'contents') else [])
+
+
+def _write_inline_nodes(writer, nodes):
+    """Queue sibling inline nodes on a _RunWriter."""
+    for content in nodes:
+        if isinstance(content, str):
+            writer.plain(content)
+        elif hasattr(content, 'name'):
+            if content.name in {'strong', 'b'}:
+                # Bold text containing links keeps the links but loses the bold
+                if content.find('a'):
+                    _write_inline(writer, content)
+                else:
+                    writer.text(content.get_text(), 'bold')
+            elif content.name in {'em', 'i'}:
+                writer.text(content.get_text(), 'italic')
+            elif content.name == 'code':
+                writer.text(content.get_text(), 'code')
+            elif content.name == 'a' and content.get('href'):
+                writer.link(content.get_text().strip() or content.get('href'), content.get('href'))
+            elif content.name == 'img':
+                writer.image(content)
+            else:
+                _write_inline(writer, content)
+
+
+def save_docx(doc, target, compression='default'):
+    """Write a Document as a .docx package to a file path or writable binary stream.
+
+    Mirrors python-docx's package writer, but XML parts are serialized
+    straight into their zip entries instead of being built as whole byte
+    strings first. The target does not need to be seekable, so sockets and
+    response bodies work. ``compression`` is one of COMPRESSION_MODES:
+    'stored' is fastest, 'max' is smallest.
+    """
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression mode: {compression!r}")
+    _write_package(doc, target, compression)
+
+
+def _write_package(doc, target, compression, body_content=None):
+    """Write the package parts as a zip; body_content is a binary file spliced in at the start of the body."""
+    method, level = COMPRESSION_MODES[compression]
+    package = doc.part.package
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+    with zipfile.ZipFile(target, 'w', method, compresslevel=level) as archive:
+        archive.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+        archive.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+        for part in parts:
+            if body_content is not None and part is doc.part:
+                xml = etree.tostring(part.element, encoding='UTF-8', standalone=True)
+                split = xml.index(b'>', xml.index(b'<w:body')) + 1
+                with archive.open(part.partname.membername, 'w') as member:
+                    member.write(xml[:split])
+                    shutil.copyfileobj(body_content, member)
+                    member.write(xml[split:])
+            elif isinstance(part, XmlPart):
+                with archive.open(part.partname.membername, 'w') as member:
+                    etree.ElementTree(part.element).write(member, encoding='UTF-8', standalone=True)
+            else:
+                archive.writestr(part.partname.membername, part.blob)
+            if len(part.rels):
+                archive.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
 
+def get_docx_bytes(doc, metrics=None, compression='default'):
+    """Convert a docx Document object to bytes.
 
-def get_docx_bytes(doc):
-    """Convert a docx Document object to bytes."""
+    ``compression`` selects the zip mode (see save_docx). An optional
+    ``ConversionMetrics`` receives the 'save' stage timing and the output size.
+    """
     try:
-        docx_bytes = BytesIO()
-        doc.save(docx_bytes)
-        docx_bytes.seek(0)
-        return docx_bytes.getvalue()
+        with metrics.profiling() if metrics is not None else nullcontext(), _stage(metrics, 'save'):
+            docx_bytes = BytesIO()
+            save_docx(doc, docx_bytes, compression)
+            data = docx_bytes.getvalue()
+        if metrics is not None:
+            metrics.count('output_bytes', len(data))
+        return data
     except Exception as e:
         try:
             if _is_streamlit_context():
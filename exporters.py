@@ -0,0 +1,161 @@
+import html
+import threading
+
+from bs4 import BeautifulSoup, Comment
+
+import docx_utils
+
+# Elements written without a closing tag in HTML output
+_VOID_ELEMENTS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                            'link', 'meta', 'source', 'track', 'wbr'})
+_HEADINGS = frozenset({'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+
+_HTML_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: Calibri, Arial, sans-serif; max-width: 50em; margin: 2em auto; line-height: 1.5; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #000; padding: 0.25em 0.5em; font-family: Arial, sans-serif; }}
+th {{ background: #E7E6E6; }}
+pre, code {{ font-family: Consolas, monospace; font-size: 0.9em; }}
+blockquote {{ border-left: 3px solid #ccc; margin-left: 0; padding-left: 1em; color: #555; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+class ParsedDocument:
+    """Markdown parsed once into the converter's block tree, ready for any number of exports.
+
+    Parsing (sanitize, markdown, tree building and linkification) happens in
+    the constructor; each ``to_*`` method is a single read-only walk over the
+    shared tree, so one instance can serve every format and every thread.
+    """
+
+    def __init__(self, md_content, engine='soup', metrics=None, converter=None):
+        self.md_content = md_content
+        self.engine = engine
+        self.root = docx_utils.parse_markdown(md_content, engine, metrics, converter)
+
+    def to_docx(self, template=None, cancel_event=None, metrics=None, image_dir=None):
+        """Return a new Word document built from the parsed tree."""
+        return docx_utils.tree_to_docx(self.root, cancel_event, template, metrics, image_dir)
+
+    def to_docx_bytes(self, template=None, compression='default'):
+        """Return the Word document as .docx bytes."""
+        return docx_utils.get_docx_bytes(self.to_docx(template), compression=compression)
+
+    def to_html(self, title=None):
+        """Return a standalone HTML page with the document body and a small stylesheet."""
+        if isinstance(self.root, BeautifulSoup):
+            # The lxml parser wraps the fragment in <html><body>
+            body = (self.root.body or self.root).decode_contents()
+        else:
+            parts = []
+            _render_html(self.root, parts)
+            body = ''.join(parts)
+        if title is None:
+            heading = self.root.find('h1')
+            title = heading.get_text().strip() if heading is not None else 'Document'
+        return _HTML_PAGE.format(title=html.escape(title), body=body.strip())
+
+    def to_text(self):
+        """Return the document as plain text, one block per paragraph."""
+        return '\n\n'.join(block for block in _text_blocks(self.root) if block) + '\n'
+
+
+class LatestParse:
+    """Holds the ParsedDocument of one editor's latest text and nothing older.
+
+    ``get`` parses on first use of a text and replaces the previous tree,
+    so a session keeps at most one tree alive. It is safe to call from the
+    threads that build downloads.
+    """
+
+    def __init__(self, engine='soup'):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._parsed = None
+
+    def get(self, md_content):
+        """Return the parsed document for md_content, parsing it if the text changed."""
+        with self._lock:
+            if self._parsed is None or self._parsed.md_content != md_content:
+                # Let the old tree go before the new one is built
+                self._parsed = None
+                self._parsed = ParsedDocument(md_content, self.engine)
+            return self._parsed
+
+
+def _render_html(node, parts):
+    """Serialize the children of a _TreeNode as HTML."""
+    for child in node.contents:
+        if isinstance(child, str):
+            parts.append(html.escape(child, quote=False))
+            continue
+        attrs = ''.join(f' {name}="{html.escape(str(value))}"' for name, value in child.attrs.items())
+        parts.append(f'<{child.name}{attrs}>')
+        if child.name in _VOID_ELEMENTS:
+            continue
+        _render_html(child, parts)
+        parts.append(f'</{child.name}>')
+
+
+def _inline_text(node):
+    """Flatten inline content to text, writing links as 'label (url)' when the label differs."""
+    parts = []
+    for child in node.contents:
+        if isinstance(child, str):
+            if not isinstance(child, Comment):
+                parts.append(child)
+        elif child.name in ('ul', 'ol'):
+            continue
+        elif child.name == 'a' and child.get('href'):
+            label = child.get_text().strip()
+            url = child.get('href')
+            parts.append(f'{label} ({url})' if label and label != url else url)
+        else:
+            parts.append(_inline_text(child))
+    return ''.join(parts)
+
+
+def _list_lines(element, depth=0):
+    """Render a list and its nested lists as indented '-' or 'N.' lines."""
+    lines = []
+    number = docx_utils._list_start(element)
+    for li in element.find_all('li', recursive=False):
+        marker = f'{number}.' if element.name == 'ol' else '-'
+        number += 1
+        text = ' '.join(_inline_text(li).split('\n')).strip()
+        lines.append(f"{'  ' * depth}{marker} {text}")
+        for nested in li.find_all(['ul', 'ol'], recursive=False):
+            lines.extend(_list_lines(nested, depth + 1))
+    return lines
+
+
+def _text_blocks(root):
+    """Yield the plain-text rendering of each top-level block under root."""
+    for block in docx_utils._iter_top_level_blocks(root):
+        name = block.name
+        if name in _HEADINGS or name == 'p' or name not in docx_utils._BLOCK_EMITTERS:
+            yield _inline_text(block).strip()
+        elif name in ('ul', 'ol'):
+            yield '\n'.join(_list_lines(block))
+        elif name == 'table':
+            rows = block.find_all('tr')
+            yield '\n'.join('\t'.join(cell.get_text().strip() for cell in row.find_all(['th', 'td']))
+                            for row in rows)
+        elif name == 'hr':
+            yield '-' * 40
+        elif name == 'blockquote':
+            quoted = '\n\n'.join(text for text in _text_blocks(block) if text)
+            yield '\n'.join(f'> {line}' if line else '>' for line in quoted.split('\n'))
+        elif name in ('pre', 'code'):
+            yield block.get_text().strip('\n')
@@ -0,0 +1,171 @@
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import unquote, unquote_to_bytes, urlparse
+
+from byte_cache import ByteLRUCache
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are embedded unchanged
+    Image = None
+
+EMU_PER_INCH = 914400
+# Resolution of images downscaled to fit the page width
+TARGET_DPI = 200
+# Images above this size are re-encoded even when they already fit the page (1 MB)
+MAX_IMAGE_BYTES = 1024 * 1024
+# Images with more pixels are not decoded at all, since a small file can expand to
+# hundreds of megabytes (25 megapixels is about 100 MB as RGBA)
+MAX_IMAGE_PIXELS = 25_000_000
+# Default byte budget for processed images kept between conversions (64 MB)
+DEFAULT_IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+# Pillow formats that python-docx can embed as they are
+_DOCX_FORMATS = frozenset({'PNG', 'JPEG', 'GIF', 'BMP', 'TIFF'})
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Return the process-wide thread pool that loads images."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 2),
+                                       thread_name_prefix='image-loader')
+        return _pool
+
+
+class ImageCache(ByteLRUCache):
+    """Processed image bytes kept between conversions, keyed by source hash and size."""
+
+    def __init__(self, max_bytes=DEFAULT_IMAGE_CACHE_BYTES):
+        super().__init__(max_bytes)
+
+
+_image_cache = ImageCache()
+
+
+def read_image_source(src, image_dir=None):
+    """Return the raw bytes of a data URI or local image file, or None.
+
+    Relative paths and file:// URLs are read only when ``image_dir`` is
+    given; relative paths are resolved against it. Remote URLs are not fetched.
+    """
+    if src.startswith('data:'):
+        header, _, payload = src.partition(',')
+        try:
+            if header.endswith(';base64'):
+                return base64.b64decode(payload, validate=False)
+            return unquote_to_bytes(payload)
+        except (binascii.Error, ValueError):
+            return None
+    if image_dir is None:
+        return None
+    url = urlparse(src)
+    if url.scheme == 'file':
+        path = unquote(url.path)
+    elif len(url.scheme) <= 1:  # no scheme, or a Windows drive letter
+        path = os.path.join(image_dir, unquote(src))
+    else:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def process_image(data, max_px=None):
+    """Downscale an image wider than max_px pixels and re-encode it when oversized.
+
+    Returns bytes python-docx can embed, or None if the image cannot be
+    decoded or has more than MAX_IMAGE_PIXELS pixels. Without Pillow the
+    bytes are returned unchanged.
+    """
+    if Image is None:
+        return data
+    try:
+        with Image.open(BytesIO(data)) as image:
+            # Opening reads only the header, so the size is known before decoding
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                return None
+            too_wide = max_px is not None and image.width > max_px
+            if not too_wide and image.format in _DOCX_FORMATS and len(data) <= MAX_IMAGE_BYTES:
+                return data
+            source_format = image.format
+            dpi = image.info.get('dpi')
+            if too_wide:
+                # thumbnail() lets JPEG decode at reduced size before resampling
+                image.thumbnail((max_px, image.height), Image.LANCZOS)
+                dpi = (TARGET_DPI, TARGET_DPI)
+            else:
+                image.load()
+            has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+            output = BytesIO()
+            options = {'dpi': dpi} if dpi else {}
+            if has_alpha or source_format in ('PNG', 'GIF'):
+                if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                    image = image.convert('RGBA')
+                image.save(output, 'PNG', optimize=True, **options)
+            else:
+                image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True, **options)
+    except Exception:
+        return None
+    return output.getvalue()
+
+
+class ImageLoader:
+    """Loads and processes the images of one conversion on a shared thread pool.
+
+    ``prefetch`` starts every image up front so decoding and resizing
+    overlap with text emission; ``get`` waits for one image. Each distinct
+    source is loaded once per loader, and processed bytes are cached by a
+    hash of the source bytes, so a repeated image is processed once and
+    embedded as a single package part.
+    """
+
+    def __init__(self, image_dir=None, max_width=None, cache=_image_cache):
+        self.image_dir = image_dir
+        self.max_width = max_width
+        self.max_px = max(1, round(max_width / EMU_PER_INCH * TARGET_DPI)) if max_width else None
+        self.cache = cache
+        self._futures = {}
+
+    def prefetch(self, sources):
+        """Start loading every source in the background."""
+        for src in sources:
+            if src:
+                self._future(src)
+
+    def get(self, src):
+        """Return processed image bytes for src, or None if it cannot be embedded."""
+        return self._future(src).result()
+
+    def close(self):
+        """Cancel loads that have not started yet."""
+        for future in self._futures.values():
+            future.cancel()
+
+    def _future(self, src):
+        future = self._futures.get(src)
+        if future is None:
+            future = self._futures[src] = _get_pool().submit(self._load, src)
+        return future
+
+    def _load(self, src):
+        data = read_image_source(src, self.image_dir)
+        if data is None:
+            return None
+        key = f'{hashlib.sha1(data).hexdigest()}:{self.max_px}'
+        processed = self.cache.get(key)
+        if processed is None:
+            processed = process_image(data, self.max_px)
+            if processed is not None:
+                self.cache.put(key, processed)
+        return processed
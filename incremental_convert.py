@@ -0,0 +1,130 @@
+import hashlib
+from contextlib import nullcontext
+from difflib import SequenceMatcher
+
+import docx_utils
+from docx_utils import ConversionCancelled
+
+
+def _elements_between(body, previous, end):
+    """Return the body children after previous (or from the start) up to, not including, end."""
+    element = previous.getnext() if previous is not None else next(iter(body), None)
+    group = []
+    while element is not None and element is not end:
+        group.append(element)
+        element = element.getnext()
+    return group
+
+
+class IncrementalConverter:
+    """Keeps the last converted document and regenerates only the blocks that changed.
+
+    The markdown is split into top-level blocks (see
+    ``docx_utils.iter_markdown_blocks``) and each block is fingerprinted.
+    Body elements built for blocks whose fingerprint is unchanged stay in
+    the document untouched, hyperlink relationships included; removed
+    blocks are deleted and new or edited blocks are converted on their own
+    and spliced into place. The result matches a full rebuild.
+
+    The same ``Document`` object is updated by every call, so save or copy
+    it before converting the next version of the text.
+    """
+
+    def __init__(self, engine='soup', template=None):
+        if engine not in docx_utils.ENGINES:
+            raise ValueError(f"Unknown conversion engine: {engine!r}")
+        self.engine = engine
+        self.template = template
+        self.reused = 0
+        self.regenerated = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the previous document so the next conversion starts from scratch."""
+        self.doc = None
+        self._fingerprints = []
+        self._elements = []
+
+    def convert(self, md_content, cancel_event=None, metrics=None):
+        """Bring the document up to date with md_content and return it.
+
+        Falls back to a full ``convert_md_to_docx`` if the update fails; a
+        cancelled update discards the partially updated document.
+        """
+        try:
+            with metrics.profiling() if metrics is not None else nullcontext():
+                doc = self._update(md_content, cancel_event, metrics)
+        except ConversionCancelled:
+            self.reset()
+            raise
+        except Exception:
+            self.reset()
+            return docx_utils.convert_md_to_docx(md_content, cancel_event, self.engine, self.template, metrics)
+        if metrics is not None:
+            metrics.count('input_chars', len(md_content))
+            metrics.count('blocks_reused', self.reused)
+            metrics.count('blocks_regenerated', self.regenerated)
+            docx_utils._count_document_parts(doc, metrics)
+        return doc
+
+    def _update(self, md_content, cancel_event, metrics):
+        with docx_utils._stage(metrics, 'split'):
+            blocks = docx_utils.split_markdown_blocks(md_content)
+            if blocks:
+                # Trailing spaces are dropped at the end of a document only, and
+                # the last block no longer ends it once the definitions follow
+                blocks[-1] = blocks[-1].rstrip()
+            # Reference definitions resolve links in any block, so every block sees
+            # them; they follow the block so its own first line still starts the text
+            definitions = docx_utils.reference_definitions(md_content)
+            suffix = '\n\n' + '\n'.join(definitions) if definitions else ''
+            fingerprints = [hashlib.sha1((block + suffix).encode('utf-8')).digest() for block in blocks]
+
+        if self.doc is None:
+            with docx_utils._stage(metrics, 'template'):
+                self.doc = docx_utils.new_document(self.template)
+        body = self.doc.element.body
+
+        elements = []
+        fresh = set()
+        removed = False
+        self.reused = self.regenerated = 0
+        matcher = SequenceMatcher(None, self._fingerprints, fingerprints, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                elements.extend(self._elements[i1:i2])
+                self.reused += i2 - i1
+                continue
+            for group in self._elements[i1:i2]:
+                removed = removed or bool(group)
+                for element in group:
+                    body.remove(element)
+                # Numbered lists each own a numbering definition, which goes with them
+                docx_utils._list_numbering(self.doc.part).release(self.doc.part, group)
+            for j in range(j1, j2):
+                # New blocks are emitted at the end of the body and moved below
+                tail = docx_utils._last_body_child(self.doc)
+                end = tail if tail is not None and tail.tag == docx_utils._SECT_PR_TAG else None
+                previous = end.getprevious() if end is not None else tail
+                docx_utils.append_markdown(self.doc, blocks[j] + suffix, cancel_event, self.engine, metrics)
+                elements.append(_elements_between(body, previous, end))
+                fresh.add(j)
+            self.regenerated += j2 - j1
+
+        # Walk backwards so each new block lands just before its successor
+        anchor = body.sectPr
+        for j in range(len(elements) - 1, -1, -1):
+            group = elements[j]
+            if j in fresh and anchor is not None:
+                for element in group:
+                    anchor.addprevious(element)
+            if group:
+                anchor = group[0]
+
+        if removed:
+            # Hyperlinks and images of removed blocks would otherwise stay in the package
+            docx_utils._drop_unused_relationships(self.doc)
+
+        self._fingerprints = fingerprints
+        self._elements = elements
+        return self.doc
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Load test the conversion service and report requests per second and latency."""
+
+import argparse
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import generate_markdown
+from service import DEFAULT_PORT, percentile
+
+
+def post_markdown(url, body, timeout):
+    """POST one document and return (HTTP status, seconds)."""
+    request = urllib.request.Request(url, data=body, method='POST',
+                                     headers={'Content-Type': 'text/markdown; charset=utf-8'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def run_load(url, body, requests, concurrency, timeout=60.0):
+    """Send requests from concurrency client threads; return (elapsed seconds, results)."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: post_markdown(url, body, timeout), range(requests)))
+    return time.perf_counter() - start, results
+
+
+def summarize(elapsed, results):
+    """Return a dict of throughput, status counts and latency percentiles for successful requests."""
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(seconds for status, seconds in results if status == 200)
+    return {
+        'requests': len(results),
+        'statuses': statuses,
+        'rps': statuses.get(200, 0) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default=f'http://127.0.0.1:{DEFAULT_PORT}/convert', help='Conversion endpoint')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='Total requests to send')
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='Client concurrency levels to test in turn')
+    parser.add_argument('--size', type=int, default=20_000, help='Approximate markdown size in characters')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus generator seed')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Client timeout per request in seconds')
+    args = parser.parse_args(argv)
+
+    body = generate_markdown(args.seed, args.size).encode('utf-8')
+    status, _ = post_markdown(args.url, body, args.timeout)
+    if status != 200:
+        print(f"Warm-up request to {args.url} failed with status {status}", file=sys.stderr)
+        return 1
+
+    print(f"{'clients':>8} {'requests':>9} {'ok':>6} {'429':>6} {'other':>6} {'rps':>8} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        summary = summarize(*run_load(args.url, body, args.requests, concurrency, args.timeout))
+        statuses = summary['statuses']
+        ok, rejected = statuses.get(200, 0), statuses.get(429, 0)
+        print(f"{concurrency:>8} {summary['requests']:>9} {ok:>6} {rejected:>6} "
+              f"{summary['requests'] - ok - rejected:>6} {summary['rps']:>8.1f} "
+              f"{summary['p50_ms']:>8.1f} {summary['p90_ms']:>8.1f} {summary['p99_ms']:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
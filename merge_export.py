@@ -0,0 +1,301 @@
+import copy
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlparse
+
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+
+import docx_utils
+
+# Heading levels listed in the table of contents by default
+DEFAULT_TOC_LEVELS = 3
+# Word ignores bookmark names longer than this
+_MAX_BOOKMARK_NAME = 40
+_SLUG_STRIP = re.compile(r'[^\w\- ]')
+_BOOKMARK_SAFE = re.compile(r'[A-Za-z0-9_]+')
+
+
+def slugify(text):
+    """Return the anchor GitHub generates for a heading's text."""
+    return _SLUG_STRIP.sub('', text.strip().lower()).replace(' ', '-')
+
+
+def _bookmark_name(chapter, slug=None):
+    """Return the bookmark for a heading slug in a chapter, or for the chapter's start."""
+    prefix = f'_c{chapter}'
+    if slug is None:
+        return prefix
+    name = f'{prefix}_{slug.replace("-", "_")}'
+    if len(name) > _MAX_BOOKMARK_NAME or not _BOOKMARK_SAFE.fullmatch(name):
+        name = f'{prefix}_{hashlib.sha1(slug.encode("utf-8")).hexdigest()[:16]}'
+    return name
+
+
+def _bookmark_xml(bookmark_id, name):
+    return (parse_xml(f'<w:bookmarkStart {nsdecls("w")} w:id="{bookmark_id}" w:name="{name}"/>'),
+            parse_xml(f'<w:bookmarkEnd {nsdecls("w")} w:id="{bookmark_id}"/>'))
+
+
+class HeadingIndex:
+    """Headings of a merged document, collected while its blocks are emitted.
+
+    The emitters find the index on the document part as ``_heading_index``.
+    Each heading is bookmarked under a name derived from its chapter and
+    GitHub-style slug, made unique within the document, so a link can be
+    resolved to the same name before or after its target is written:
+    ``#slug`` points into the current chapter, ``chapter.md#slug`` and
+    ``chapter.md`` into another one.
+    """
+
+    def __init__(self, chapter_names=(), chapter_paths=None):
+        self.entries = []
+        self.contents_marker = None
+        self.chapter = 0
+        self._chapter_dirs = []
+        self._paths = {}
+        self._names = {}
+        for number, name in enumerate(chapter_names):
+            path = chapter_paths[number] if chapter_paths is not None else None
+            if path is not None:
+                path = os.path.abspath(path)
+                self._paths.setdefault(os.path.normcase(path), number)
+            self._chapter_dirs.append(os.path.dirname(path) if path is not None else None)
+            self._names.setdefault(os.path.basename(name).lower(), []).append(number)
+        self._slugs = {}
+        self._used = set()
+        self._next_id = 0
+
+    def begin_chapter(self, doc, number):
+        """Start a chapter, bookmarking its beginning at the end of the document."""
+        self.chapter = number
+        self._slugs = {}
+        for element in self._bookmark(_bookmark_name(number)):
+            docx_utils._append_body_element(doc, element)
+
+    def add(self, paragraph, level, text):
+        """Record a heading paragraph and bookmark it."""
+        slug = base = slugify(text)
+        count = self._slugs.get(base, 0)
+        if count:
+            slug = f'{base}-{count}'
+        self._slugs[base] = count + 1
+        start, end = self._bookmark(_bookmark_name(self.chapter, slug))
+        name = start.get(qn('w:name'))
+        p = paragraph._p
+        if p.pPr is not None:
+            p.pPr.addnext(start)
+        else:
+            p.insert(0, start)
+        p.append(end)
+        self.entries.append((level, text, name))
+
+    def mark_contents(self, paragraph):
+        """Use paragraph as the place for the table of contents (the first marker wins)."""
+        if self.contents_marker is None:
+            self.contents_marker = paragraph._p
+
+    def anchor(self, url):
+        """Return the bookmark an internal link points to, or None for any other link."""
+        parsed = urlparse(url)
+        if parsed.scheme or parsed.netloc:
+            return None
+        path, fragment = unquote(parsed.path), unquote(parsed.fragment)
+        if not path:
+            chapter = self.chapter if fragment else None
+        else:
+            chapter = self._find_chapter(path)
+        if chapter is None:
+            return None
+        return _bookmark_name(chapter, fragment or None)
+
+    def _find_chapter(self, path):
+        directory = self._chapter_dirs[self.chapter] if self.chapter < len(self._chapter_dirs) else None
+        if directory is not None:
+            number = self._paths.get(os.path.normcase(os.path.normpath(os.path.join(directory, path))))
+            if number is not None:
+                return number
+        candidates = self._names.get(os.path.basename(path).lower(), ())
+        return candidates[0] if len(candidates) == 1 else None
+
+    def _bookmark(self, name):
+        # Distinct slugs can still share a name ("a-b" and "a_b", or a heading
+        # "Install 1" after a repeated "Install"), so later ones get a suffix;
+        # links resolve to the first
+        unique = name
+        count = 1
+        while unique in self._used:
+            count += 1
+            suffix = f'_{count}'
+            unique = name[:_MAX_BOOKMARK_NAME - len(suffix)] + suffix
+        self._used.add(unique)
+        bookmark_id = self._next_id
+        self._next_id += 1
+        return _bookmark_xml(bookmark_id, unique)
+
+
+def _toc_style_id(doc, level):
+    """Return the styleId of Word's built-in 'toc N' style, adding it if the document lacks it."""
+    styles = doc.part.styles.element
+    style = styles.get_by_name(f'toc {level}')
+    if style is not None:
+        return style.styleId
+    style_id = f'TOC{level}'
+    styles.append(parse_xml(
+        f'<w:style {nsdecls("w")} w:type="paragraph" w:styleId="{style_id}">'
+        f'<w:name w:val="toc {level}"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+        f'<w:uiPriority w:val="39"/><w:unhideWhenUsed/><w:pPr><w:spacing w:after="100"/>'
+        f'<w:ind w:left="{220 * (level - 1)}"/></w:pPr></w:style>'
+    ))
+    return style_id
+
+
+def _field_run(xml):
+    return f'<w:r>{xml}</w:r>'
+
+
+def insert_contents(doc, index, levels=DEFAULT_TOC_LEVELS):
+    """Write a table of contents from the heading index at its marker or the start of the document.
+
+    The entries are the cached result of a Word TOC field, so they link to
+    their headings straight away and Word can refresh them with page
+    numbers (Update Field). Returns the number of entries written.
+    """
+    entries = [entry for entry in index.entries if entry[0] <= levels]
+    marker = index.contents_marker
+    if not entries:
+        if marker is not None:
+            marker.getparent().remove(marker)
+        return 0
+    hyperlink_style = docx_utils._style_ids(doc.part)['Hyperlink']
+    paragraphs = []
+    title_style = doc.part.styles.element.get_by_name('TOC Heading')
+    title_ppr = f'<w:pPr><w:pStyle w:val="{title_style.styleId}"/></w:pPr>' if title_style is not None else ''
+    paragraphs.append(f'<w:p {nsdecls("w")}>{title_ppr}<w:r><w:t>Contents</w:t></w:r></w:p>')
+    style_ids = {}
+    for number, (level, text, name) in enumerate(entries):
+        style_id = style_ids.get(level)
+        if style_id is None:
+            style_id = style_ids[level] = _toc_style_id(doc, level)
+        begin = end = ''
+        if number == 0:
+            begin = (_field_run('<w:fldChar w:fldCharType="begin"/>')
+                     + _field_run(f'<w:instrText xml:space="preserve"> TOC \\o "1-{levels}" \\h \\z \\u </w:instrText>')
+                     + _field_run('<w:fldChar w:fldCharType="separate"/>'))
+        if number == len(entries) - 1:
+            end = _field_run('<w:fldChar w:fldCharType="end"/>')
+        paragraphs.append(
+            f'<w:p {nsdecls("w")}><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>{begin}'
+            f'<w:hyperlink w:anchor="{name}" w:history="1"><w:r><w:rPr><w:rStyle w:val="{hyperlink_style}"/>'
+            f'</w:rPr>{docx_utils._run_content_xml(text)}</w:r></w:hyperlink>{end}</w:p>'
+        )
+    anchor = marker if marker is not None else doc.element.body[0]
+    for xml in paragraphs:
+        anchor.addprevious(parse_xml(xml))
+    if marker is not None:
+        marker.getparent().remove(marker)
+    return len(entries)
+
+
+def _add_section_break(doc):
+    """End the current section with a copy of the document's page setup, starting a new page."""
+    section = docx_utils._last_body_child(doc)
+    properties = copy.deepcopy(section) if section is not None and section.tag == qn('w:sectPr') else None
+    paragraph = docx_utils._add_paragraph(doc)
+    if properties is not None:
+        paragraph._p.get_or_add_pPr().append(properties)
+
+
+def _source_path(source):
+    return os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+
+
+def _parse_chapter(source, engine):
+    """Read and parse one chapter; runs in a worker process when merging in parallel.
+
+    The 'soup' engine returns rendered HTML, which is cheaper to send back
+    than a BeautifulSoup tree; the main process finishes it with parse_html.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r', encoding='utf-8') as f:
+            md_content = f.read()
+    else:
+        md_content = source[1]
+    if engine == 'soup':
+        return docx_utils.markdown_to_html(md_content)
+    return docx_utils.parse_markdown(md_content, engine)
+
+
+def _init_worker():
+    docx_utils._get_markdown()
+
+
+def _iter_parsed(sources, engine, workers):
+    if workers and workers > 0 and len(sources) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(sources)), initializer=_init_worker)
+        try:
+            # Results arrive in order, so emitting a chapter overlaps parsing the next ones
+            yield from pool.map(_parse_chapter, sources, [engine] * len(sources))
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        for source in sources:
+            yield _parse_chapter(source, engine)
+
+
+def merge_markdown(sources, template=None, engine='soup', workers=None, toc_levels=DEFAULT_TOC_LEVELS,
+                   section_breaks=True, cancel_event=None, metrics=None):
+    """Convert an ordered list of markdown chapters into a single Word document.
+
+    Each source is a file path or a ``(name, md_content)`` pair. Chapters
+    are parsed across ``workers`` processes (default: one per CPU beyond the
+    one emitting; 0 parses in this process) and emitted in order into one
+    document, each after a section break when ``section_breaks`` is set.
+    Headings are bookmarked and indexed in that single pass; the index
+    resolves links between chapters and becomes a table of contents of
+    levels up to ``toc_levels`` (0 for none), placed where a chapter has a
+    ``[TOC]`` paragraph or else at the start. Errors propagate to the caller.
+    """
+    if engine not in docx_utils.ENGINES:
+        raise ValueError(f"Unknown conversion engine: {engine!r}")
+    if workers is None:
+        workers = (os.cpu_count() or 1) - 1
+    sources = list(sources)
+    paths = [_source_path(source) for source in sources]
+    names = [path if path is not None else source[0] for path, source in zip(paths, sources)]
+    with docx_utils._stage(metrics, 'template'):
+        doc = docx_utils.new_document(template)
+    index = doc.part._heading_index = HeadingIndex(names, paths)
+    parsed = _iter_parsed(sources, engine, workers)
+    try:
+        for number, path in enumerate(paths):
+            if cancel_event is not None and cancel_event.is_set():
+                raise docx_utils.ConversionCancelled()
+            with docx_utils._stage(metrics, 'wait'):
+                result = next(parsed)
+            root = docx_utils.parse_html(result, metrics) if engine == 'soup' else result
+            if number and section_breaks:
+                _add_section_break(doc)
+            index.begin_chapter(doc, number)
+            image_dir = os.path.dirname(os.path.abspath(path)) if path is not None else None
+            with docx_utils._stage(metrics, 'emit'):
+                docx_utils._emit_blocks(doc, root, cancel_event, metrics, image_dir)
+        with docx_utils._stage(metrics, 'contents'):
+            if toc_levels:
+                insert_contents(doc, index, toc_levels)
+            elif index.contents_marker is not None:
+                index.contents_marker.getparent().remove(index.contents_marker)
+    finally:
+        parsed.close()
+        del doc.part._heading_index
+    if metrics is not None:
+        metrics.count('chapters', len(sources))
+        metrics.count('headings', len(index.entries))
+    return doc
+
+
+def save_merged(sources, target, compression='default', **options):
+    """Merge sources (see merge_markdown) and write the .docx to a file path or binary stream."""
+    docx_utils.save_docx(merge_markdown(sources, **options), target, compression)
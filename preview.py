@@ -0,0 +1,85 @@
+import hashlib
+import re
+from collections import namedtuple
+
+# Documents longer than this many characters get the sectioned preview
+LARGE_DOCUMENT_CHARS = 200_000
+# Sections are split further at block boundaries beyond this size
+MAX_SECTION_CHARS = 50_000
+# Characters of markdown rendered per page of the sectioned preview
+PAGE_CHARS = 100_000
+
+_ATX_HEADING = re.compile(r' {0,3}(#{1,6})(?:[ \t]+|$)(.*?)[ \t#]*$')
+_SETEXT_UNDERLINE = re.compile(r' {0,3}(=+|-+)[ \t]*$')
+
+Section = namedtuple('Section', 'title level text digest')
+
+
+def _heading(block):
+    """Return (level, title) if a block starts with an ATX or setext heading, else None."""
+    lines = block.split('\n', 2)
+    match = _ATX_HEADING.match(lines[0])
+    if match:
+        return len(match.group(1)), match.group(2).strip()
+    if len(lines) > 1 and lines[0].strip() and _SETEXT_UNDERLINE.match(lines[1]):
+        return (1 if lines[1].strip()[0] == '=' else 2), lines[0].strip()
+    return None
+
+
+def split_sections(md_content, max_level=3, max_chars=MAX_SECTION_CHARS):
+    """Split markdown into sections starting at headings of level max_level or above.
+
+    Splits happen only between top-level blocks, so fenced code and raw HTML
+    stay intact. Sections longer than max_chars are cut into continuation
+    parts. Link reference definitions are repeated in every section so each
+    one renders on its own. Each section carries a digest of its text.
+    """
+    # Imported here so the app can read the constants above without loading the converter
+    import docx_utils
+
+    definitions = docx_utils.reference_definitions(md_content)
+    prefix = '\n'.join(definitions) + '\n\n' if definitions else ''
+    sections = []
+    title, level, blocks, size, part = 'Start', 0, [], 0, 1
+
+    def close():
+        if blocks:
+            text = '\n\n'.join(blocks)
+            label = title if part == 1 else f'{title} (part {part})'
+            digest = hashlib.sha1((prefix + text).encode('utf-8')).hexdigest()
+            sections.append(Section(label, level, text, digest))
+
+    for block in docx_utils.split_markdown_blocks(md_content):
+        heading = _heading(block)
+        if heading is not None and heading[0] <= max_level:
+            close()
+            (level, title), blocks, size, part = heading, [], 0, 1
+        elif blocks and size + len(block) > max_chars:
+            close()
+            blocks, size, part = [], 0, part + 1
+        blocks.append(block)
+        size += len(block) + 2
+    close()
+    if prefix:
+        sections = [section._replace(text=prefix + section.text) for section in sections]
+    return sections
+
+
+def page_bounds(sections, start, page_chars=PAGE_CHARS):
+    """Return the end index of a page that starts at start and holds about page_chars characters."""
+    end = start
+    total = 0
+    while end < len(sections) and (end == start or total + len(sections[end].text) <= page_chars):
+        total += len(sections[end].text)
+        end += 1
+    return end
+
+
+def previous_page_start(sections, start, page_chars=PAGE_CHARS):
+    """Return the start index of the page that ends just before start."""
+    begin = start
+    total = 0
+    while begin > 0 and (begin == start or total + len(sections[begin - 1].text) <= page_chars):
+        total += len(sections[begin - 1].text)
+        begin -= 1
+    return begin
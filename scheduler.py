@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Defaults, overridable with MARKDOWN_VIEWER_MAX_CONVERSIONS, _MAX_CHARS and _TIME_LIMIT
+DEFAULT_MAX_CONVERSIONS = max(1, (os.cpu_count() or 1) - 1)
+DEFAULT_MAX_CHARS = 2_000_000
+DEFAULT_TIME_LIMIT = 60.0
+# Number of recent queue waits kept for the load summary
+WAIT_SAMPLES = 256
+# Number of sessions whose last queue wait is remembered
+WAIT_SESSIONS = 1024
+# Seconds after which a session's past conversion time counts half as much
+USAGE_HALF_LIFE = 60.0
+
+
+class ConversionLimitExceeded(Exception):
+    """Raised when a conversion is refused or stopped for exceeding a size or time limit."""
+
+
+class _Ticket:
+    """One request waiting for a conversion slot."""
+
+    __slots__ = ('granted', 'queued')
+
+    def __init__(self):
+        self.granted = False
+        self.queued = time.perf_counter()
+
+
+class ConversionScheduler:
+    """Process-wide admission control for conversions from many sessions.
+
+    At most ``max_concurrent`` conversions run at once. Waiting requests are
+    queued per session, and a free slot goes to the waiting session that has
+    used the least conversion time recently, so a light editor is served
+    before sessions busy with large documents and no session can starve the
+    others. Inputs longer than ``max_chars`` are refused up front. A
+    running conversion that exceeds ``time_limit`` seconds is stopped
+    through its cancel event, which the converter checks between blocks.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONVERSIONS, max_chars=DEFAULT_MAX_CHARS,
+                 time_limit=DEFAULT_TIME_LIMIT):
+        self.max_concurrent = max_concurrent
+        self.max_chars = max_chars
+        self.time_limit = time_limit
+        self.running = 0
+        self.last_wait = OrderedDict()
+        self._queues = OrderedDict()
+        self._usage = {}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._condition = threading.Condition()
+
+    @property
+    def queued(self):
+        """Number of requests waiting for a slot."""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def check_size(self, size, max_size=None):
+        """Raise ConversionLimitExceeded if size (in characters) is over the limit.
+
+        A size of None is not checked.
+        """
+        limit = self.max_chars if max_size is None else max_size
+        if size is not None and limit is not None and size > limit:
+            raise ConversionLimitExceeded(
+                f"The document has {size:,} characters; conversions are limited to {limit:,}.")
+
+    def run(self, session_id, func, size, cancel_event=None, max_size=None, time_limit=None):
+        """Wait for a slot, then return func(cancel_event) with the time limit enforced.
+
+        ``cancel_event`` (a ``threading.Event``) abandons the request while it
+        is queued and is set when the time limit expires; one is created if
+        not given. The wait is recorded in ``last_wait[session_id]`` for the
+        WAIT_SESSIONS sessions that converted most recently. Raises
+        ConversionLimitExceeded for oversized input or a conversion that ran
+        out of time, and ConversionCancelled if cancelled while queued.
+        """
+        # Imported here so the app can create the scheduler without loading the converter
+        from docx_utils import ConversionCancelled
+
+        self.check_size(size, max_size)
+        cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        ticket = _Ticket()
+        with self._condition:
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._dispatch_locked()
+            while not ticket.granted:
+                if cancel_event.is_set():
+                    self._withdraw_locked(session_id, ticket)
+                    raise ConversionCancelled()
+                self._condition.wait(0.1)
+            waited = time.perf_counter() - ticket.queued
+            self.last_wait[session_id] = waited
+            self.last_wait.move_to_end(session_id)
+            # Forget the sessions that converted least recently, which are mostly closed
+            while len(self.last_wait) > WAIT_SESSIONS:
+                self.last_wait.popitem(last=False)
+            self._waits.append(waited)
+
+        limit = self.time_limit if time_limit is None else time_limit
+        expired = threading.Event()
+        timer = None
+        if limit is not None:
+            timer = threading.Timer(limit, lambda: (expired.set(), cancel_event.set()))
+            timer.daemon = True
+            timer.start()
+        started = time.perf_counter()
+        try:
+            return func(cancel_event)
+        except ConversionCancelled:
+            if expired.is_set():
+                raise ConversionLimitExceeded(
+                    f"The conversion was stopped after {limit:g} seconds, the time limit per document.")
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self._condition:
+                self.running -= 1
+                self._charge_locked(session_id, time.perf_counter() - started)
+                self._dispatch_locked()
+
+    def snapshot(self):
+        """Return running and queued counts and recent queue waits in seconds."""
+        with self._condition:
+            waits = sorted(self._waits)
+            queued = sum(len(queue) for queue in self._queues.values())
+            running = self.running
+        return {
+            'running': running,
+            'queued': queued,
+            'max_concurrent': self.max_concurrent,
+            'wait_median': waits[len(waits) // 2] if waits else 0.0,
+            'wait_max': waits[-1] if waits else 0.0,
+        }
+
+    def _recent_usage_locked(self, session_id, now):
+        used, since = self._usage.get(session_id, (0.0, now))
+        return used * 0.5 ** ((now - since) / USAGE_HALF_LIFE)
+
+    def _charge_locked(self, session_id, seconds):
+        now = time.perf_counter()
+        self._usage[session_id] = (self._recent_usage_locked(session_id, now) + seconds, now)
+        # Drop sessions whose usage has decayed away so closed sessions do not accumulate
+        for other in [key for key in self._usage if self._recent_usage_locked(key, now) < 0.001]:
+            del self._usage[other]
+
+    def _dispatch_locked(self):
+        # Hand free slots to the session with the least recent usage; ties go
+        # round-robin because served sessions move to the back
+        granted = False
+        now = time.perf_counter()
+        while self.running < self.max_concurrent and self._queues:
+            session_id = min(self._queues, key=lambda key: self._recent_usage_locked(key, now))
+            queue = self._queues[session_id]
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            ticket.granted = True
+            self.running += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def _withdraw_locked(self, session_id, ticket):
+        queue = self._queues.get(session_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[session_id]
+
+
+def default_scheduler():
+    """Create a ConversionScheduler configured from the environment."""
+    time_limit = float(os.environ.get('MARKDOWN_VIEWER_TIME_LIMIT', DEFAULT_TIME_LIMIT))
+    return ConversionScheduler(
+        max_concurrent=int(os.environ.get('MARKDOWN_VIEWER_MAX_CONVERSIONS', DEFAULT_MAX_CONVERSIONS)),
+        max_chars=int(os.environ.get('MARKDOWN_VIEWER_MAX_CHARS', DEFAULT_MAX_CHARS)),
+        time_limit=time_limit if time_limit > 0 else None,
+    )
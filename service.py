@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Headless HTTP service that converts Markdown to Word documents.
+
+POST markdown text to /convert and receive the .docx bytes. Optional query
+parameters: engine (soup or etree) and compression (stored, fast, default
+or max). GET /metrics returns throughput and latency as JSON and GET
+/healthz reports whether the worker pool is accepting work.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import docx_utils
+
+DEFAULT_PORT = 8502
+# Requests allowed to wait for a worker before new ones are turned away
+DEFAULT_QUEUE_DEPTH = 16
+# Seconds a request may spend queued and converting before it times out
+DEFAULT_TIMEOUT = 30.0
+# Largest markdown body accepted (5 MB)
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+# Number of recent latencies kept for percentiles
+LATENCY_SAMPLES = 2048
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Template used by every conversion in a worker process
+_worker_template = None
+
+
+def _init_worker(template):
+    """Load per-process converter state once, before any request is converted."""
+    global _worker_template
+    _worker_template = template
+    docx_utils.load_template(template)
+    docx_utils._get_markdown()
+
+
+def _convert(md_content, engine, compression, deadline=None):
+    """Convert markdown to DOCX bytes inside a worker process.
+
+    A conversion still running at ``deadline`` (a time.time() value) is
+    cancelled between blocks, so a request that timed out frees its worker.
+    """
+    cancel_event = threading.Event()
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(max(0.0, deadline - time.time()), cancel_event.set)
+        timer.daemon = True
+        timer.start()
+    try:
+        doc = docx_utils.convert_md_to_docx(md_content, cancel_event, engine, _worker_template)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if doc is None:
+        raise RuntimeError("conversion failed")
+    data = docx_utils.get_docx_bytes(doc, compression=compression)
+    if data is None:
+        # Fail the request rather than answer 200 with no body
+        raise RuntimeError("saving the document failed")
+    return data
+
+
+class ServiceSaturated(Exception):
+    """Raised when every worker is busy and the queue is full."""
+
+
+class ServiceUnavailable(Exception):
+    """Raised when the worker pool is shut down or broken."""
+
+
+class ServiceMetrics:
+    """Thread-safe request counters with recent latencies and completion times."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.statuses = {}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._completed = deque()
+        self._lock = threading.Lock()
+
+    def record(self, status, seconds):
+        """Record one finished request with its HTTP status and latency."""
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self._latencies.append(seconds)
+                self._completed.append(now)
+            # Keep one minute of completions for the recent throughput figure
+            while self._completed and self._completed[0] < now - 60:
+                self._completed.popleft()
+
+    def snapshot(self, in_flight=0):
+        """Return counters, throughput and latency percentiles as a dict."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            completed = len(self._completed)
+            statuses = dict(self.statuses)
+            requests = self.requests
+        uptime = time.time() - self.started
+        return {
+            'uptime_seconds': round(uptime, 1),
+            'requests': requests,
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'in_flight': in_flight,
+            'throughput_rps': round(completed / min(uptime, 60), 2) if uptime else 0.0,
+            'latency_ms': {
+                name: round(percentile(latencies, q) * 1000, 1)
+                for name, q in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('max', 1.0))
+            },
+        }
+
+
+def percentile(sorted_values, q):
+    """Return the q-quantile (0..1) of already sorted values, or 0.0 when empty."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ConversionService:
+    """Bounded process pool for conversions with a queue-depth limit.
+
+    At most ``workers + queue_depth`` conversions are admitted at once;
+    ``submit`` raises ServiceSaturated beyond that instead of queueing
+    without bound. A slot is freed only when its conversion really ends,
+    which for a request that timed out is at its next block boundary.
+    """
+
+    def __init__(self, workers=None, queue_depth=DEFAULT_QUEUE_DEPTH, timeout=DEFAULT_TIMEOUT,
+                 max_bytes=DEFAULT_MAX_BYTES, template=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(self.workers + queue_depth)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.closed = False
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(template,))
+
+    @property
+    def in_flight(self):
+        """Number of admitted conversions that have not finished yet."""
+        return self._in_flight
+
+    def submit(self, md_content, engine='soup', compression='default', deadline=None):
+        """Queue a conversion and return its future, or raise if the service cannot take it.
+
+        The conversion is cancelled if it is still running at ``deadline`` (see _convert).
+        """
+        if self.closed:
+            raise ServiceUnavailable("service is shutting down")
+        if not self._slots.acquire(blocking=False):
+            raise ServiceSaturated("all workers busy and queue full")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._pool.submit(_convert, md_content, engine, compression, deadline)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._release()
+            raise ServiceUnavailable(str(e))
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def convert(self, md_content, engine='soup', compression='default'):
+        """Convert and wait up to the service timeout; raises TimeoutError when it expires."""
+        future = self.submit(md_content, engine, compression, time.time() + self.timeout)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop it if it never reached a worker; a running one stops at the deadline
+            future.cancel()
+            raise
+        except docx_utils.ConversionCancelled:
+            # The deadline passed just before the wait ran out
+            raise TimeoutError()
+        except BrokenProcessPool as e:
+            raise ServiceUnavailable(str(e))
+
+    def close(self):
+        """Stop admitting work and shut the pool down."""
+        self.closed = True
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes requests to the ConversionService attached to the server."""
+
+    server_version = 'MarkdownViewerService/1.0'
+    # perf_counter() at the start of the conversion request being answered
+    _started = None
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._send_json(200, self.service.metrics.snapshot(self.service.in_flight))
+        elif path == '/healthz':
+            healthy = not self.service.closed
+            self._send_json(200 if healthy else 503, {'status': 'ok' if healthy else 'unavailable'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self._send_json(404, {'error': 'not found'})
+            return
+        self._started = time.perf_counter()
+        self._handle_convert(parse_qs(url.query))
+
+    def _handle_convert(self, query):
+        engine = query.get('engine', ['soup'])[0]
+        compression = query.get('compression', ['default'])[0]
+        if engine not in docx_utils.ENGINES or compression not in docx_utils.COMPRESSION_MODES:
+            return self._send_json(400, {'error': 'unknown engine or compression'})
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return self._send_json(411, {'error': 'Content-Length required'})
+        if length < 0:
+            # rfile.read(-1) would read to the end of the stream, past the size limit
+            return self._send_json(400, {'error': 'invalid Content-Length'})
+        if length > self.service.max_bytes:
+            return self._send_json(413, {'error': f'body larger than {self.service.max_bytes} bytes'})
+        try:
+            md_content = self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError:
+            return self._send_json(400, {'error': 'body must be UTF-8 markdown'})
+
+        try:
+            data = self.service.convert(md_content, engine, compression)
+        except ServiceSaturated as e:
+            return self._send_json(429, {'error': str(e)}, {'Retry-After': '1'})
+        except ServiceUnavailable as e:
+            return self._send_json(503, {'error': str(e)}, {'Retry-After': '5'})
+        except TimeoutError:
+            return self._send_json(504, {'error': f'conversion exceeded {self.service.timeout}s'})
+        except Exception as e:
+            return self._send_json(500, {'error': f'{type(e).__name__}: {e}'})
+
+        return self._send(200, DOCX_MIME, data, {'Content-Disposition': 'attachment; filename="document.docx"'})
+
+    def _send_json(self, status, payload, headers=None):
+        return self._send(status, 'application/json', json.dumps(payload).encode('utf-8'), headers)
+
+    def _send(self, status, content_type, body, headers=None):
+        if self._started is not None:
+            # Record before replying so a client reading /metrics next sees this request
+            self.service.metrics.record(status, time.perf_counter() - self._started)
+            self._started = None
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, quiet=False):
+    """Create (but do not start) an HTTP server bound to host:port for the service."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help='Requests allowed to wait for a worker before answering 429')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='Seconds per request, queueing included, before answering 504')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES, help='Largest accepted request body')
+    parser.add_argument('--template', help='.docx/.dotx template providing styles and page setup')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not log each request')
+    args = parser.parse_args(argv)
+
+    template = os.path.abspath(args.template) if args.template else None
+    service = ConversionService(args.workers, args.queue_depth, args.timeout, args.max_bytes, template)
+    server = make_server(service, args.host, args.port, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_port} with {service.workers} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
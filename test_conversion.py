@@ -40,5 +40,780 @@ def test_conversion():
 
     return False
 
+def test_conversion_cache():
+    from conversion_cache import ConversionCache
+
+    cache = ConversionCache(max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    assert cache.get('a') == b'12345'
+    # Adding a third entry evicts the least recently used one ('b')
+    cache.put('c', b'123')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.size <= 10
+
+    # The image cache shares the same LRU and counts its own lookups
+    from image_utils import ImageCache
+    images = ImageCache(max_bytes=10)
+    images.put('a', b'12345')
+    images.put('b', b'123456')
+    assert images.get('a') is None and images.get('b') == b'123456'
+    assert (images.hits, images.misses) == (1, 1)
+
+    cache = ConversionCache()
+    first = cache.get_or_convert('# Title\n\nBody text')
+    second = cache.get_or_convert('# Title\n\nBody text')
+    assert first and first is second
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_block_walk_scales_linearly():
+    from bs4 import BeautifulSoup
+    from docx_utils import _iter_top_level_blocks
+
+    class CountingList(list):
+        visits = 0
+
+        def __iter__(self):
+            for item in list.__iter__(self):
+                CountingList.visits += 1
+                yield item
+
+    def count_children(node):
+        if not isinstance(node, str):
+            node.contents = CountingList(node.contents)
+            for child in node.contents:
+                count_children(child)
+
+    def build(n):
+        # Blocks buried in raw wrappers with deeply nested lists and quotes
+        nested = '<blockquote>' * 20 + '<p>q</p>' + '</blockquote>' * 20
+        nested += '<ul><li>a' * 20 + '</li></ul>' * 20
+        return BeautifulSoup(''.join(
+            f'<div><div><h2>Title {i}</h2><p>para {i}</p>{nested}</div></div>' for i in range(n)
+        ), 'html.parser')
+
+    small, large = build(250), build(1000)
+    assert [b.name for b in _iter_top_level_blocks(small)][:4] == ['h2', 'p', 'blockquote', 'ul']
+    assert len(list(_iter_top_level_blocks(large))) == 4 * 1000
+
+    # Nodes inside blocks are never visited, however deeply they nest, so
+    # four times the blocks means exactly four times the visits
+    for tree in (small, large):
+        count_children(tree)
+    CountingList.visits = 0
+    list(_iter_top_level_blocks(small))
+    small_visits = CountingList.visits
+    CountingList.visits = 0
+    list(_iter_top_level_blocks(large))
+    assert CountingList.visits == 4 * small_visits
+
+def _body_xml(doc):
+    """Serialize a document body with hyperlink ids replaced by their targets and list ids by their order."""
+    import re
+    from lxml import etree
+
+    targets = {r_id: rel.target_ref for r_id, rel in doc.part.rels.items() if rel.is_external}
+    xml = etree.tostring(doc.element.body).decode('utf-8')
+    xml = re.sub(r'r:id="(rId\d+)"', lambda m: 'href="%s"' % targets.get(m.group(1), m.group(1)), xml)
+    lists = {}
+    return re.sub(r'<w:numId w:val="(\d+)"/>',
+                  lambda m: '<w:numId list="%d"/>' % lists.setdefault(m.group(1), len(lists)), xml)
+
+def test_engines_produce_identical_documents():
+    from docx_utils import convert_md_to_docx
+
+    with open('sample.md', 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    md_content += "\n\nAT&amp;T <span>raw https://example.com/x</span> &copy; `a < b`\n"
+    soup_doc = convert_md_to_docx(md_content, engine='soup')
+    etree_doc = convert_md_to_docx(md_content, engine='etree')
+    assert _body_xml(soup_doc) == _body_xml(etree_doc)
+
+def test_table_builder_layout():
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx_utils import convert_md_to_docx
+
+    doc = convert_md_to_docx("| ID | Date | Note |\n|---|---|---|\n| 7 | Jan 3 | some text |\n| 8 |")
+    table = doc.tables[0]
+    assert len(table.rows) == 3 and len(table.columns) == 3
+    assert [cell.text for cell in table.rows[1].cells] == ['7', 'Jan 3', 'some text']
+    assert table.style.name == 'Markdown Table'
+    header = table.rows[0].cells[0]
+    assert header.paragraphs[0].style.name == 'Table Header'
+    assert header.paragraphs[0].style.font.bold
+    assert header._tc.tcPr.xpath('./w:shd/@w:fill') == ['E7E6E6']
+    # Formatting lives in the styles, so cells carry no borders or run properties
+    assert not table._tbl.xpath('.//w:tcBorders | .//w:r/w:rPr')
+    alignments = [cell.paragraphs[0].alignment for cell in table.rows[1].cells]
+    assert alignments == [None, WD_ALIGN_PARAGRAPH.CENTER, None]
+
+def test_shared_styles_and_template_reuse(tmp_path):
+    from docx import Document
+    from docx.shared import RGBColor
+    from docx_utils import new_document
+
+    doc = convert_md_to_docx("Use `code` and https://example.com\n\n```\nblock\n```")
+    paragraph = doc.paragraphs[0]
+    assert paragraph.runs[1].style.name == 'Code Char'
+    assert paragraph._p.xpath('./w:hyperlink/w:r/w:rPr/w:rStyle/@w:val') == ['Hyperlink']
+    assert not paragraph._p.xpath('.//w:color | .//w:u')
+    assert doc.paragraphs[1].style.name == 'Code Block'
+
+    # A template's own definition of a converter style is kept
+    template = Document()
+    template.styles.add_style('Code Char', 2).font.color.rgb = RGBColor(0xC0, 0, 0)
+    path = str(tmp_path / "styled.docx")
+    template.save(path)
+    styled = new_document(path)
+    assert styled.styles['Code Char'].font.color.rgb == RGBColor(0xC0, 0, 0)
+    assert len([style for style in styled.styles if style.name == 'Code Char']) == 1
+    assert styled.styles['Table Cell'].font.name == 'Arial'
+
+def test_template_cache(tmp_path):
+    import zipfile
+    from docx import Document
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx_utils import convert_md_to_docx, load_template
+
+    # Build a .dotx with a custom style and some body text that must not carry over
+    source = Document()
+    source.styles.add_style('Corporate Body', WD_STYLE_TYPE.PARAGRAPH)
+    source.add_paragraph('Template boilerplate')
+    docx_path = tmp_path / 'corporate.docx'
+    source.save(docx_path)
+    dotx_path = tmp_path / 'corporate.dotx'
+    with zipfile.ZipFile(docx_path) as src, zipfile.ZipFile(dotx_path, 'w') as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename == '[Content_Types].xml':
+                data = data.replace(b'document.main+xml', b'template.main+xml')
+            dst.writestr(item, data)
+
+    first = convert_md_to_docx('# One', template=str(dotx_path))
+    second = convert_md_to_docx('# Two', template=str(dotx_path))
+    assert [p.text for p in first.paragraphs] == ['One']
+    assert [p.text for p in second.paragraphs] == ['Two']
+    assert 'Corporate Body' in [style.name for style in second.styles]
+    # The cached base document stays empty and is shared between conversions
+    assert load_template(str(dotx_path)) is load_template(str(dotx_path))
+    assert load_template(str(dotx_path)).paragraphs == []
+
+def test_sanitizer():
+    from docx_utils import TextSanitizer, sanitize_content_for_word
+
+    assert sanitize_content_for_word('') == ''
+    assert sanitize_content_for_word('  Ship it \U0001F680  now\u2026 ') == 'Ship it now...'
+    assert sanitize_content_for_word('\u201CQuote\u201D \u2013 it\u2019s \u2014 fine') == '"Quote" - it\'s -- fine'
+    assert sanitize_content_for_word('a\n\n\n\nb\n\nc \U0001F600\u200d\U0001F4BB d') == 'a\n\nb\n\nc d'
+    # Indentation is kept, and emoji that start a line's text do not add to it
+    assert sanitize_content_for_word('- a\n    - b  c') == '- a\n    - b c'
+    assert sanitize_content_for_word('a\n   \U0001F600  b\n\U0001F680 c') == 'a\n   b\nc'
+    # Custom tables can map characters that would otherwise be stripped as emoji
+    custom = TextSanitizer({'\u2713': '[x]', '->': '\u2192'})
+    assert custom('done \u2713 -> next \u2705') == 'done [x] \u2192 next'
+
+def test_batch_convert(tmp_path):
+    import os
+    from batch_convert import find_markdown_files, run_batch
+
+    source_dir = tmp_path / 'docs'
+    (source_dir / 'guide').mkdir(parents=True)
+    (source_dir / 'intro.md').write_text('# Intro\n\nHello', encoding='utf-8')
+    (source_dir / 'guide' / 'setup.md').write_text('# Setup\n\n- step', encoding='utf-8')
+    output_dir = tmp_path / 'out'
+
+    sources = find_markdown_files([str(source_dir)])
+    results = run_batch(sources, str(output_dir), workers=1)
+    assert len(results['converted']) == 2 and not results['failed']
+    assert os.path.isfile(output_dir / 'guide' / 'setup.docx')
+
+    # Outputs newer than their sources are skipped on the next run
+    results = run_batch(sources, str(output_dir), workers=1)
+    assert len(results['skipped']) == 2 and not results['converted']
+
+def test_benchmark_corpus_and_regression_check():
+    from benchmark import compare_results, generate_markdown
+
+    first = generate_markdown(seed=3, size=2_000, list_depth=4)
+    assert first == generate_markdown(seed=3, size=2_000, list_depth=4)
+    assert first != generate_markdown(seed=4, size=2_000, list_depth=4)
+    assert len(first) >= 2_000
+
+    baseline = {'cases': {'medium': {'total': 1.0, 'stages': {'emit': 0.8, 'save': 0.2}}}}
+    current = {'cases': {'medium': {'total': 1.05, 'stages': {'emit': 0.8, 'save': 0.25}}}}
+    regressions = compare_results(baseline, current, threshold=0.10)
+    assert [(case, metric) for case, metric, *_ in regressions] == [('medium', 'stage:save')]
+
+def test_conversion_metrics():
+    import gc
+    from docx_utils import ConversionMetrics, convert_md_to_docx, get_docx_bytes
+
+    # A full collection of what earlier tests left behind would dominate the profile
+    gc.collect()
+    metrics = ConversionMetrics(profile=True)
+    doc = convert_md_to_docx(
+        "# Title\n\nSee https://example.com.\n\n| a | b |\n|---|---|\n| 1 | 2 |", metrics=metrics
+    )
+    docx_bytes = get_docx_bytes(doc, metrics=metrics)
+    for stage in ('sanitize', 'template', 'markdown', 'parse', 'linkify', 'emit', 'tables', 'save'):
+        assert stage in metrics.stages
+    assert metrics.counts['blocks'] == 3
+    assert metrics.counts['table_cells'] == 4
+    assert metrics.counts['hyperlinks'] == 1
+    assert metrics.counts['output_bytes'] == len(docx_bytes)
+    assert '_emit_blocks' in metrics.profile_report()
+
+def test_incremental_conversion_matches_full_rebuild():
+    from docx_utils import split_markdown_blocks
+    from incremental_convert import IncrementalConverter
+
+    assert split_markdown_blocks("# H\n\n- a\n\n- b\n\n```\nx\n\n\ny\n```\n\n<div>\n\nz\n\n</div>\n\nend") == [
+        "# H", "- a\n\n- b", "```\nx\n\n\ny\n```", "<div>\n\nz\n\n</div>", "end"]
+    # Void and self-closed elements open no HTML block, so later blank lines still split
+    assert split_markdown_blocks("# A\n\n<hr>\n\np1\n\n<img src=\"x.png\">\n\np2\n\n<div/>\n\np3") == [
+        "# A", "<hr>", "p1", '<img src="x.png">', "p2", "<div/>", "p3"]
+
+    with open('sample.md', 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    md_content += "\n\nSee [the docs][ref].\n\n<hr>\n\n[ref]: https://example.com/ref\n\n> one\n\n> two\n"
+    converter = IncrementalConverter()
+    versions = [
+        md_content,
+        md_content.replace("\n\n", "\n\nA new paragraph with https://example.com/new\n\n", 3),
+        md_content.replace("https://example.com/ref", "https://example.com/moved"),
+        md_content[:len(md_content) // 2],
+        # Indented first lines parse as in the whole document, whatever definitions exist
+        "    indented code\n\n[ref]: http://r.com\n\n3. three\n4. four",
+        # and definitions between blocks do not keep them from joining
+        "- a\n- b\n\n[ref]: http://r.com\n\n    more of b [r][ref]\n\n3. three\n",
+    ]
+    for version in versions:
+        doc = converter.convert(version)
+        assert _body_xml(doc) == _body_xml(convert_md_to_docx(version))
+
+    # A one-paragraph edit regenerates only that block
+    converter.convert(versions[0])
+    converter.convert(versions[0].replace("\n\n", "\n\nEdited.\n\n", 1))
+    assert converter.regenerated == 1
+    assert converter.reused > 10
+
+    # Removed blocks take their hyperlinks and images out of the package
+    import io
+    import zipfile
+
+    # A 1x1 PNG, embedded as it is with or without Pillow
+    data_uri = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGNgaGAAAAEEAIFw9selAAAAAElFTkSuQmCC"
+    converter.convert(f"Intro\n\nSee [gone](https://example.com/gone)\n\n![dot]({data_uri})\n\nEnd\n")
+    doc = converter.convert("Intro\n\nEnd\n")
+    full = convert_md_to_docx("Intro\n\nEnd\n")
+    assert len(list(doc.part.package.iter_parts())) == len(list(full.part.package.iter_parts()))
+    assert sorted(zipfile.ZipFile(io.BytesIO(get_docx_bytes(doc))).namelist()) == \
+        sorted(zipfile.ZipFile(io.BytesIO(get_docx_bytes(full))).namelist())
+    assert not any(rel.is_external for rel in doc.part.rels.values())
+    # The same link added back gets a live relationship again
+    doc = converter.convert("Intro\n\nSee [gone](https://example.com/gone)\n\nEnd\n")
+    assert _body_xml(doc) == _body_xml(convert_md_to_docx("Intro\n\nSee [gone](https://example.com/gone)\n\nEnd\n"))
+
+def test_streaming_save_and_compression(tmp_path):
+    import io
+    import zipfile
+    from docx import Document
+    from docx_utils import COMPRESSION_MODES, save_docx
+
+    with open('sample.md', 'r', encoding='utf-8') as f:
+        doc = convert_md_to_docx(f.read())
+    reference = io.BytesIO()
+    doc.save(reference)
+    expected = {name: zipfile.ZipFile(reference).read(name) for name in zipfile.ZipFile(reference).namelist()}
+
+    sizes = {}
+    for mode in COMPRESSION_MODES:
+        data = get_docx_bytes(doc, compression=mode)
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        assert {name: archive.read(name) for name in archive.namelist()} == expected
+        sizes[mode] = len(data)
+    assert sizes['stored'] > sizes['fast'] >= sizes['max']
+
+    class Unseekable(io.RawIOBase):
+        def __init__(self):
+            self.chunks = []
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+            return len(data)
+
+    stream = Unseekable()
+    save_docx(doc, stream, 'fast')
+    assert Document(io.BytesIO(b''.join(stream.chunks))).paragraphs
+
+def test_conversion_service(monkeypatch):
+    import io
+    import json
+    import threading
+    import urllib.error
+    import urllib.request
+    import pytest
+    import docx_utils
+    import service as service_module
+    from docx import Document
+    from service import ConversionService, make_server
+
+    # A document that cannot be saved fails the conversion instead of returning no body
+    with monkeypatch.context() as patch:
+        patch.setattr(docx_utils, 'get_docx_bytes', lambda *args, **kwargs: None)
+        with pytest.raises(RuntimeError):
+            service_module._convert("# Title\n", 'soup', 'default')
+
+    # A conversion still running at its deadline stops between blocks and frees its worker
+    import time
+    long_text = '\n\n'.join(f'Paragraph {i} with **bold** text.' for i in range(5000))
+    started = time.perf_counter()
+    with pytest.raises(docx_utils.ConversionCancelled):
+        service_module._convert(long_text, 'soup', 'default', time.time() + 0.05)
+    assert time.perf_counter() - started < 5
+
+    service = ConversionService(workers=1, queue_depth=0, timeout=60)
+    server = make_server(service, port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    body = "# Title\n\nSee https://example.com\n".encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base + "/convert?compression=fast", data=body)) as response:
+            assert response.status == 200
+            assert Document(io.BytesIO(response.read())).paragraphs[0].text == "Title"
+
+        # With the only slot taken the service turns requests away instead of queueing them
+        assert service._slots.acquire(blocking=False)
+        try:
+            urllib.request.urlopen(urllib.request.Request(base + "/convert", data=body))
+            assert False, "expected 429"
+        except urllib.error.HTTPError as e:
+            assert e.code == 429
+            assert e.headers['Retry-After']
+        finally:
+            service._slots.release()
+
+        # A negative length cannot slip past the size limit by reading to the end of the stream
+        import http.client
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+        connection.putrequest('POST', '/convert')
+        connection.putheader('Content-Length', '-1')
+        connection.endheaders()
+        connection.send(b'x' * 5000)
+        assert connection.getresponse().status == 400
+        connection.close()
+
+        with urllib.request.urlopen(base + "/metrics") as response:
+            metrics = json.load(response)
+        assert metrics['statuses'] == {'200': 1, '400': 1, '429': 1}
+        assert metrics['latency_ms']['p99'] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+def test_inline_runs_are_coalesced():
+    from docx_utils import ENGINES, _iter_url_parts
+
+    assert list(_iter_url_parts("no links here")) == [("no links here", None)]
+    assert list(_iter_url_parts("see https://example.com/a).")) == [
+        ("see ", None), ("https://example.com/a", "https://example.com/a"), (").", None)]
+
+    md_content = "line one\nline two https://example.com/a. AT&amp;T <span>inline</span> **bold** end"
+    for engine in ENGINES:
+        paragraph = convert_md_to_docx(md_content, engine=engine).paragraphs[0]
+        runs = paragraph._p.xpath('./w:r')
+        assert len(runs) == 4
+        assert len(paragraph._p.xpath('./w:hyperlink')) == 1
+        assert runs[1].text == ". AT&T inline "
+        assert paragraph.text == "line one\nline two https://example.com/a. AT&T inline bold end"
+
+def test_parsed_document_exports():
+    from docx_utils import ENGINES
+    from exporters import ParsedDocument
+
+    md_content = ("# Report\n\nSee [docs](https://example.com/docs) and https://example.com/raw.\n\n"
+                  "1. one\n2. two\n\n> quoted\n\n| A | B |\n|---|---|\n| 1 | x < y |\n\n```\ncode\n```\n")
+    for engine in ENGINES:
+        parsed = ParsedDocument(md_content, engine)
+        assert _body_xml(parsed.to_docx()) == _body_xml(convert_md_to_docx(md_content, engine=engine))
+        assert parsed.to_text() == (
+            "Report\n\nSee docs (https://example.com/docs) and https://example.com/raw.\n\n"
+            "1. one\n2. two\n\n> quoted\n\nA\tB\n1\tx < y\n\ncode\n")
+        page = parsed.to_html()
+        assert page.startswith("<!DOCTYPE html>") and "<title>Report</title>" in page
+        assert '<a href="https://example.com/raw">https://example.com/raw</a>' in page
+        assert "<td>x &lt; y</td>" in page
+
+    # An invalid start attribute numbers from 1 instead of failing the export
+    parsed = ParsedDocument('<ol start="x"><li>one</li></ol>\n')
+    assert parsed.to_text() == "1. one\n"
+    assert parsed.to_docx().paragraphs[0].text == "one"
+
+    # A session keeps only the tree of its latest text
+    from exporters import LatestParse
+    latest = LatestParse()
+    first = latest.get("# One\n")
+    assert latest.get("# One\n") is first
+    assert latest.get("# Two\n") is not first and latest.get("# Two\n").to_text() == "Two\n"
+
+def _fill_disk_cache(args):
+    from conversion_cache import DiskConversionCache
+
+    directory, worker = args
+    cache = DiskConversionCache(directory, max_bytes=10_000)
+    for index in range(20):
+        cache.put(f"{worker}-{index}", b"x" * 1000)
+    return worker
+
+def test_disk_cache(tmp_path, monkeypatch):
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from conversion_cache import ConversionCache, DiskConversionCache, make_cache_key, warm_cache
+
+    directory = str(tmp_path / "cache")
+    cache = DiskConversionCache(directory, max_bytes=3000, ttl=60)
+    cache.put("a", b"1" * 1000)
+    cache.put("b", b"2" * 1000)
+    assert cache.get("a") == b"1" * 1000
+    cache.put("c", b"3" * 1000)
+    cache.put("d", b"4" * 1000)  # over the cap: "b" is the least recently used
+    assert cache.get("b") is None and cache.get("a") is not None and len(cache) == 3
+
+    # Entries survive a restart but not their time to live
+    assert DiskConversionCache(directory, max_bytes=3000, ttl=60).get("c") == b"3" * 1000
+    monkeypatch.setattr(time, "time", lambda: 10**10)
+    assert DiskConversionCache(directory, max_bytes=3000, ttl=60).get("c") is None
+    monkeypatch.undo()
+
+    # Several processes writing at once keep the index consistent and capped
+    shared = str(tmp_path / "shared")
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        assert sorted(pool.map(_fill_disk_cache, [(shared, worker) for worker in range(3)])) == [0, 1, 2]
+    assert DiskConversionCache(shared, max_bytes=10_000).size <= 10_000
+
+    # A fresh in-memory cache is served from disk after a warm-up
+    source = tmp_path / "doc.md"
+    source.write_text("# Cached\n\nText", encoding="utf-8")
+    store = DiskConversionCache(str(tmp_path / "warm"))
+    assert warm_cache(store, [str(source)], workers=1) == (1, 0, 0)
+    assert warm_cache(store, [str(source)], workers=1) == (0, 1, 0)
+    data = ConversionCache(store=store).get_or_convert("# Cached\n\nText")
+    assert data == store.get(make_cache_key("# Cached\n\nText"))
+    assert store.hits >= 2
+
+    # The command line applies the limits the environment configures, not the defaults
+    from conversion_cache import main
+    configured = str(tmp_path / "configured")
+    filled = DiskConversionCache(configured, max_bytes=2**30)
+    filled.put("big", b"5" * 2 * 2**20)
+    filled.put("small", b"6" * 1000)
+    monkeypatch.setenv("MARKDOWN_VIEWER_CACHE_MB", "1")
+    monkeypatch.setenv("MARKDOWN_VIEWER_CACHE_TTL", "600")
+    assert main(["--cache-dir", configured, "evict"]) == 0 and len(DiskConversionCache(configured)) == 1
+    later = time.time() + 3600
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert main(["--cache-dir", configured, "evict"]) == 0
+    monkeypatch.undo()
+    assert len(DiskConversionCache(configured)) == 0
+
+def test_sectioned_preview_split():
+    from preview import page_bounds, previous_page_start, split_sections
+
+    md_content = ("Intro with [ref].\n\n# One\n\nText\n\n```\n# not a heading\n```\n\n"
+                  "Two\n---\n\n#### Deep\n\nMore\n\n[ref]: https://example.com\n")
+    sections = split_sections(md_content)
+    assert [(s.title, s.level) for s in sections] == [("Start", 0), ("One", 1), ("Two", 2)]
+    assert "# not a heading" in sections[1].text and "#### Deep" in sections[2].text
+    assert all(s.text.startswith("[ref]: https://example.com\n\n") for s in sections)
+
+    # Editing one section changes only its digest
+    edited = split_sections(md_content.replace("Text", "Changed"))
+    assert [a.digest == b.digest for a, b in zip(sections, edited)] == [True, False, True]
+
+    long_sections = split_sections("# Long\n\n" + "paragraph\n\n" * 100, max_chars=200)
+    assert long_sections[1].title == "Long (part 2)"
+    assert max(len(s.text) for s in long_sections) <= 200
+    end = page_bounds(long_sections, 0, page_chars=500)
+    assert 1 < end < len(long_sections)
+    assert previous_page_start(long_sections, end, page_chars=500) == 0
+
+def test_images_are_embedded(tmp_path, monkeypatch):
+    import base64
+    import io
+    import pytest
+    import image_utils
+
+    Image = pytest.importorskip("PIL.Image")
+
+    Image.new("RGB", (4000, 2000), "red").save(tmp_path / "wide.jpg")
+    Image.new("RGBA", (50, 40), (0, 0, 255, 128)).save(tmp_path / "icon.png")
+    buffer = io.BytesIO()
+    Image.new("RGB", (30, 30), "green").save(buffer, "PNG")
+    data_uri = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    md_content = (f"![wide](wide.jpg)\n\nTwice ![icon](icon.png) and ![icon](icon.png)\n\n"
+                  f"- inline ![dot]({data_uri})\n\n![gone](missing.png)\n")
+
+    doc = convert_md_to_docx(md_content, image_dir=str(tmp_path))
+    shapes = list(doc.inline_shapes)
+    assert len(shapes) == 4
+    section = doc.sections[-1]
+    assert shapes[0].width == section.page_width - section.left_margin - section.right_margin
+    assert shapes[0].height == shapes[0].width // 2
+    # The repeated icon is stored once and referenced twice
+    assert len(doc.part.package.image_parts) == 3
+    assert doc.paragraphs[-1].text == "gone"
+
+    # Without an image folder only data URIs are embedded
+    doc = convert_md_to_docx(md_content)
+    assert len(doc.inline_shapes) == 1 and doc.paragraphs[0].text == "wide"
+
+    # Images with more pixels than the budget are not decoded; their alt text stands in
+    monkeypatch.setattr(image_utils, "MAX_IMAGE_PIXELS", 1000)
+    Image.new("RGB", (50, 21), "yellow").save(tmp_path / "large.png")
+    assert image_utils.process_image((tmp_path / "large.png").read_bytes()) is None
+    doc = convert_md_to_docx("![too large](large.png)\n", image_dir=str(tmp_path))
+    assert not doc.inline_shapes and doc.paragraphs[0].text == "too large"
+
+def test_streaming_conversion(tmp_path):
+    import io
+    import zipfile
+    from docx_utils import convert_md_stream, iter_markdown_chunks, save_md_stream
+
+    md_content = ("# Stream\n\nSee [the docs][docs].\n\n```\nfenced\n\nstill code\n```\n\n"
+                  "| A | B |\n|---|---|\n| 1 | 2 |\n\n- one\n\n- two\n\n" + "Paragraph text.\n\n" * 20 +
+                  "[docs]: https://example.com/docs\n")
+    source = tmp_path / "doc.md"
+    source.write_text(md_content, encoding="utf-8")
+    chunks = list(iter_markdown_chunks(io.StringIO(md_content), chunk_chars=60))
+    assert len(chunks) > 5 and any("fenced\n\nstill code" in chunk for chunk in chunks)
+
+    # Void and self-closed HTML lines do not open a block that swallows the rest
+    for line in ("<br>", "<hr>", '<img src="x.png">', "<div/>"):
+        chunks = list(iter_markdown_chunks(io.StringIO(line + "\n\n" + "Paragraph text.\n\n" * 200),
+                                           chunk_chars=1000))
+        assert len(chunks) > 1 and max(len(chunk) for chunk in chunks) <= 1000
+
+    expected = convert_md_to_docx(md_content)
+    upload = io.BytesIO(md_content.encode("utf-8"))
+    for stream_source in (str(source), upload):
+        assert _body_xml(convert_md_stream(stream_source, chunk_chars=60)) == _body_xml(expected)
+    assert not upload.closed
+
+    # An indented first line is a paragraph, as in the whole text, though definitions precede the chunk
+    indented = "    indented\n\n[ref]: https://example.com/ref\n\n" + "Para [r][ref].\n\n" * 5
+    assert _body_xml(convert_md_stream(io.StringIO(indented), chunk_chars=30)) == \
+        _body_xml(convert_md_to_docx(indented))
+
+    output = io.BytesIO()
+    save_md_stream(str(source), output, chunk_chars=60)
+    with zipfile.ZipFile(output) as streamed, zipfile.ZipFile(io.BytesIO(get_docx_bytes(expected))) as full:
+        assert streamed.read("word/document.xml") == full.read("word/document.xml")
+
+def test_conversion_scheduler(monkeypatch):
+    import threading
+    import time
+    from scheduler import ConversionLimitExceeded, ConversionScheduler
+
+    scheduler = ConversionScheduler(max_concurrent=1, max_chars=1000, time_limit=None)
+    order = []
+    release = threading.Event()
+
+    def submit(session, name, wait=None):
+        def job(cancel_event):
+            order.append(name)
+            if wait is not None:
+                wait.wait(5)
+        thread = threading.Thread(target=scheduler.run, args=(session, job, 10))
+        thread.start()
+        return thread
+
+    threads = [submit('a', 'a1', release)]
+    while scheduler.running == 0:
+        time.sleep(0.01)
+    # Session a queues two more jobs before b queues one; b has used no time yet, so it goes first
+    for session, name in [('a', 'a2'), ('a', 'a3'), ('b', 'b1')]:
+        threads.append(submit(session, name))
+        while scheduler.queued < len(threads) - 1:
+            time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a1', 'b1', 'a2', 'a3']
+    assert scheduler.last_wait['b'] > 0 and scheduler.snapshot()['running'] == 0
+
+    # Only the sessions that converted most recently keep their last wait
+    import scheduler as scheduler_module
+    monkeypatch.setattr(scheduler_module, 'WAIT_SESSIONS', 2)
+    for session in ('c', 'a', 'd'):
+        scheduler.run(session, lambda cancel_event: None, 1)
+    assert list(scheduler.last_wait) == ['a', 'd']
+
+    try:
+        scheduler.run('a', lambda cancel_event: None, 1001)
+        assert False, "expected the size limit"
+    except ConversionLimitExceeded as e:
+        assert '1,000' in str(e)
+
+    # A conversion that overruns the time limit is cancelled between blocks
+    text = '\n\n'.join(f'Paragraph {i} with **bold** text.' for i in range(5000))
+    try:
+        scheduler.run('a', lambda cancel_event: convert_md_to_docx(text, cancel_event=cancel_event),
+                      None, time_limit=0.05)
+        assert False, "expected the time limit"
+    except ConversionLimitExceeded as e:
+        assert 'seconds' in str(e)
+
+def test_merge_export(tmp_path):
+    from docx.oxml.ns import qn
+    from merge_export import merge_markdown
+
+    (tmp_path / 'intro.md').write_text(
+        "# Intro\n\n[TOC]\n\nSee [setup](setup.md#install) and [below](#more).\n\n## More\n\nText.\n",
+        encoding='utf-8')
+    (tmp_path / 'setup.md').write_text(
+        "# Setup\n\n## Install\n\nBack to [the intro](intro.md).\n\n## Install\n\nAgain.\n\n"
+        "## Install 1\n\n## More\n", encoding='utf-8')
+    sources = [str(tmp_path / 'intro.md'), str(tmp_path / 'setup.md')]
+    doc = merge_markdown(sources, workers=0)
+    body = doc.element.body
+
+    bookmarks = body.xpath('.//w:bookmarkStart/@w:name')
+    # A heading that slugs like an earlier duplicate still gets its own name
+    assert bookmarks == ['_c0', '_c0_intro', '_c0_more', '_c1', '_c1_setup', '_c1_install', '_c1_install_1',
+                         '_c1_install_1_2', '_c1_more']
+    # The contents replace the [TOC] paragraph and link every heading
+    paragraphs = [p for p in body.iterchildren(qn('w:p'))]
+    texts = [''.join(p.xpath('.//w:t/text()')) for p in paragraphs]
+    assert '[TOC]' not in texts and texts[1] == 'Contents'
+    assert [p.xpath('string(.//w:hyperlink/@w:anchor)') for p in paragraphs[2:7]] == \
+        ['_c0_intro', '_c0_more', '_c1_setup', '_c1_install', '_c1_install_1']
+    # Links between and within chapters point at bookmarks, even before their target is written
+    assert body.xpath('.//w:p[not(w:pPr/w:pStyle)]/w:hyperlink/@w:anchor') == ['_c1_install', '_c0_more', '_c0']
+    assert len(body.xpath('./w:p/w:pPr/w:sectPr')) == 1
+
+    # Parsing in worker processes produces the same document
+    parallel = merge_markdown(sources, workers=2)
+    assert _body_xml(parallel) == _body_xml(doc)
+
+def test_markdown_converter():
+    import pytest
+    from docx_utils import MarkdownConverter, default_html_parser
+    from exporters import ParsedDocument
+
+    with open('sample.md', 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    reference = _body_xml(convert_md_to_docx(md_content, converter=MarkdownConverter(html_parser='html.parser')))
+    assert _body_xml(convert_md_to_docx(md_content, converter=MarkdownConverter(html_parser='lxml'))) == reference
+    assert default_html_parser() == 'lxml'
+    # Raw HTML blocks keep their text whichever parser rebuilds them
+    raw = "Before\n\n<div>inside a div</div>\n\n<div>\ninside a div\n</div>\n\nAfter\n"
+    hidden = "Intro\n\n<style>\n.a { color: red }\n</style>\n\n<script>run()</script>\n\nAfter"
+    for html_parser in ('html.parser', 'lxml'):
+        converter = MarkdownConverter(html_parser=html_parser)
+        # Text is trimmed as in any paragraph, without breaks for the newlines inside the tags
+        doc = convert_md_to_docx(raw, converter=converter)
+        assert [p.text for p in doc.paragraphs] == ['Before', 'inside a div', 'inside a div', 'After']
+        assert not doc.element.body.xpath('.//w:br')
+        # Elements that are never rendered stay out of the document and the text export
+        doc = convert_md_to_docx(hidden, converter=converter)
+        assert [p.text for p in doc.paragraphs] == ['Intro', 'After']
+    for engine in ('soup', 'etree'):
+        assert ParsedDocument(hidden, engine).to_text() == "Intro\n\nAfter\n"
+
+    # The instance is reset between documents and its extension set is its own
+    converter = MarkdownConverter(extensions=['fenced_code'])
+    table = "| a | b |\n|---|---|\n| 1 | 2 |\n"
+    assert '<table>' not in converter.to_html(table)
+    assert converter.markdown() is converter.markdown()
+    assert '<table>' in MarkdownConverter().to_html(table)
+    with pytest.raises(ValueError):
+        MarkdownConverter(html_parser='no-such-parser')
+
+    # Cache keys depend on a converter's settings, not on the instance
+    from conversion_cache import make_cache_key
+    key = make_cache_key(table, {'converter': MarkdownConverter(html_parser='lxml')})
+    assert make_cache_key(table, {'converter': MarkdownConverter(html_parser='lxml')}) == key
+    assert make_cache_key(table, {'converter': MarkdownConverter(html_parser='html.parser')}) != key
+    assert make_cache_key(table, {'converter': converter}) != key
+
+def test_nested_lists_and_quotes(monkeypatch):
+    from docx.oxml.ns import qn
+    from docx_utils import get_default_converter, new_document, _list_numbering
+    from benchmark import build_outline
+
+    md_content = (
+        "- one\n    - nested **bold** `code`\n        1. deep\n        2. deeper\n- two\n\n"
+        "    second paragraph\n\n"
+        "Text.\n\n"
+        "1. first\n2. second\n\n"
+        "Between.\n\n"
+        "3. third\n\n"
+        "> top [link](https://example.com)\n>\n> > inner\n>\n> - in quote\n"
+    )
+    for engine in ('soup', 'etree'):
+        doc = convert_md_to_docx(md_content, engine=engine)
+        rows = []
+        for p in doc.paragraphs:
+            num_pr = p._p.pPr.numPr if p._p.pPr is not None else None
+            rows.append((p.text, p.style.name, num_pr.ilvl.val if num_pr is not None else None,
+                         num_pr.numId.val if num_pr is not None else None, p.paragraph_format.left_indent))
+        texts = [row[0] for row in rows]
+        assert texts == ['one', 'nested bold code', 'deep', 'deeper', 'two', 'second paragraph', 'Text.',
+                         'first', 'second', 'Between.', 'third', 'top link', 'inner', 'in quote']
+        assert [row[2] for row in rows[:5]] == [0, 1, 2, 2, 0]
+        assert rows[5][1] == 'Normal' and rows[5][4].twips == 720
+        assert [row[1] for row in rows[11:13]] == ['Quote', 'Quote'] and rows[12][4].twips == 720
+        assert doc.paragraphs[11].hyperlinks
+        # Bullets share one definition; each numbered list restarts with its own w:num
+        bullets = {row[3] for row in rows if row[1] == 'List Bullet'}
+        numbered = [row[3] for row in rows if row[1] == 'List Number']
+        assert len(bullets) == 1 and len(set(numbered)) == 3
+        assert numbered[0] == numbered[1] and numbered[2] == numbered[3]
+
+    # An explicit start carries into the list's numbering
+    doc = convert_md_to_docx('<ol start="3"><li>third</li></ol>\n')
+    num_id = doc.paragraphs[0]._p.pPr.numPr.numId.val
+    num = doc.part.numbering_part.element.xpath(f'./w:num[@w:numId="{num_id}"]')[0]
+    assert num.xpath('string(.//w:startOverride/@w:val)') == '3'
+
+    # The definitions are added once per template and carried into every copy
+    fresh = new_document()
+    abstracts = len(fresh.part.numbering_part.element.findall(qn('w:abstractNum')))
+    numbering = _list_numbering(fresh.part)
+    large = build_outline(2000)
+    html = get_default_converter().to_html(large)
+    lists, ordered = html.count('<ul>') + html.count('<ol>'), html.count('<ol>')
+
+    # Emission stays linear: each list builds its properties and numbering
+    # once, and every item only copies them
+    import docx_utils
+    from collections import Counter
+    calls = Counter()
+
+    def counting(name):
+        original = getattr(docx_utils, name)
+
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return original(*args, **kwargs)
+        monkeypatch.setattr(docx_utils, name, wrapper)
+
+    for name in ('_add_list_item_paragraph', '_list_item_properties', '_numbering_element'):
+        counting(name)
+    doc = convert_md_to_docx(large)
+    assert calls == {'_add_list_item_paragraph': 2000, '_list_item_properties': lists, '_numbering_element': ordered}
+    assert len(doc.part.numbering_part.element.findall(qn('w:abstractNum'))) == abstracts
+    assert len(doc.part.numbering_part.element.findall(qn('w:num'))) == \
+        len(fresh.part.numbering_part.element.findall(qn('w:num'))) + ordered
+    assert len(doc.paragraphs) == 2000
+    assert numbering.bullet_num in {p._p.pPr.numPr.numId.val for p in doc.paragraphs}
+    assert {p._p.pPr.numPr.ilvl.val for p in doc.paragraphs} == set(range(6))
+
 if __name__ == "__main__":
     test_conversion()